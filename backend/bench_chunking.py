@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Benchmark du découpage en chunks : ancien chunk_text (fenêtres de 2000 caractères,
+recouvrement de 200) contre TokenChunker (budget en tokens, coupe aux fins de
+phrase et de paragraphe, chunks stockés en positions dans le texte du document)
+
+Mesure le débit, la régularité de la taille des chunks en tokens et le volume
+stocké dans document_chunks (texte recopié contre deux entiers par chunk).
+Les textes sont synthétiques, ou lus depuis des fichiers .txt/.pdf.
+
+Usage: python bench_chunking.py [--sizes 100000 1000000 10000000] [--files doc.pdf notes.txt] [--repeat 3]
+"""
+import sys
+import os
+import argparse
+import random
+import statistics
+import time
+
+# Ajouter le répertoire parent au PATH pour les imports
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from file_loader import chunk_text, iter_token_chunks, pdf_text, CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS
+from tokenizer import count_tokens
+
+WORDS = ("le la les des une un contrat client facture projet budget équipe réunion livraison délai "
+         "article annexe montant paiement mois année service produit qualité conformément selon").split()
+
+def synthetic_text(rng: random.Random, size: int) -> str:
+    """Paragraphes de phrases de longueur variable, avec des retours à la ligne comme dans un PDF"""
+    parts, length = [], 0
+    while length < size:
+        sentence = " ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 40))).capitalize()
+        sentence += rng.choice([". ", ". ", "? ", ".\n", ".\n\n"])
+        parts.append(sentence)
+        length += len(sentence)
+    return "".join(parts)[:size]
+
+def load_text(path: str) -> str:
+    with open(path, "rb") as f:
+        data = f.read()
+    return pdf_text(data) if path.endswith(".pdf") else data.decode("utf-8", errors="replace")
+
+def best_time(fn, repeat):
+    best, result = None, None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def describe(name, text, elapsed, chunks, stored_bytes):
+    tokens = [count_tokens(chunk) for chunk in chunks] or [0]
+    print(f"  {name:<8} | {len(text) / elapsed / 1e6:8.2f} | {len(chunks):>7} | {statistics.mean(tokens):7.0f} "
+          f"| {min(tokens):>5}-{max(tokens):<5} | {statistics.pstdev(tokens):6.1f} | {stored_bytes / 1e3:9.1f}")
+
+def run(label, text, repeat):
+    print(f"\n{label} ({len(text)} caractères)")
+    print(f"  {'':<8} | {'Mcar/s':>8} | {'chunks':>7} | {'tokens':>7} | {'min-max':^11} | {'écart':>6} | {'stocké Ko':>9}")
+
+    elapsed, chunks = best_time(lambda: chunk_text(text), repeat)
+    describe("ancien", text, elapsed, chunks, sum(len(chunk.encode("utf-8")) for chunk in chunks))
+
+    # Le texte est fourni par pages de 3000 caractères, comme pendant l'ingestion d'un PDF
+    pages = [text[i:i + 3000] for i in range(0, len(text), 3000)]
+    elapsed, spans = best_time(lambda: list(iter_token_chunks(pages)), repeat)
+    describe("tokens", text, elapsed, [chunk for _, _, chunk in spans], 8 * len(spans))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark du découpage en chunks")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100000, 1000000, 10000000])
+    parser.add_argument("--files", nargs="*", default=[])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"TokenChunker: {CHUNK_MAX_TOKENS} tokens par chunk au plus, recouvrement {CHUNK_OVERLAP_TOKENS}")
+    rng = random.Random(42)
+    for size in args.sizes:
+        run("Texte synthétique", synthetic_text(rng, size), args.repeat)
+    for path in args.files:
+        run(os.path.basename(path), load_text(path), args.repeat)
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Test de charge de bout en bout de l'API : utilisateurs virtuels qui se
+connectent, uploadent, listent leurs documents et posent des questions
+
+Chaque utilisateur s'inscrit, se connecte, uploade --docs-per-user documents
+synthétiques, puis enchaîne jusqu'à la fin de --duration des actions tirées
+selon --mix (poids par action). Rapporte par endpoint le nombre de requêtes,
+le débit, le taux d'erreur et les latences p50/p95/p99 ; le résultat est
+enregistré en JSON (avec les compteurs /cache/stats et /openai/stats de l'API)
+pour comparer les exécutions (--compare).
+
+À lancer contre le serveur OpenAI simulé pour ne consommer aucun crédit :
+  python fake_openai_server.py --latency-ms 300 --rate-429 0.01 &
+  OPENAI_BASE_URL=http://localhost:8100/v1 OPENAI_API_KEY=fake uvicorn main:app --port 8000 &
+  python bench_load.py --api http://localhost:8000 --users 20 --duration 60
+
+Usage: python bench_load.py [--api URL] [--users 20] [--duration 60] [--mix ask=60,ask_stream=10,list=15,upload=10,login=5]
+                            [--docs-per-user 2] [--think-ms 500] [--output fichier.json] [--compare précédent.json]
+"""
+import sys
+import os
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime
+
+import httpx
+import numpy as np
+
+# Ajouter le répertoire parent au PATH pour les imports
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from bench_chunking import synthetic_text, WORDS
+
+QUESTIONS = [
+    "Quel est le montant du budget {} ?",
+    "Quels sont les délais de livraison pour le {} ?",
+    "Que dit l'article sur le {} ?",
+    "Fais un résumé de mes documents",
+    "Quelles sont les conditions de paiement du {} ?",
+    "Qui est responsable du {} dans l'équipe ?"
+]
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+
+    def record(self, endpoint: str, elapsed: float, status):
+        self.latencies[endpoint].append(elapsed)
+        self.statuses[endpoint][str(status)] += 1
+        if not (isinstance(status, int) and status < 400):
+            self.errors[endpoint] += 1
+
+    async def timed(self, endpoint: str, request):
+        """Run the request coroutine, recording its latency and status; returns the response or None"""
+        started = time.perf_counter()
+        try:
+            response = await request
+        except Exception as e:
+            self.record(endpoint, time.perf_counter() - started, type(e).__name__)
+            return None
+        self.record(endpoint, time.perf_counter() - started, response.status_code)
+        return response
+
+    def summary(self, elapsed: float) -> dict:
+        endpoints = {}
+        for endpoint, latencies in sorted(self.latencies.items()):
+            ms = np.array(latencies) * 1000
+            endpoints[endpoint] = {
+                "requests": len(latencies),
+                "errors": self.errors[endpoint],
+                "error_rate": round(self.errors[endpoint] / len(latencies), 4),
+                "throughput_rps": round(len(latencies) / elapsed, 2),
+                "p50_ms": round(float(np.percentile(ms, 50)), 1),
+                "p95_ms": round(float(np.percentile(ms, 95)), 1),
+                "p99_ms": round(float(np.percentile(ms, 99)), 1),
+                "mean_ms": round(float(ms.mean()), 1),
+                "max_ms": round(float(ms.max()), 1),
+                "statuses": dict(self.statuses[endpoint])
+            }
+        total = sum(len(latencies) for latencies in self.latencies.values())
+        errors = sum(self.errors.values())
+        return {
+            "endpoints": endpoints,
+            "total": {
+                "requests": total,
+                "errors": errors,
+                "error_rate": round(errors / total, 4) if total else 0.0,
+                "throughput_rps": round(total / elapsed, 2)
+            }
+        }
+
+def parse_mix(value: str) -> dict:
+    mix = {}
+    for part in value.split(","):
+        name, weight = part.split("=")
+        mix[name.strip()] = float(weight)
+    unknown = set(mix) - set(ACTIONS)
+    if unknown:
+        raise argparse.ArgumentTypeError(f"Actions inconnues : {', '.join(sorted(unknown))} (possibles : {', '.join(ACTIONS)})")
+    return mix
+
+class VirtualUser:
+    def __init__(self, client: httpx.AsyncClient, recorder: Recorder, rng: random.Random, run_id: str, number: int, doc_chars: int):
+        self.client = client
+        self.recorder = recorder
+        self.rng = rng
+        self.username = f"load-{run_id}-{number}"
+        self.password = "load-test-password"
+        self.doc_chars = doc_chars
+        self.headers = {}
+        self.uploads = 0
+
+    async def register(self) -> bool:
+        response = await self.recorder.timed("register", self.client.post("/register", json={
+            "username": self.username, "email": f"{self.username}@example.com", "password": self.password
+        }))
+        return response is not None and response.status_code < 400
+
+    async def login(self):
+        response = await self.recorder.timed("login", self.client.post("/login", json={
+            "username": self.username, "password": self.password
+        }))
+        if response is not None and response.status_code < 400:
+            self.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    async def upload(self):
+        self.uploads += 1
+        text = synthetic_text(self.rng, self.rng.randint(self.doc_chars // 2, self.doc_chars))
+        files = {"file": (f"{self.username}-{self.uploads}.txt", text.encode("utf-8"), "text/plain")}
+        await self.recorder.timed("upload", self.client.post("/upload", files=files, headers=self.headers))
+
+    async def list_documents(self):
+        await self.recorder.timed("list", self.client.get("/user/documents", headers=self.headers))
+
+    def question(self) -> str:
+        return self.rng.choice(QUESTIONS).format(self.rng.choice(WORDS))
+
+    async def ask(self):
+        await self.recorder.timed("ask", self.client.post("/ask", json={"question": self.question()}, headers=self.headers))
+
+    async def ask_stream(self):
+        """Latency until the last event of the stream"""
+        async def streamed():
+            async with self.client.stream("POST", "/ask/stream", json={"question": self.question()}, headers=self.headers) as response:
+                async for _ in response.aiter_lines():
+                    pass
+                return response
+        await self.recorder.timed("ask_stream", streamed())
+
+ACTIONS = {
+    "ask": VirtualUser.ask,
+    "ask_stream": VirtualUser.ask_stream,
+    "list": VirtualUser.list_documents,
+    "upload": VirtualUser.upload,
+    "login": VirtualUser.login
+}
+
+async def run_user(user: VirtualUser, mix: dict, deadline: float, docs_per_user: int, think_ms: float):
+    if not await user.register():
+        return
+    await user.login()
+    for _ in range(docs_per_user):
+        await user.upload()
+    names, weights = list(mix), list(mix.values())
+    while time.monotonic() < deadline:
+        await ACTIONS[user.rng.choices(names, weights)[0]](user)
+        if think_ms:
+            await asyncio.sleep(user.rng.expovariate(1000 / think_ms))
+
+async def api_stats(client: httpx.AsyncClient) -> dict:
+    stats = {}
+    for path in ("/cache/stats", "/openai/stats"):
+        try:
+            response = await client.get(path)
+            stats[path] = response.json()
+        except Exception as e:
+            stats[path] = {"error": str(e)}
+    return stats
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except Exception:
+        return ""
+
+async def run(args) -> dict:
+    run_id = uuid.uuid4().hex[:8]
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=args.users * 2, max_keepalive_connections=args.users * 2)
+    async with httpx.AsyncClient(base_url=args.api, timeout=args.timeout, limits=limits) as client:
+        started = time.monotonic()
+        deadline = started + args.duration
+        users = [VirtualUser(client, recorder, random.Random(args.seed + i), run_id, i, args.doc_chars) for i in range(args.users)]
+        await asyncio.gather(*(run_user(user, args.mix, deadline, args.docs_per_user, args.think_ms) for user in users))
+        elapsed = time.monotonic() - started
+        stats = await api_stats(client)
+
+    return {
+        "run_id": run_id,
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "config": {
+            "api": args.api, "users": args.users, "duration_s": args.duration, "mix": args.mix,
+            "docs_per_user": args.docs_per_user, "doc_chars": args.doc_chars, "think_ms": args.think_ms, "seed": args.seed
+        },
+        "elapsed_s": round(elapsed, 2),
+        **recorder.summary(elapsed),
+        "api_stats": stats
+    }
+
+def print_report(result: dict):
+    print(f"\n{result['config']['users']} utilisateurs, {result['elapsed_s']} s (commit {result['commit'] or '?'})")
+    print(f"{'endpoint':<11} | {'requêtes':>8} | {'req/s':>7} | {'erreurs':>7} | {'p50 ms':>8} | {'p95 ms':>8} | {'p99 ms':>8}")
+    print("-" * 78)
+    for endpoint, s in result["endpoints"].items():
+        print(f"{endpoint:<11} | {s['requests']:>8} | {s['throughput_rps']:>7.2f} | {s['error_rate']:>6.1%} "
+              f"| {s['p50_ms']:>8.1f} | {s['p95_ms']:>8.1f} | {s['p99_ms']:>8.1f}")
+    total = result["total"]
+    print(f"{'total':<11} | {total['requests']:>8} | {total['throughput_rps']:>7.2f} | {total['error_rate']:>6.1%} |")
+
+def print_comparison(previous: dict, result: dict):
+    """Relative change of latency and throughput against a previous run, per endpoint"""
+    print(f"\nComparaison avec {previous.get('run_id')} (commit {previous.get('commit') or '?'})")
+    print(f"{'endpoint':<11} | {'req/s':>8} | {'p50':>8} | {'p95':>8} | {'p99':>8}")
+    print("-" * 54)
+
+    def change(before, after):
+        return f"{(after - before) / before:+.0%}" if before else "n/a"
+
+    for endpoint, s in result["endpoints"].items():
+        before = previous.get("endpoints", {}).get(endpoint)
+        if before is None:
+            continue
+        print(f"{endpoint:<11} | {change(before['throughput_rps'], s['throughput_rps']):>8} | {change(before['p50_ms'], s['p50_ms']):>8} "
+              f"| {change(before['p95_ms'], s['p95_ms']):>8} | {change(before['p99_ms'], s['p99_ms']):>8}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Test de charge de l'API")
+    parser.add_argument("--api", default="http://localhost:8000")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=60, help="Secondes d'actions après l'inscription et les premiers uploads")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("ask=60,ask_stream=10,list=15,upload=10,login=5"))
+    parser.add_argument("--docs-per-user", type=int, default=2)
+    parser.add_argument("--doc-chars", type=int, default=40000)
+    parser.add_argument("--think-ms", type=float, default=500, help="Pause moyenne entre deux actions d'un utilisateur")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Fichier JSON du résultat (défaut : bench_results/load_<date>.json)")
+    parser.add_argument("--compare", help="Résultat JSON d'une exécution précédente")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print_report(result)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print_comparison(json.load(f), result)
+
+    output = args.output or os.path.join("bench_results", f"load_{datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    print(f"\nRésultat enregistré dans {output}")
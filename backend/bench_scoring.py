@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Benchmark du scoring de similarité : ancienne boucle Python (json.loads + cosinus
+par chunk) contre le moteur matriciel normalisé de vector_store (et HNSW)
+
+Usage: python bench_scoring.py [--sizes 1000 10000 100000] [--queries 20]
+"""
+import sys
+import os
+import argparse
+import json
+import time
+
+import numpy as np
+
+# Ajouter le répertoire parent au PATH pour les imports
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from vector_store import FlatTenantIndex, HNSWTenantIndex, dimension
+
+def legacy_cosine_similarity(vec1, vec2):
+    """Ancien rag_engine.cosine_similarity, recopié pour comparaison"""
+    vec1 = np.array(vec1)
+    vec2 = np.array(vec2)
+    
+    dot_product = np.dot(vec1, vec2)
+    norm_vec1 = np.linalg.norm(vec1)
+    norm_vec2 = np.linalg.norm(vec2)
+    
+    if norm_vec1 == 0 or norm_vec2 == 0:
+        return 0
+    
+    return dot_product / (norm_vec1 * norm_vec2)
+
+def legacy_search(query, stored_json, top_k):
+    """Ancienne boucle de search_similar_texts_for_user"""
+    similarities = []
+    for chunk_id, embedding in stored_json:
+        similarities.append((legacy_cosine_similarity(query, json.loads(embedding)), chunk_id))
+    similarities.sort(reverse=True)
+    return [chunk_id for _, chunk_id in similarities[:top_k]]
+
+def synthetic_embeddings(rng, n, chunks_per_topic=50):
+    """Vecteurs groupés autour de thèmes, comme les chunks d'un même document.
+
+    Des gaussiennes isotropes seraient le pire cas pour HNSW et ne ressemblent
+    pas à de vrais embeddings.
+    """
+    topics = rng.standard_normal((max(1, n // chunks_per_topic), dimension), dtype="float32")
+    return topics[rng.integers(0, len(topics), n)] + 0.8 * rng.standard_normal((n, dimension), dtype="float32")
+
+def build_index(index_class, vectors):
+    index = index_class(user_id=0, agent_id=None, model="bench")
+    ids = list(range(1, len(vectors) + 1))
+    for start in range(0, len(vectors), 10000):
+        index.add(ids[start:start + 10000], [1] * len(ids[start:start + 10000]), vectors[start:start + 10000])
+    return index
+
+def time_per_query(fn, queries):
+    started = time.perf_counter()
+    results = [fn(q) for q in queries]
+    return (time.perf_counter() - started) / len(queries) * 1000, results
+
+def run(sizes, n_queries, top_k, legacy_limit):
+    rng = np.random.default_rng(42)
+    print(f"{'chunks':>8} | {'boucle (ms)':>12} | {'flat (ms)':>10} | {'hnsw (ms)':>10} | {'flat vs boucle':>14} | {'rappel hnsw':>11}")
+    print("-" * 80)
+    
+    for size in sizes:
+        vectors = synthetic_embeddings(rng, size + n_queries)
+        vectors, queries = vectors[:size], vectors[size:]
+        vectors[::50] = 0  # embeddings factices [0.0]*1536, exclus de l'index
+        normalized = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+        
+        flat = build_index(FlatTenantIndex, vectors)
+        flat_ms, flat_results = time_per_query(lambda q: [cid for cid, _ in flat.search(q, top_k)], normalized)
+        
+        hnsw = build_index(HNSWTenantIndex, vectors)
+        hnsw_ms, hnsw_results = time_per_query(lambda q: [cid for cid, _ in hnsw.search(q, top_k)], normalized)
+        recall = np.mean([len(set(a) & set(b)) / top_k for a, b in zip(flat_results, hnsw_results)])
+        
+        if size <= legacy_limit:
+            stored_json = [(i + 1, json.dumps(v.tolist())) for i, v in enumerate(vectors)]
+            legacy_queries = queries[:max(1, n_queries // 10)].tolist()
+            legacy_ms, legacy_results = time_per_query(lambda q: legacy_search(q, stored_json, top_k), legacy_queries)
+            assert all(a == b for a, b in zip(legacy_results, flat_results)), "Résultats différents de la boucle"
+            legacy_cell = f"{legacy_ms:12.1f}"
+            speedup = f"{legacy_ms / flat_ms:13.0f}x"
+        else:
+            legacy_cell = f"{'(ignoré)':>12}"
+            speedup = f"{'-':>14}"
+        
+        print(f"{size:>8} | {legacy_cell} | {flat_ms:10.2f} | {hnsw_ms:10.2f} | {speedup} | {recall:11.3f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark du scoring de similarité")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--top-k", type=int, default=8)
+    parser.add_argument("--legacy-limit", type=int, default=100000,
+                        help="Taille maximale pour laquelle la boucle historique est mesurée")
+    args = parser.parse_args()
+    
+    run(args.sizes, args.queries, args.top_k, args.legacy_limit)
@@ -0,0 +1,113 @@
+# Stockage des fichiers uploadés, adressé par contenu (sha256)
+import hashlib
+import logging
+import os
+import tempfile
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Production (Cloud Run, GOOGLE_CLOUD_PROJECT set) defaults to GCS: the local disk of an instance is lost on restart
+PRODUCTION = bool(os.getenv("GOOGLE_CLOUD_PROJECT"))
+BLOB_STORE_BACKEND = os.getenv("BLOB_STORE_BACKEND", "gcs" if PRODUCTION else "local")  # local | gcs
+BLOB_STORE_DIR = os.getenv("BLOB_STORE_DIR")  # Required for the local backend in production (persistent volume)
+BLOB_STORE_BUCKET = os.getenv("BLOB_STORE_BUCKET")
+BLOB_STORE_PREFIX = os.getenv("BLOB_STORE_PREFIX", "documents/")
+
+def blob_key(data: bytes) -> str:
+    """Content address of a file: identical uploads share one blob"""
+    return hashlib.sha256(data).hexdigest()
+
+class BlobStore:
+    """Raw upload storage; subclasses implement _put/get/delete/exists"""
+
+    def put(self, data: bytes) -> str:
+        key = blob_key(data)
+        if not self.exists(key):
+            self._put(key, data)
+        return key
+
+    def _put(self, key: str, data: bytes):
+        raise NotImplementedError
+
+    def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+class LocalBlobStore(BlobStore):
+    """Blobs as files under root/ab/abcdef..., written atomically"""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    def _put(self, key: str, data: bytes):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def delete(self, key: str):
+        try:
+            os.unlink(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+class GCSBlobStore(BlobStore):
+    """Blobs as objects of a Google Cloud Storage bucket (requires google-cloud-storage)"""
+
+    def __init__(self, bucket_name: str, prefix: str):
+        from google.cloud import storage
+        self.bucket = storage.Client().bucket(bucket_name)
+        self.prefix = prefix
+
+    def _blob(self, key: str):
+        return self.bucket.blob(self.prefix + key)
+
+    def _put(self, key: str, data: bytes):
+        self._blob(key).upload_from_string(data)
+
+    def get(self, key: str) -> Optional[bytes]:
+        blob = self._blob(key)
+        return blob.download_as_bytes() if blob.exists() else None
+
+    def delete(self, key: str):
+        blob = self._blob(key)
+        if blob.exists():
+            blob.delete()
+
+    def exists(self, key: str) -> bool:
+        return self._blob(key).exists()
+
+def create_blob_store() -> BlobStore:
+    if BLOB_STORE_BACKEND == "gcs":
+        if not BLOB_STORE_BUCKET:
+            raise ValueError("BLOB_STORE_BUCKET is required with BLOB_STORE_BACKEND=gcs")
+        return GCSBlobStore(BLOB_STORE_BUCKET, BLOB_STORE_PREFIX)
+    if BLOB_STORE_BACKEND != "local":
+        raise ValueError(f"Unknown BLOB_STORE_BACKEND: {BLOB_STORE_BACKEND}")
+    if BLOB_STORE_DIR is None and PRODUCTION:
+        raise ValueError("BLOB_STORE_DIR must point to persistent storage with BLOB_STORE_BACKEND=local in production "
+                         "(or use BLOB_STORE_BACKEND=gcs with BLOB_STORE_BUCKET)")
+    return LocalBlobStore(BLOB_STORE_DIR or "/tmp/document_blobs")
+
+blob_store = create_blob_store()
@@ -0,0 +1,279 @@
+# Ingestion en masse (plusieurs fichiers ou archive ZIP) traitée en tâche de fond, suivie par job
+import asyncio
+import logging
+import os
+import tempfile
+import uuid
+import zipfile
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import BinaryIO, Callable, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, Document, IngestJob, IngestJobFile
+from extractors import is_supported, SUPPORTED_EXTENSIONS, ExtractionError
+from rag_engine import process_document_for_user
+from utils import event_tracker
+
+logger = logging.getLogger(__name__)
+
+# Files of a job ingested at once; extraction and embedding have their own global limits
+# (EXTRACT_WORKERS, INGEST_EMBEDDING_CONCURRENCY)
+BULK_INGEST_CONCURRENCY = int(os.getenv("BULK_INGEST_CONCURRENCY", "4"))
+BULK_UPLOAD_MAX_FILES = int(os.getenv("BULK_UPLOAD_MAX_FILES", "500"))
+BULK_UPLOAD_MAX_BYTES = int(os.getenv("BULK_UPLOAD_MAX_BYTES", str(200 * 1024 * 1024)))  # Uncompressed
+MAX_FILE_BYTES = 10 * 1024 * 1024  # Same limit as /upload
+# Uploaded parts are copied to temporary files, kept in memory up to this size
+SPOOL_MEMORY_BYTES = 1024 * 1024
+UPLOAD_READ_BYTES = 1024 * 1024
+# A running job refreshes its updated_at this often; one silent for JOB_STALE_SECONDS was interrupted
+JOB_HEARTBEAT_SECONDS = 30
+JOB_STALE_SECONDS = int(os.getenv("BULK_INGEST_JOB_STALE_SECONDS", "120"))
+
+_running_jobs: Set[asyncio.Task] = set()
+
+@dataclass
+class BulkItem:
+    """One file of a bulk upload; ZIP members are read only when their turn comes"""
+    filename: str
+    size: int
+    load: Optional[Callable[[], bytes]] = None
+    error: Optional[str] = None
+
+async def spool_uploads(files) -> List[Tuple[str, BinaryIO]]:
+    """Copy the parts of a bulk upload (UploadFile) to temporary files, which outlive the request.
+
+    Raises ValueError as soon as more than BULK_UPLOAD_MAX_BYTES have been received.
+    """
+    uploads, received = [], 0
+    try:
+        for file in files:
+            spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_BYTES)
+            uploads.append((file.filename, spool))
+            while True:
+                block = await file.read(UPLOAD_READ_BYTES)
+                if not block:
+                    break
+                received += len(block)
+                if received > BULK_UPLOAD_MAX_BYTES:
+                    raise ValueError(f"Upload too large (max {BULK_UPLOAD_MAX_BYTES // (1024 * 1024)}MB)")
+                await asyncio.to_thread(spool.write, block)
+            spool.seek(0)
+    except BaseException:
+        close_uploads(uploads)
+        raise
+    return uploads
+
+def close_uploads(uploads: List[Tuple[str, BinaryIO]]):
+    """Delete the temporary files of a bulk upload"""
+    for _, spool in uploads:
+        spool.close()
+
+def _read_file(spool: BinaryIO) -> bytes:
+    spool.seek(0)
+    return spool.read()
+
+def _zip_items(archive_name: str, spool: BinaryIO) -> List[BulkItem]:
+    items = []
+    # Stays open for the job: members are read from the temporary file when their turn comes
+    # (ZipFile serializes the reads of concurrent members on the shared file)
+    archive = zipfile.ZipFile(spool)
+    for info in archive.infolist():
+        name = os.path.basename(info.filename)
+        if info.is_dir() or not name or name.startswith(".") or info.filename.startswith("__MACOSX/"):
+            continue
+        # The path in the archive is the document name: q1/report.pdf and q2/report.pdf
+        # are two documents, not two versions of one
+        path = info.filename.lstrip("/")
+        if path.startswith("./"):
+            path = path[2:]
+
+        def load(member=info.filename) -> bytes:
+            return archive.read(member)
+
+        items.append(BulkItem(path, info.file_size, load,
+                              error="File path too long (max 255 characters)" if len(path) > 255 else None))
+    logger.info(f"ZIP archive {archive_name}: {len(items)} files")
+    return items
+
+def expand_uploads(uploads: List[Tuple[str, BinaryIO]]) -> List[BulkItem]:
+    """Files and ZIP members of a bulk upload (see spool_uploads), with the reason each rejected one is skipped.
+
+    Raises ValueError when the upload as a whole exceeds the file count or
+    uncompressed size limits, read from the ZIP directories without extracting.
+    """
+    items = []
+    for filename, spool in uploads:
+        size = spool.seek(0, os.SEEK_END)
+        spool.seek(0)
+        if filename.lower().endswith(".zip"):
+            try:
+                items.extend(_zip_items(filename, spool))
+            except zipfile.BadZipFile:
+                items.append(BulkItem(filename, size, error="Invalid ZIP archive"))
+        else:
+            items.append(BulkItem(filename, size, lambda spool=spool: _read_file(spool)))
+
+    if len(items) > BULK_UPLOAD_MAX_FILES:
+        raise ValueError(f"Too many files ({len(items)}, max {BULK_UPLOAD_MAX_FILES})")
+    if sum(item.size for item in items) > BULK_UPLOAD_MAX_BYTES:
+        raise ValueError(f"Upload too large (max {BULK_UPLOAD_MAX_BYTES // (1024 * 1024)}MB uncompressed)")
+
+    for item in items:
+        if item.error:
+            continue
+        if not is_supported(item.filename):
+            item.error = f"File type not supported ({', '.join(SUPPORTED_EXTENSIONS)})"
+        elif item.size > MAX_FILE_BYTES:
+            item.error = "File too large (max 10MB)"
+    return items
+
+def create_job(db: Session, user_id: int, agent_id: Optional[int], items: List[BulkItem]) -> IngestJob:
+    job = IngestJob(id=uuid.uuid4().hex, user_id=user_id, agent_id=agent_id, status="queued")
+    job.files = [
+        IngestJobFile(filename=item.filename[:255], size_bytes=item.size,
+                      status="skipped" if item.error else "queued", error=item.error)
+        for item in items
+    ]
+    db.add(job)
+    db.commit()
+    return job
+
+def _update_file(file_id: int, **values):
+    db = SessionLocal()
+    try:
+        db.query(IngestJobFile).filter(IngestJobFile.id == file_id).update(values)
+        db.commit()
+    finally:
+        db.close()
+
+def _update_job(job_id: str, status: str):
+    db = SessionLocal()
+    try:
+        db.query(IngestJob).filter(IngestJob.id == job_id).update({"status": status, "updated_at": datetime.utcnow()})
+        db.commit()
+    finally:
+        db.close()
+
+async def _heartbeat(job_id: str):
+    """Keep the job's updated_at fresh while it runs, so fail_interrupted_jobs leaves it alone"""
+    while True:
+        await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+        await asyncio.to_thread(_update_job, job_id, "running")
+
+def fail_interrupted_jobs() -> int:
+    """Mark failed the jobs left queued or running by a stopped process (no heartbeat for JOB_STALE_SECONDS)"""
+    db = SessionLocal()
+    try:
+        stale = datetime.utcnow() - timedelta(seconds=JOB_STALE_SECONDS)
+        job_ids = [job_id for (job_id,) in db.query(IngestJob.id).filter(
+            IngestJob.status.in_(("queued", "running")),
+            IngestJob.updated_at < stale
+        )]
+        if not job_ids:
+            return 0
+        db.query(IngestJobFile).filter(
+            IngestJobFile.job_id.in_(job_ids),
+            IngestJobFile.status.in_(("queued", "processing"))
+        ).update({"status": "failed", "error": "Interrupted by a server restart, upload the file again"},
+                 synchronize_session=False)
+        db.query(IngestJob).filter(IngestJob.id.in_(job_ids)).update(
+            {"status": "failed", "updated_at": datetime.utcnow()}, synchronize_session=False
+        )
+        db.commit()
+        logger.warning(f"Marked {len(job_ids)} interrupted bulk ingestion jobs as failed")
+        return len(job_ids)
+    finally:
+        db.close()
+
+async def watch_interrupted_jobs():
+    """Fail interrupted jobs at startup, then periodically (jobs of an instance that stopped meanwhile)"""
+    while True:
+        try:
+            await asyncio.to_thread(fail_interrupted_jobs)
+        except Exception as e:
+            logger.error(f"Could not check for interrupted bulk ingestion jobs: {e}")
+        await asyncio.sleep(JOB_STALE_SECONDS)
+
+def _chunk_count(db: Session, document_id: int) -> Optional[int]:
+    return db.query(Document.chunk_count).filter(Document.id == document_id).scalar()
+
+async def _ingest_file(file_id: int, item: BulkItem, user_id: int, agent_id: Optional[int], slots: asyncio.Semaphore):
+    async with slots:
+        await asyncio.to_thread(_update_file, file_id, status="processing")
+        db = SessionLocal()
+        try:
+            content = await asyncio.to_thread(item.load)
+            document_id = await process_document_for_user(item.filename, content, user_id, db, agent_id)
+            chunk_count = await asyncio.to_thread(_chunk_count, db, document_id)
+            await asyncio.to_thread(_update_file, file_id, status="done", document_id=document_id, chunk_count=chunk_count)
+            event_tracker.track_document_upload(user_id, item.filename, len(content))
+        except Exception as e:
+            logger.error(f"Bulk ingestion of {item.filename} failed: {e}")
+            # A corrupt file or one without text is reported apart from processing errors
+            status = "unreadable" if isinstance(e, ExtractionError) else "failed"
+            await asyncio.to_thread(_update_file, file_id, status=status, error=str(e)[:1000])
+        finally:
+            db.close()
+
+async def _ingest_in_order(files: List[Tuple[int, BulkItem]], user_id: int, agent_id: Optional[int], slots: asyncio.Semaphore):
+    """Files of the same name are successive versions of one document, ingested one after the other"""
+    for file_id, item in files:
+        await _ingest_file(file_id, item, user_id, agent_id, slots)
+
+async def run_job(job_id: str, file_ids: List[int], items: List[BulkItem], user_id: int, agent_id: Optional[int],
+                  uploads: List[Tuple[str, BinaryIO]]):
+    """Ingest the files of a job, BULK_INGEST_CONCURRENCY at a time"""
+    heartbeat = None
+    try:
+        await asyncio.to_thread(_update_job, job_id, "running")
+        heartbeat = asyncio.create_task(_heartbeat(job_id))
+        slots = asyncio.Semaphore(BULK_INGEST_CONCURRENCY)
+        by_name: Dict[str, List[Tuple[int, BulkItem]]] = {}
+        for file_id, item in zip(file_ids, items):
+            if not item.error:
+                by_name.setdefault(item.filename, []).append((file_id, item))
+        await asyncio.gather(*(_ingest_in_order(files, user_id, agent_id, slots) for files in by_name.values()))
+        await asyncio.to_thread(_update_job, job_id, "done")
+        logger.info(f"Bulk ingestion job {job_id} finished ({len(items)} files)")
+    except Exception as e:
+        logger.error(f"Bulk ingestion job {job_id} failed: {e}")
+        await asyncio.to_thread(_update_job, job_id, "failed")
+    finally:
+        if heartbeat is not None:
+            heartbeat.cancel()
+        close_uploads(uploads)
+
+def start_job(job: IngestJob, items: List[BulkItem], uploads: List[Tuple[str, BinaryIO]]) -> asyncio.Task:
+    """Run the job in the background; the task is referenced until it finishes, then the uploads are deleted"""
+    file_ids = [job_file.id for job_file in job.files]
+    task = asyncio.create_task(run_job(job.id, file_ids, items, job.user_id, job.agent_id, uploads))
+    _running_jobs.add(task)
+    task.add_done_callback(_running_jobs.discard)
+    return task
+
+def job_status(job: IngestJob) -> Dict:
+    """Job progress with one entry per file"""
+    counts: Dict[str, int] = {}
+    for job_file in job.files:
+        counts[job_file.status] = counts.get(job_file.status, 0) + 1
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "agent_id": job.agent_id,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "updated_at": job.updated_at.isoformat() if job.updated_at else None,
+        "total_files": len(job.files),
+        "counts": counts,
+        "files": [
+            {
+                "filename": job_file.filename,
+                "status": job_file.status,
+                "document_id": job_file.document_id,
+                "chunk_count": job_file.chunk_count,
+                "error": job_file.error
+            }
+            for job_file in job.files
+        ]
+    }
@@ -0,0 +1,171 @@
+# Assemblage du contexte du prompt : budget en tokens, extraits redondants écartés, extraits voisins fusionnés
+import logging
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from tokenizer import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Tokens of document excerpts in the RAG prompt (the previous 8 raw chunks were ~4000)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+# MMR trade-off between retrieval rank (1.0) and novelty with respect to the excerpts already kept
+CONTEXT_MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7"))
+# Share of an excerpt's word trigrams already present in a kept excerpt above which it is a near-duplicate
+CONTEXT_DUPLICATE_THRESHOLD = float(os.getenv("CONTEXT_DUPLICATE_THRESHOLD", "0.8"))
+
+_WORD_RE = re.compile(r"\w+")
+SHINGLE_WORDS = 3
+
+def shingles(text: str) -> frozenset:
+    """Word trigrams of a text: shared trigrams mean shared passages, not just a shared vocabulary"""
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < SHINGLE_WORDS:
+        return frozenset([tuple(words)]) if words else frozenset()
+    return frozenset(zip(*(words[i:] for i in range(SHINGLE_WORDS))))
+
+@dataclass
+class _Candidate:
+    rank: int
+    result: dict
+    tokens: int
+    shingles: frozenset
+    start: Optional[int] = None
+    end: Optional[int] = None
+
+@dataclass
+class Excerpt:
+    """Text of one or more merged chunks of a document"""
+    document_id: int
+    document_name: str
+    text: str
+    start: Optional[int] = None
+    end: Optional[int] = None
+
+@dataclass
+class PackedContext:
+    excerpts: List[Excerpt] = field(default_factory=list)
+    retrieved_tokens: int = 0
+    used_tokens: int = 0
+    duplicates: int = 0
+    over_budget: int = 0
+
+    @property
+    def saved_tokens(self) -> int:
+        return self.retrieved_tokens - self.used_tokens
+
+    def by_document(self) -> Dict[str, List[str]]:
+        """Excerpt texts grouped by document name, documents in order of best rank"""
+        grouped: Dict[str, List[str]] = {}
+        for excerpt in self.excerpts:
+            grouped.setdefault(excerpt.document_name, []).append(excerpt.text)
+        return grouped
+
+def _containment(shingles: frozenset, other: frozenset) -> float:
+    """Share of an excerpt's trigrams found in the other one (1.0 for a chunk contained in another)"""
+    if not shingles:
+        return 1.0
+    return len(shingles & other) / len(shingles)
+
+def _new_chars(candidate: _Candidate, selected: List[_Candidate]) -> int:
+    """Characters the candidate adds once merged with the kept chunks of its document"""
+    length = len(candidate.result['text'])
+    if candidate.start is None:
+        return length
+    # Union of the kept ranges first: text shared by several kept chunks is only subtracted once
+    kept = sorted((other.start, other.end) for other in selected
+                  if other.start is not None and other.result['document_id'] == candidate.result['document_id'])
+    merged: List[List[int]] = []
+    for start, end in kept:
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    for start, end in merged:
+        overlap = min(candidate.end, end) - max(candidate.start, start)
+        if overlap > 0:
+            length -= overlap
+    return max(length, 0)
+
+def _merge(candidates: List[_Candidate]) -> List[Excerpt]:
+    """Merge the overlapping or touching chunks of one document, in document order"""
+    excerpts: List[Excerpt] = []
+    positioned = sorted((c for c in candidates if c.start is not None), key=lambda c: c.start)
+    for candidate in positioned:
+        result, last = candidate.result, excerpts[-1] if excerpts else None
+        if last is not None and last.end is not None and candidate.start <= last.end + 2:
+            if candidate.end > last.end:
+                separator = "\n" if candidate.start > last.end else ""
+                last.text += separator + result['text'][max(last.end - candidate.start, 0):]
+                last.end = candidate.end
+            continue
+        excerpts.append(Excerpt(result['document_id'], result['document_name'], result['text'], candidate.start, candidate.end))
+    # Chunks stored before offsets existed cannot be placed in the document
+    excerpts.extend(Excerpt(c.result['document_id'], c.result['document_name'], c.result['text'])
+                    for c in candidates if c.start is None)
+    return excerpts
+
+def pack_context(results: List[dict], budget: int = CONTEXT_TOKEN_BUDGET,
+                 mmr_lambda: float = CONTEXT_MMR_LAMBDA,
+                 duplicate_threshold: float = CONTEXT_DUPLICATE_THRESHOLD) -> PackedContext:
+    """Select retrieved chunks (best first) for the prompt within a token budget.
+
+    Chunks are picked by maximal marginal relevance: retrieval rank traded
+    against word trigram overlap with the chunks already kept, so that near-duplicates
+    (the same passage in two files, overlapping chunks) are dropped and the
+    budget goes to distinct passages. Kept chunks of the same document that
+    overlap or touch are merged into one excerpt, the shared text appearing once.
+    The best chunk is always kept, even alone over budget.
+    Results are dicts with 'text', 'document_id', 'document_name' and optionally
+    'char_start'/'char_end' offsets in the document text.
+    """
+    packed = PackedContext()
+    candidates = []
+    for rank, result in enumerate(results):
+        tokens = count_tokens(result['text'])
+        packed.retrieved_tokens += tokens
+        candidates.append(_Candidate(rank, result, tokens, shingles(result['text']),
+                                     result.get('char_start'), result.get('char_end')))
+
+    selected: List[_Candidate] = []
+    remaining = budget
+    while candidates and remaining > 0:
+        best, best_score, best_redundancy = None, None, 0.0
+        for candidate in candidates:
+            relevance = 1.0 - candidate.rank / len(results)
+            redundancy = max((_containment(candidate.shingles, other.shingles) for other in selected), default=0.0)
+            score = mmr_lambda * relevance - (1 - mmr_lambda) * redundancy
+            if best_score is None or score > best_score:
+                best, best_score, best_redundancy = candidate, score, redundancy
+        candidates.remove(best)
+
+        new_chars = _new_chars(best, selected)
+        if new_chars < len(best.result['text']) and new_chars > 0:
+            # Overlaps a kept chunk of its document: only the new text will reach the prompt
+            cost = best.tokens * new_chars // len(best.result['text']) + 1
+        elif best_redundancy >= duplicate_threshold or new_chars == 0:
+            packed.duplicates += 1
+            continue
+        else:
+            cost = best.tokens
+        if cost > remaining and selected:
+            packed.over_budget += 1
+            continue
+        selected.append(best)
+        remaining -= cost
+    packed.over_budget += len(candidates)
+
+    # Documents in order of their best chunk
+    by_document: Dict[int, List[_Candidate]] = {}
+    for candidate in sorted(selected, key=lambda c: c.rank):
+        by_document.setdefault(candidate.result['document_id'], []).append(candidate)
+    for document_candidates in by_document.values():
+        packed.excerpts.extend(_merge(document_candidates))
+    packed.used_tokens = sum(count_tokens(excerpt.text) for excerpt in packed.excerpts)
+
+    logger.info(f"Context packed: {len(selected)}/{len(results)} chunks in {len(packed.excerpts)} excerpts, "
+                f"{packed.used_tokens}/{packed.retrieved_tokens} tokens ({packed.saved_tokens} saved, "
+                f"{packed.duplicates} duplicates, {packed.over_budget} over budget)")
+    return packed
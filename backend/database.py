@@ -1,9 +1,9 @@
 import os
 import logging
 from typing import List, Optional
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, ForeignKey
+from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, ForeignKey, LargeBinary, func, select
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session, relationship
+from sqlalchemy.orm import sessionmaker, Session, relationship, deferred, column_property
 from datetime import datetime
 
 # Configuration logging
@@ -67,10 +67,20 @@ class Document(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     filename = Column(String(255), nullable=False)
-    content = Column(Text)
+    content = deferred(Column(Text))  # Texte extrait ; le fichier d'origine est dans le blob store
+    blob_key = Column(String(64), index=True)  # sha256 du fichier uploadé (voir blob_store.py)
+    content_type = Column(String(100))
+    size_bytes = Column(Integer)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     agent_id = Column(Integer, ForeignKey("agents.id"), nullable=True)  # Documents peuvent être liés à un agent spécifique
     created_at = Column(DateTime, default=datetime.utcnow)
+    version = Column(Integer, default=1)  # Incrémentée quand une nouvelle version du fichier remplace le texte et les chunks
+    updated_at = Column(DateTime)
+    
+    # Résumé calculé à l'ingestion (NULL pour les documents plus anciens, complété à la demande)
+    chunk_count = Column(Integer)
+    summary_excerpt = deferred(Column(Text))  # Début du texte, 2000 caractères au plus
+    summary = deferred(Column(Text))  # Résumé LLM optionnel (DOCUMENT_LLM_SUMMARY)
     
     # Relations
     owner = relationship("User", back_populates="documents")
@@ -84,14 +94,74 @@ class DocumentChunk(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     document_id = Column(Integer, ForeignKey("documents.id"), nullable=False)
-    chunk_text = Column(Text, nullable=False)
-    embedding = Column(Text)  # JSON string of embedding vector
+    chunk_text = Column(Text)  # Copie du texte, chunks anciens seulement (voir content)
+    char_start = Column(Integer)  # Position du chunk dans documents.content : [char_start, char_end)
+    char_end = Column(Integer)
+    content_hash = Column(String(64))  # sha256 du texte : les vecteurs des chunks inchangés sont repris d'une version à l'autre
+    embedding = deferred(Column(Text))  # Legacy JSON string of embedding vector (see migrate_embeddings_to_binary.py)
+    embedding_f32 = deferred(Column(LargeBinary))  # Packed float32 embedding vector
+    embedding_model = Column(String(100))  # Model that produced the vector (NULL = legacy text-embedding-3-small)
+    embedding_dim = Column(Integer)
+    embedded_at = Column(DateTime, index=True)
     chunk_index = Column(Integer, nullable=False)
+    page_start = Column(Integer)  # PDF pages the chunk spans (NULL for other files)
+    page_end = Column(Integer)
     created_at = Column(DateTime, default=datetime.utcnow)
     
     # Relation avec le document
     document = relationship("Document", back_populates="chunks")
 
+# Texte d'un chunk : sa copie pour les chunks anciens, sinon sa tranche du texte du document,
+# découpée par la base (utilisable dans toute requête, avec ou sans jointure sur documents)
+DocumentChunk.content = column_property(
+    func.coalesce(
+        DocumentChunk.chunk_text,
+        select(func.substr(Document.content, DocumentChunk.char_start + 1, DocumentChunk.char_end - DocumentChunk.char_start))
+        .where(Document.id == DocumentChunk.document_id)
+        .correlate(DocumentChunk)
+        .scalar_subquery()
+    ),
+    deferred=True
+)
+
+class ReembedCheckpoint(Base):
+    __tablename__ = "reembed_checkpoints"
+    
+    # Progress of a re-embedding / backfill run (see reembed.py)
+    name = Column(String(100), primary_key=True)
+    target_model = Column(String(100), nullable=False)
+    last_chunk_id = Column(Integer, nullable=False, default=0)
+    processed_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class IngestJob(Base):
+    __tablename__ = "ingest_jobs"
+    
+    # Bulk / ZIP upload processed in the background (see bulk_ingest.py)
+    id = Column(String(32), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    agent_id = Column(Integer, nullable=True)  # Sans clé étrangère : l'historique survit à la suppression de l'agent
+    status = Column(String(20), nullable=False, default="queued")  # queued, running, done, failed
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    files = relationship("IngestJobFile", back_populates="job", cascade="all, delete-orphan", order_by="IngestJobFile.id")
+
+class IngestJobFile(Base):
+    __tablename__ = "ingest_job_files"
+    
+    id = Column(Integer, primary_key=True)
+    job_id = Column(String(32), ForeignKey("ingest_jobs.id"), nullable=False, index=True)
+    filename = Column(String(255), nullable=False)
+    size_bytes = Column(Integer)
+    status = Column(String(20), nullable=False, default="queued")  # queued, processing, done, failed, unreadable, skipped
+    document_id = Column(Integer, ForeignKey("documents.id", ondelete="SET NULL"), nullable=True)
+    chunk_count = Column(Integer)
+    error = Column(Text)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    job = relationship("IngestJob", back_populates="files")
+
 # Create database engine with connection pooling
 engine = create_engine(
     DATABASE_URL,
@@ -0,0 +1,134 @@
+# Cache des embeddings : (modèle, texte normalisé) -> vecteur float32
+import hashlib
+import logging
+import os
+from typing import List, Optional
+
+import numpy as np
+
+from embedding_codec import EMBEDDING_DTYPE, pack_embedding
+from openai_client import get_embedding_async, get_embeddings_batch_async, EMBEDDING_MODEL, EMBEDDING_DIMENSIONS
+from redis_cache import LRUCache, get_redis, report_redis_error, KEY_PREFIX
+from single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_CACHE_L1_SIZE = int(os.getenv("EMBEDDING_CACHE_L1_SIZE", "20000"))  # ~120 MB at 1536 dims
+# Persistent tier in Redis (when REDIS_URL is set); vectors of a given model never change
+EMBEDDING_CACHE_TTL = int(os.getenv("EMBEDDING_CACHE_TTL", str(30 * 24 * 3600)))
+EMBEDDING_CACHE_PERSISTENT = os.getenv("EMBEDDING_CACHE_PERSISTENT", "true").lower() == "true"
+
+def normalize_text(text: str) -> str:
+    """Whitespace-insensitive form of a text (case is kept, it changes the embedding)"""
+    return " ".join(text.split())
+
+def embedding_key(text: str, model: str) -> str:
+    digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+    return f"{model}:{EMBEDDING_DIMENSIONS}:{digest}"
+
+def _is_dummy(embedding: Optional[list]) -> bool:
+    """Missing or placeholder vectors (the API failed) must not be cached"""
+    return embedding is None or not any(embedding)
+
+class EmbeddingCache:
+    """In-memory LRU of packed float32 vectors, with Redis as optional persistent tier"""
+
+    def __init__(self, l1_size: int, ttl: int, persistent: bool):
+        self.l1 = LRUCache(l1_size)
+        self.ttl = ttl
+        self.persistent = persistent
+        self.hits = 0
+        self.misses = 0
+
+    def _redis(self):
+        return get_redis() if self.persistent else None
+
+    async def get_many(self, keys: List[str]) -> List[Optional[bytes]]:
+        values = [self.l1.get(key) for key in keys]
+        missing = [i for i, value in enumerate(values) if value is None]
+        client = self._redis()
+        if missing and client is not None:
+            try:
+                stored = await client.mget([KEY_PREFIX + "emb:" + keys[i] for i in missing])
+                for i, value in zip(missing, stored):
+                    if value is not None:
+                        values[i] = value
+                        self.l1.set(keys[i], value, self.ttl)
+            except Exception as e:
+                report_redis_error(e)
+        found = sum(value is not None for value in values)
+        self.hits += found
+        self.misses += len(values) - found
+        return values
+
+    async def set_many(self, items: List[tuple]):
+        """Store (key, embedding) pairs"""
+        packed = [(key, pack_embedding(embedding)) for key, embedding in items if not _is_dummy(embedding)]
+        for key, value in packed:
+            self.l1.set(key, value, self.ttl)
+        client = self._redis()
+        if packed and client is not None:
+            try:
+                async with client.pipeline(transaction=False) as pipe:
+                    for key, value in packed:
+                        pipe.set(KEY_PREFIX + "emb:" + key, value, ex=self.ttl)
+                    await pipe.execute()
+            except Exception as e:
+                report_redis_error(e)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "l1_entries": len(self.l1),
+            "redis": self._redis() is not None
+        }
+
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_L1_SIZE, EMBEDDING_CACHE_TTL, EMBEDDING_CACHE_PERSISTENT)
+
+def _unpack(value: bytes) -> list:
+    return np.frombuffer(value, dtype=EMBEDDING_DTYPE).tolist()
+
+# The same question asked by several users at once is embedded once
+query_embedding_flights = SingleFlight("query_embedding")
+
+async def _cached_query_embedding(key: str) -> Optional[list]:
+    cached = (await embedding_cache.get_many([key]))[0]
+    return _unpack(cached) if cached is not None else None
+
+async def get_query_embedding(text: str, model: str = EMBEDDING_MODEL) -> list:
+    """get_embedding_async behind the cache (questions asked again by any user are free)"""
+    key = embedding_key(text, model)
+    cached = await _cached_query_embedding(key)
+    if cached is not None:
+        return cached
+    
+    async def embed() -> list:
+        embedding = await get_embedding_async(text, model=model)
+        await embedding_cache.set_many([(key, embedding)])
+        return embedding
+    
+    return await query_embedding_flights.do(key, embed, lambda: _cached_query_embedding(key))
+
+async def get_chunk_embeddings(texts: List[str]) -> List[Optional[list]]:
+    """get_embeddings_batch_async behind the cache: identical texts are embedded once (None if embedding failed)"""
+    if not texts:
+        return []
+    keys = [embedding_key(text, EMBEDDING_MODEL) for text in texts]
+    cached = await embedding_cache.get_many(keys)
+
+    # Embed each distinct missing text once
+    to_embed = {}
+    for key, text, value in zip(keys, texts, cached):
+        if value is None and key not in to_embed:
+            to_embed[key] = text
+    if to_embed:
+        logger.info(f"Embedding cache: {len(texts) - len(to_embed)}/{len(texts)} chunks reused")
+        fresh = dict(zip(to_embed, await get_embeddings_batch_async(list(to_embed.values()))))
+        await embedding_cache.set_many(list(fresh.items()))
+    else:
+        fresh = {}
+
+    return [fresh[key] if value is None else _unpack(value) for key, value in zip(keys, cached)]
@@ -0,0 +1,46 @@
+# Encodage binaire des embeddings (float32 little-endian) avec lecture des anciennes lignes JSON
+import json
+from typing import List, Optional
+
+import numpy as np
+from sqlalchemy import or_, and_, func
+
+from database import DocumentChunk
+
+EMBEDDING_DTYPE = np.dtype("<f4")
+
+# Model of the vectors stored before embedding_model was recorded
+LEGACY_EMBEDDING_MODEL = "text-embedding-3-small"
+LEGACY_EMBEDDING_DIM = 1536
+
+def pack_embedding(embedding: List[float]) -> bytes:
+    """Pack an embedding as raw float32 bytes (6 KB for 1536 dims instead of ~30 KB of JSON)"""
+    return np.asarray(embedding, dtype=EMBEDDING_DTYPE).tobytes()
+
+def unpack_embedding(packed: Optional[bytes], legacy_json: Optional[str] = None) -> Optional[np.ndarray]:
+    """Read a stored embedding without copying; falls back to the legacy JSON column"""
+    if packed is not None:
+        return np.frombuffer(packed, dtype=EMBEDDING_DTYPE)
+    if legacy_json:
+        return np.asarray(json.loads(legacy_json), dtype=EMBEDDING_DTYPE)
+    return None
+
+def has_embedding():
+    """SQL filter for chunks carrying an embedding in either format"""
+    return or_(DocumentChunk.embedding_f32.isnot(None), DocumentChunk.embedding.isnot(None))
+
+def embedding_model_column():
+    """SQL expression for the model that produced a chunk's vector"""
+    return func.coalesce(DocumentChunk.embedding_model, LEGACY_EMBEDDING_MODEL)
+
+def needs_embedding(target_model: str, target_dim: int):
+    """SQL filter for chunks to (re-)embed: missing, dummy, or produced by another model/dimension"""
+    dummy_packed = bytes(EMBEDDING_DTYPE.itemsize * LEGACY_EMBEDDING_DIM)
+    dummy_json = json.dumps([0.0] * LEGACY_EMBEDDING_DIM)
+    return or_(
+        and_(DocumentChunk.embedding_f32.is_(None), DocumentChunk.embedding.is_(None)),
+        DocumentChunk.embedding_f32 == dummy_packed,
+        DocumentChunk.embedding == dummy_json,
+        embedding_model_column() != target_model,
+        func.coalesce(DocumentChunk.embedding_dim, LEGACY_EMBEDDING_DIM) != target_dim
+    )
@@ -0,0 +1,242 @@
+# Extraction du texte des fichiers uploadés : un extracteur par format, exécutés hors de la boucle asyncio
+import asyncio
+import codecs
+import csv
+import io
+import logging
+import os
+import re
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Dict, Iterable, Iterator, Optional, Tuple
+from xml.etree import ElementTree
+
+from file_loader import iter_pdf_pages
+
+logger = logging.getLogger(__name__)
+
+try:
+    from charset_normalizer import from_bytes
+except ImportError:  # charset-normalizer est optionnel, on retombe sur utf-8 puis cp1252
+    from_bytes = None
+
+# Files extracted at once; other uploads wait for a slot without blocking the event loop
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", "4"))
+# Size of the text pieces handed to the chunker
+TEXT_PIECE_CHARS = 64 * 1024
+ENCODING_SAMPLE_BYTES = 256 * 1024
+# Non UTF-8 encodings considered for text files: unrestricted detection misreads short French texts
+LEGACY_ENCODINGS = ["cp1252", "iso8859_15", "mac_roman", "cp850", "utf_16"]
+
+class ExtractionError(ValueError):
+    """The uploaded file could not be read, or contained no text"""
+
+# An extractor turns the file bytes into (page number or None, text) pieces, in order
+Extractor = Callable[[bytes], Iterator[Tuple[Optional[int], str]]]
+EXTRACTORS: Dict[str, Extractor] = {}
+
+def register_extractor(*extensions: str):
+    """Register an extractor for file extensions (lowercase, with the dot)"""
+    def decorator(extractor: Extractor) -> Extractor:
+        for extension in extensions:
+            EXTRACTORS[extension] = extractor
+        return extractor
+    return decorator
+
+def get_extractor(filename: str) -> Optional[Extractor]:
+    return EXTRACTORS.get(os.path.splitext(filename)[1].lower())
+
+def is_supported(filename: str) -> bool:
+    return get_extractor(filename) is not None
+
+def detect_encoding(data: bytes) -> str:
+    """BOM, then strict UTF-8, then charset-normalizer when installed, else cp1252 (Windows exports)"""
+    for bom, encoding in ((codecs.BOM_UTF8, "utf-8-sig"), (codecs.BOM_UTF16_LE, "utf-16"), (codecs.BOM_UTF16_BE, "utf-16")):
+        if data.startswith(bom):
+            return encoding
+    try:
+        data.decode("utf-8")
+        return "utf-8"
+    except UnicodeDecodeError:
+        pass
+    if from_bytes is not None:
+        match = from_bytes(data[:ENCODING_SAMPLE_BYTES], cp_isolation=LEGACY_ENCODINGS).best()
+        if match is not None:
+            return match.encoding
+    return "cp1252"
+
+def _text_stream(data: bytes, newline: Optional[str] = None) -> io.TextIOWrapper:
+    """Decoded view of the bytes; universal newlines unless newline is given (csv needs '')"""
+    return io.TextIOWrapper(io.BytesIO(data), encoding=detect_encoding(data), errors="replace", newline=newline)
+
+def _pieces(lines: Iterable[str]) -> Iterator[Tuple[Optional[int], str]]:
+    """Group lines into pieces of about TEXT_PIECE_CHARS"""
+    buffer, size = [], 0
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size >= TEXT_PIECE_CHARS:
+            yield None, "".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield None, "".join(buffer)
+
+@register_extractor(".pdf")
+def extract_pdf(data: bytes) -> Iterator[Tuple[Optional[int], str]]:
+    """Pages, parsed in parallel by the PDF process pool (see file_loader.iter_pdf_pages)"""
+    for page, text in iter_pdf_pages(data):
+        if text:
+            yield page, text + "\n"
+
+@register_extractor(".txt")
+def extract_txt(data: bytes) -> Iterator[Tuple[Optional[int], str]]:
+    stream = _text_stream(data)
+    while True:
+        piece = stream.read(TEXT_PIECE_CHARS)
+        if not piece:
+            break
+        yield None, piece
+
+_MD_FENCE_RE = re.compile(r"^\s*(```|~~~)")
+_MD_HEADING_RE = re.compile(r"^\s{0,3}#{1,6}\s+|\s+#+\s*$")
+_MD_IMAGE_RE = re.compile(r"!\[([^\]]*)\]\([^)]*\)")
+_MD_LINK_RE = re.compile(r"\[([^\]]+)\]\([^)]*\)")
+_MD_EMPHASIS_RE = re.compile(r"(\*\*|\*|`)(?=\S)(.+?)(?<=\S)\1|\b(__|_)(?=\S)(.+?)(?<=\S)\3\b")  # No intraword _
+_MD_HTML_RE = re.compile(r"<[^>\n]+>")
+
+def markdown_to_text(line: str) -> str:
+    """Drop the Markdown markup of a line, keep its words (headings, link and image texts)"""
+    line = _MD_HEADING_RE.sub("", line.rstrip("\n"))
+    line = _MD_IMAGE_RE.sub(r"\1", line)
+    line = _MD_LINK_RE.sub(r"\1", line)
+    line = _MD_EMPHASIS_RE.sub(lambda match: match.group(2) or match.group(4), line)
+    return _MD_HTML_RE.sub("", line) + "\n"
+
+@register_extractor(".md", ".markdown")
+def extract_markdown(data: bytes) -> Iterator[Tuple[Optional[int], str]]:
+    def lines():
+        in_code = False
+        for line in _text_stream(data):
+            if _MD_FENCE_RE.match(line):
+                in_code = not in_code
+                continue
+            yield line if in_code else markdown_to_text(line)
+    yield from _pieces(lines())
+
+@register_extractor(".csv")
+def extract_csv(data: bytes) -> Iterator[Tuple[Optional[int], str]]:
+    """One line per row, each value prefixed by its column name so every chunk stands alone"""
+    stream = _text_stream(data, newline="")
+    sample = stream.read(8192)
+    stream.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=",;\t|")
+    except csv.Error:
+        dialect = csv.excel
+
+    def lines():
+        reader = csv.reader(stream, dialect)
+        header = next(reader, None)
+        if header is None:
+            return
+        header = [name.strip() for name in header]
+        for row in reader:
+            values = [
+                f"{header[i] if i < len(header) and header[i] else f'colonne {i + 1}'}: {value.strip()}"
+                for i, value in enumerate(row) if value.strip()
+            ]
+            if values:
+                yield " ; ".join(values) + "\n"
+    yield from _pieces(lines())
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+def _docx_paragraph_text(paragraph) -> str:
+    parts = []
+    for node in paragraph.iter():
+        if node.tag == _W + "t" and node.text:
+            parts.append(node.text)
+        elif node.tag == _W + "tab":
+            parts.append("\t")
+        elif node.tag in (_W + "br", _W + "cr"):
+            parts.append("\n")
+    return "".join(parts)
+
+@register_extractor(".docx")
+def extract_docx(data: bytes) -> Iterator[Tuple[Optional[int], str]]:
+    """Body paragraphs (blank line after each) and table rows (cells joined by ' | '), parsed incrementally"""
+    def lines():
+        with zipfile.ZipFile(io.BytesIO(data)) as archive, archive.open("word/document.xml") as document:
+            tables, row, cell = 0, [], []
+            for event, node in ElementTree.iterparse(document, events=("start", "end")):
+                if node.tag == _W + "tbl":
+                    tables += 1 if event == "start" else -1
+                if event == "start":
+                    continue
+                if node.tag == _W + "p":
+                    text = _docx_paragraph_text(node).strip()
+                    if tables:
+                        cell.append(text)
+                    elif text:
+                        yield text + "\n\n"
+                    node.clear()
+                elif node.tag == _W + "tc":
+                    row.append(" ".join(part for part in cell if part))
+                    cell = []
+                elif node.tag == _W + "tr":
+                    if any(row):
+                        yield " | ".join(row) + "\n"
+                    row = []
+                    node.clear()
+                elif node.tag == _W + "tbl" and not tables:
+                    yield "\n"
+                    node.clear()
+    yield from _pieces(lines())
+
+# Formats accepted by the upload endpoints
+SUPPORTED_EXTENSIONS = tuple(sorted(EXTRACTORS))
+
+_executor: Optional[ThreadPoolExecutor] = None
+_slots = asyncio.Semaphore(EXTRACT_WORKERS)
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(EXTRACT_WORKERS, thread_name_prefix="extract")
+    return _executor
+
+def shutdown_extract_pool():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(cancel_futures=True)
+        _executor = None
+
+async def extract_text(filename: str, data: bytes) -> AsyncIterator[Tuple[Optional[int], str]]:
+    """Yield the (page, text) pieces of an uploaded file as they are extracted.
+
+    Extractors run in a bounded thread pool (PDF pages are further parsed by the
+    PDF process pool); at most EXTRACT_WORKERS files are extracted at a time.
+    A corrupt or unreadable file raises ExtractionError.
+    """
+    extractor = get_extractor(filename)
+    if extractor is None:
+        raise ValueError(f"Unsupported file type: {filename}")
+    async with _slots:
+        pieces = extractor(data)
+        pending = None
+        try:
+            while True:
+                pending = _get_executor().submit(next, pieces, None)
+                try:
+                    piece = await asyncio.wrap_future(pending)
+                except Exception as e:
+                    raise ExtractionError(f"Could not extract text from {filename}: {e}") from e
+                if piece is None:
+                    break
+                yield piece
+        finally:
+            if pending is not None and not pending.done():
+                # Cancelled while a worker thread is inside the generator: closing it now would raise
+                # "generator already executing" and hide the cancellation
+                await asyncio.wait([asyncio.wrap_future(pending)])
+            pieces.close()
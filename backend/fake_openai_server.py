@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Serveur compatible OpenAI pour les tests de charge, sans appel à l'API réelle
+
+Sert /v1/embeddings et /v1/chat/completions (streaming compris) avec des réponses
+déterministes : les embeddings sont un hachage des mots du texte (deux textes
+proches ont des vecteurs proches, la recherche reste pertinente), la réponse du
+chat reprend la question. Latence, débit du streaming et taux de 429 sont
+réglables ; les en-têtes x-ratelimit-* imitent les quotas par minute d'OpenAI.
+
+Usage: python fake_openai_server.py [--port 8100] [--latency-ms 200] [--jitter-ms 100]
+                                    [--token-delay-ms 20] [--rate-429 0.02] [--rpm 5000] [--tpm 1000000]
+Puis lancer l'API avec OPENAI_BASE_URL=http://localhost:8100/v1 OPENAI_API_KEY=fake
+"""
+import sys
+import os
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+import uuid
+from collections import deque
+from functools import lru_cache
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Ajouter le répertoire parent au PATH pour les imports
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from tokenizer import count_tokens
+
+WORD_RE = re.compile(r"\w+")
+
+class Settings:
+    latency_ms = 200.0
+    jitter_ms = 100.0
+    token_delay_ms = 20.0
+    rate_429 = 0.0
+    rpm = 5000
+    tpm = 1000000
+    seed = 42
+
+settings = Settings()
+rng = random.Random(settings.seed)
+app = FastAPI(title="Fake OpenAI")
+
+class MinuteWindow:
+    """Requests and tokens of the last 60 seconds, for the x-ratelimit-* headers"""
+
+    def __init__(self):
+        self.events = deque()
+        self.tokens = 0
+
+    def add(self, tokens: int):
+        now = time.monotonic()
+        while self.events and now - self.events[0][0] > 60:
+            self.tokens -= self.events.popleft()[1]
+        self.events.append((now, tokens))
+        self.tokens += tokens
+
+    def headers(self) -> dict:
+        return {
+            "x-ratelimit-limit-requests": str(settings.rpm),
+            "x-ratelimit-remaining-requests": str(max(settings.rpm - len(self.events), 0)),
+            "x-ratelimit-reset-requests": "1s",
+            "x-ratelimit-limit-tokens": str(settings.tpm),
+            "x-ratelimit-remaining-tokens": str(max(settings.tpm - self.tokens, 0)),
+            "x-ratelimit-reset-tokens": "1s"
+        }
+
+windows = {}
+stats = {"requests": 0, "rate_limited": 0}
+
+def window(model: str) -> MinuteWindow:
+    return windows.setdefault(model, MinuteWindow())
+
+@lru_cache(maxsize=200000)
+def word_vector(word: str, dim: int) -> np.ndarray:
+    seed = int.from_bytes(hashlib.sha256(word.encode("utf-8")).digest()[:8], "little")
+    return np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+
+def fake_embedding(text: str, dim: int) -> list:
+    """Normalized sum of per-word random vectors: deterministic, and similar texts get similar vectors"""
+    vector = np.zeros(dim, dtype=np.float32)
+    for word in WORD_RE.findall(text.lower()):
+        vector += word_vector(word, dim)
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        vector = word_vector("", dim)
+        norm = np.linalg.norm(vector)
+    return (vector / norm).tolist()
+
+def fake_answer(messages: list) -> str:
+    question = messages[-1]["content"] if messages else ""
+    match = re.search(r"Question(?: de l'utilisateur)?:\s*(.+?)\s*\n", question)
+    asked = match.group(1) if match else question[-200:]
+    return (f"Réponse simulée à « {asked} ». D'après les documents fournis, les éléments pertinents "
+            "sont résumés ici de manière concise et professionnelle.")
+
+async def simulate_latency():
+    delay = settings.latency_ms + rng.uniform(-settings.jitter_ms, settings.jitter_ms)
+    await asyncio.sleep(max(delay, 0.0) / 1000)
+
+def rate_limited(model: str):
+    """A 429 response for a share of the requests, like OpenAI's"""
+    if settings.rate_429 <= 0 or rng.random() >= settings.rate_429:
+        return None
+    stats["rate_limited"] += 1
+    headers = {**window(model).headers(), "retry-after-ms": str(rng.randint(200, 1500))}
+    return JSONResponse(status_code=429, headers=headers, content={"error": {
+        "message": f"Rate limit reached for {model} (simulated)", "type": "requests", "code": "rate_limit_exceeded"
+    }})
+
+@app.post("/v1/embeddings")
+async def embeddings(request: Request):
+    body = await request.json()
+    model = body.get("model", "text-embedding-3-small")
+    inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+    stats["requests"] += 1
+    await simulate_latency()
+    limited = rate_limited(model)
+    if limited is not None:
+        return limited
+
+    dim = int(body.get("dimensions") or 1536)
+    tokens = sum(count_tokens(text) for text in inputs)
+    window(model).add(tokens)
+    data = [{"object": "embedding", "index": i, "embedding": fake_embedding(text, dim)} for i, text in enumerate(inputs)]
+    return JSONResponse(headers=window(model).headers(), content={
+        "object": "list", "data": data, "model": model,
+        "usage": {"prompt_tokens": tokens, "total_tokens": tokens}
+    })
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    model = body.get("model", "gpt-4")
+    messages = body.get("messages", [])
+    stats["requests"] += 1
+    await simulate_latency()
+    limited = rate_limited(model)
+    if limited is not None:
+        return limited
+
+    answer = fake_answer(messages)
+    prompt_tokens = sum(count_tokens(message.get("content") or "") for message in messages)
+    completion_tokens = count_tokens(answer)
+    usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+    window(model).add(prompt_tokens + completion_tokens)
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+    created = int(time.time())
+
+    if not body.get("stream"):
+        return JSONResponse(headers=window(model).headers(), content={
+            "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
+            "usage": usage
+        })
+
+    include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+
+    def chunk(delta: dict, finish_reason=None, with_usage=None) -> str:
+        payload = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                   "choices": [] if with_usage else [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+        if with_usage:
+            payload["usage"] = with_usage
+        return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+    async def events():
+        yield chunk({"role": "assistant", "content": ""})
+        for word in re.findall(r"\S+\s*", answer):
+            await asyncio.sleep(settings.token_delay_ms / 1000)
+            yield chunk({"content": word})
+        yield chunk({}, "stop")
+        if include_usage:
+            yield chunk({}, with_usage=usage)
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=window(model).headers())
+
+@app.get("/stats")
+async def server_stats():
+    return {**stats, "models": {model: w.headers() for model, w in windows.items()}}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serveur OpenAI simulé")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency-ms", type=float, default=settings.latency_ms, help="Latence moyenne avant la réponse")
+    parser.add_argument("--jitter-ms", type=float, default=settings.jitter_ms)
+    parser.add_argument("--token-delay-ms", type=float, default=settings.token_delay_ms, help="Délai entre deux morceaux en streaming")
+    parser.add_argument("--rate-429", type=float, default=settings.rate_429, help="Part des requêtes refusées par un 429")
+    parser.add_argument("--rpm", type=int, default=settings.rpm)
+    parser.add_argument("--tpm", type=int, default=settings.tpm)
+    parser.add_argument("--seed", type=int, default=settings.seed)
+    args = parser.parse_args()
+
+    for name in ("latency_ms", "jitter_ms", "token_delay_ms", "rate_429", "rpm", "tpm", "seed"):
+        setattr(settings, name, getattr(args, name))
+    rng.seed(args.seed)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
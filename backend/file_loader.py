@@ -1,18 +1,120 @@
+import bisect
+import io
+import logging
+import multiprocessing
+import os
+import re
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
 import pdfplumber
-from typing import List
+
+from tokenizer import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Page ranges are parsed in worker processes (pdfminer is pure Python and holds the GIL)
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "8"))
+
+# Chunk budget in tokens (cl100k_base), overlap made of whole sentences
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "500"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "50"))
+
+# End of a sentence (punctuation, closing quotes/brackets, whitespace) or of a line
+_BOUNDARY_RE = re.compile(r"[.!?…]+[\"'»)\]]*(?:\s+|$)|\n\s*")
+
+_pdf_pool: Optional[ProcessPoolExecutor] = None
+
+def _get_pdf_pool() -> ProcessPoolExecutor:
+    global _pdf_pool
+    if _pdf_pool is None:
+        # spawn: forking the threaded API process is unsafe
+        _pdf_pool = ProcessPoolExecutor(PDF_EXTRACT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pdf_pool
+
+def shutdown_pdf_pool():
+    global _pdf_pool
+    if _pdf_pool is not None:
+        _pdf_pool.shutdown(cancel_futures=True)
+        _pdf_pool = None
+
+def _extract_pages(pdf, start: int, end: int) -> List[Tuple[int, str]]:
+    """(page number, text) for pages [start, end), page numbers starting at 1"""
+    pages = []
+    for index in range(start, min(end, len(pdf.pages))):
+        page = pdf.pages[index]
+        try:
+            pages.append((index + 1, page.extract_text() or ""))
+        except Exception as e:
+            logger.warning(f"Could not extract PDF page {index + 1}: {e}")
+            pages.append((index + 1, ""))
+        page.close()  # Release the parsed layout, memory stays flat on long documents
+    return pages
+
+# In a worker process: the PDF its last page range came from, kept open for the next ranges
+_worker_pdf: Optional[Tuple[str, object]] = None
+
+def _extract_page_range(path: str, start: int, end: int) -> List[Tuple[int, str]]:
+    """Worker task: pages [start, end) of the PDF file at path, opened once per worker and file"""
+    global _worker_pdf
+    if _worker_pdf is None or _worker_pdf[0] != path:
+        if _worker_pdf is not None:
+            _worker_pdf[1].close()
+            _worker_pdf = None
+        _worker_pdf = (path, pdfplumber.open(path))
+    return _extract_pages(_worker_pdf[1], start, end)
+
+def iter_pdf_pages(data: bytes) -> Iterator[Tuple[int, str]]:
+    """Yield (page number, text) in page order from an in-memory PDF.
+
+    Page ranges are extracted in parallel by a process pool, with a bounded
+    number of ranges in flight; pages are yielded as soon as their range is done.
+    The bytes are written once to a temporary file: tasks only carry its path
+    and a page range, and each worker parses the document once.
+    """
+    with pdfplumber.open(io.BytesIO(data)) as pdf:
+        page_count = len(pdf.pages)
+        if page_count <= PDF_PAGES_PER_TASK or PDF_EXTRACT_WORKERS <= 1:
+            yield from _extract_pages(pdf, 0, page_count)
+            return
+
+    fd, path = tempfile.mkstemp(suffix=".pdf", prefix="upload_")
+    in_flight = deque()
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        pool = _get_pdf_pool()
+        ranges = iter(range(0, page_count, PDF_PAGES_PER_TASK))
+        for start in ranges:
+            in_flight.append(pool.submit(_extract_page_range, path, start, start + PDF_PAGES_PER_TASK))
+            if len(in_flight) >= 2 * PDF_EXTRACT_WORKERS:
+                break
+        while in_flight:
+            pages = in_flight.popleft().result()
+            start = next(ranges, None)
+            if start is not None:
+                in_flight.append(pool.submit(_extract_page_range, path, start, start + PDF_PAGES_PER_TASK))
+            yield from pages
+    finally:
+        for future in in_flight:
+            future.cancel()
+        os.unlink(path)  # Workers still holding it open keep reading until they move to another file
+
+def pdf_text(data: bytes) -> str:
+    """Text of an in-memory PDF, one line break after each page"""
+    return "".join(page_text + "\n" for _, page_text in iter_pdf_pages(data) if page_text)
 
 def load_text_from_pdf(path: str) -> str:
     """Load text from PDF file"""
-    text = ""
     try:
-        with pdfplumber.open(path) as pdf:
-            for page in pdf.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text + "\n"
+        with open(path, "rb") as f:
+            return pdf_text(f.read())
     except Exception as e:
-        print(f"Error loading PDF: {e}")
-    return text
+        logger.error(f"Error loading PDF: {e}")
+        return ""
 
 def chunk_text(text: str, chunk_size: int = 2000, overlap: int = 200) -> List[str]:
     """Split text into overlapping chunks"""
@@ -25,10 +127,8 @@ def chunk_text(text: str, chunk_size: int = 2000, overlap: int = 200) -> List[st
         
         # If not the last chunk, try to end at a sentence boundary
         if end < len(text):
-            # Look for sentence endings
-            sentence_ends = ['.', '!', '?', '\n']
             for i in range(len(chunk) - 1, max(0, len(chunk) - 100), -1):
-                if chunk[i] in sentence_ends:
+                if chunk[i] in ['.', '!', '?', '\n']:
                     chunk = chunk[:i + 1]
                     break
         
@@ -39,3 +139,156 @@ def chunk_text(text: str, chunk_size: int = 2000, overlap: int = 200) -> List[st
             break
     
     return [chunk for chunk in chunks if chunk]
+
+class _Segment(NamedTuple):
+    start: int
+    end: int
+    tokens: int
+    strength: int  # Boundary closing the segment: 0 none/line, 1 sentence, 2 paragraph
+
+def _boundary_strength(separator: str) -> int:
+    if separator.count("\n") >= 2:
+        return 2
+    return 0 if separator[0] == "\n" else 1
+
+class TokenChunker:
+    """Chunks of at most max_tokens tokens, cut on sentence and paragraph boundaries.
+
+    Text is fed piece by piece (e.g. one PDF page at a time) and scanned forward
+    once: each sentence or line is counted as it completes, and a chunk is
+    emitted when the next one would overflow the budget, preferably after the
+    last paragraph or sentence end of its second half. Consecutive chunks share
+    up to overlap_tokens of whole sentences. Chunks are (start, end, text) with
+    offsets into the concatenated text, surrounding whitespace excluded.
+    """
+
+    def __init__(self, max_tokens: int = CHUNK_MAX_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS):
+        self.max_tokens = max_tokens
+        self.overlap_tokens = min(overlap_tokens, max_tokens // 2)
+        self.buffer = ""
+        self.base = 0  # Offset of buffer[0] in the whole text
+        self.scanned = 0  # Offset up to which the text is split into segments
+        self.window: List[_Segment] = []
+        self.window_tokens = 0
+        self.overlap = 0  # Leading window segments already emitted with the previous chunk
+
+    def _text(self, start: int, end: int) -> str:
+        return self.buffer[start - self.base:end - self.base]
+
+    def _chunk(self, segments: List[_Segment]) -> Optional[Tuple[int, int, str]]:
+        start, end = segments[0].start, segments[-1].end
+        raw = self._text(start, end)
+        stripped = raw.strip()
+        if not stripped:
+            return None
+        start += len(raw) - len(raw.lstrip())
+        return start, start + len(stripped), stripped
+
+    def _split_oversized(self, segment: _Segment) -> List[_Segment]:
+        """Cut a segment longer than the budget (no punctuation, tables) on whitespace"""
+        text = self._text(segment.start, segment.end)
+        piece_chars = max(1, int(len(text) * self.max_tokens / segment.tokens * 0.9))
+        pieces, offset = [], 0
+        while offset < len(text):
+            end = min(offset + piece_chars, len(text))
+            if end < len(text):
+                space = text.rfind(" ", offset + piece_chars // 2, end)
+                end = space + 1 if space >= 0 else end
+            pieces.append(_Segment(segment.start + offset, segment.start + end,
+                                   count_tokens(text[offset:end]), 0 if end < len(text) else segment.strength))
+            offset = end
+        return pieces
+
+    def _cut(self) -> Optional[Tuple[int, int, str]]:
+        """Emit the head of the window and keep the overlap plus the remainder"""
+        # Last boundary of the second half at least as strong as every later one
+        cut, tokens, strongest_after = len(self.window), self.window_tokens, 0
+        for i in range(len(self.window) - 1, self.overlap - 1, -1):
+            segment = self.window[i]
+            if i < len(self.window) - 1 and segment.strength >= max(strongest_after, 1):
+                cut = i + 1
+                break
+            tokens -= segment.tokens
+            strongest_after = max(strongest_after, segment.strength)
+            if tokens < self.max_tokens // 2:
+                break
+        emitted, rest = self.window[:cut], self.window[cut:]
+
+        overlap, overlap_tokens = [], 0
+        for segment in reversed(emitted[1:]):
+            if overlap_tokens + segment.tokens > self.overlap_tokens:
+                break
+            overlap.insert(0, segment)
+            overlap_tokens += segment.tokens
+        self._set_window(overlap + rest, len(overlap))
+        return self._chunk(emitted)
+
+    def _set_window(self, segments: List[_Segment], overlap: int = 0):
+        self.window = segments
+        self.window_tokens = sum(segment.tokens for segment in segments)
+        self.overlap = overlap
+
+    def _add(self, segment: _Segment) -> Iterator[Tuple[int, int, str]]:
+        pieces = self._split_oversized(segment) if segment.tokens > self.max_tokens else [segment]
+        for piece in pieces:
+            cut = False
+            while self.window and self.window_tokens + piece.tokens > self.max_tokens:
+                if self.overlap and (cut or self.overlap == len(self.window)):
+                    # The overlap does not fit next to this piece, keep only the text not emitted yet
+                    self._set_window(self.window[self.overlap:])
+                    continue
+                chunk = self._cut()
+                cut = True
+                if chunk:
+                    yield chunk
+            self.window.append(piece)
+            self.window_tokens += piece.tokens
+
+    def _scan(self, final: bool) -> Iterator[Tuple[int, int, str]]:
+        position = self.scanned - self.base
+        for match in _BOUNDARY_RE.finditer(self.buffer, position):
+            if match.end() == len(self.buffer) and not final:
+                break  # More whitespace or text may follow in the next piece
+            end = self.base + match.end()
+            if match.start() > position or self.window:
+                yield from self._add(_Segment(self.scanned, end, count_tokens(self.buffer[position:match.end()]),
+                                              _boundary_strength(match.group())))
+            self.scanned, position = end, match.end()
+        if final and position < len(self.buffer):
+            yield from self._add(_Segment(self.scanned, self.base + len(self.buffer),
+                                          count_tokens(self.buffer[position:]), 2))
+            self.scanned = self.base + len(self.buffer)
+
+        # Drop text no longer needed by the window
+        keep = self.window[0].start if self.window else self.scanned
+        if keep > self.base:
+            self.buffer = self.buffer[keep - self.base:]
+            self.base = keep
+
+    def feed(self, text: str) -> Iterator[Tuple[int, int, str]]:
+        """Append text, yield the chunks that are now complete"""
+        self.buffer += text
+        yield from self._scan(final=False)
+
+    def finish(self) -> Iterator[Tuple[int, int, str]]:
+        """Yield the remaining chunks"""
+        yield from self._scan(final=True)
+        if len(self.window) > self.overlap:
+            chunk = self._chunk(self.window)
+            if chunk:
+                yield chunk
+        self._set_window([])
+
+def iter_token_chunks(pieces: Iterable[str], max_tokens: int = CHUNK_MAX_TOKENS,
+                      overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> Iterator[Tuple[int, int, str]]:
+    """Yield (start, end, text) chunks of the concatenated pieces while they are produced"""
+    chunker = TokenChunker(max_tokens, overlap_tokens)
+    for piece in pieces:
+        yield from chunker.feed(piece)
+    yield from chunker.finish()
+
+def page_range(page_offsets: List[int], pages: List[int], start: int, end: int) -> Tuple[int, int]:
+    """First and last page of the text span [start, end), given the offset where each page starts"""
+    first = bisect.bisect_right(page_offsets, start) - 1
+    last = bisect.bisect_right(page_offsets, end - 1) - 1
+    return pages[max(first, 0)], pages[max(last, 0)]
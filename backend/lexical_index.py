@@ -0,0 +1,340 @@
+# Index lexical BM25 persistant, un index inversé par partition (utilisateur, agent)
+import glob
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from database import Document, DocumentChunk
+
+logger = logging.getLogger(__name__)
+
+LEXICAL_INDEX_DIR = os.getenv("LEXICAL_INDEX_DIR", "/tmp/lexical_indexes")
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Seconds during which a user's partitions are trusted without re-checking the database
+SYNC_INTERVAL = float(os.getenv("LEXICAL_INDEX_SYNC_INTERVAL", "2"))
+# Uploads and deletions are appended to a log; the snapshot is rewritten once the log outgrows it (and this size)
+LOG_COMPACT_MIN_BYTES = int(os.getenv("LEXICAL_INDEX_LOG_COMPACT_MIN_BYTES", str(1024 * 1024)))
+
+STOPWORDS = set("""
+a au aux avec ce ces cet cette dans de des du elle en est et eux il ils je la le les leur leurs lui ma mais me
+meme mes moi mon ne nos notre nous on ou par pas pour qu que qui sa se ses son sont sur ta te tes toi ton tu un
+une vos votre vous y ete etre avoir ai as avons avez ont fait faire quel quelle quels quelles comment combien
+pourquoi quand the of and to in is are for on with what how
+""".split())
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+def _strip_accents(text: str) -> str:
+    return "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+
+def _stem(token: str) -> str:
+    """Light French stemming: plural and feminine endings only, enough to match résumé/résumés"""
+    if len(token) > 3 and token[-1] in "sx":
+        token = token[:-1]
+    if len(token) > 3 and token.endswith("e"):
+        token = token[:-1]
+    return token
+
+def analyze(text: str) -> List[str]:
+    """Lowercase, strip accents, drop elisions (l', d', qu') and stopwords, stem"""
+    tokens = _TOKEN_RE.findall(_strip_accents(text.lower()))
+    return [_stem(token) for token in tokens if len(token) > 1 and token not in STOPWORDS]
+
+class LexicalTenantIndex:
+    """Inverted index of the chunks of one (user, agent) partition, scored with BM25"""
+
+    def __init__(self, user_id: int, agent_id: Optional[int]):
+        self.user_id = user_id
+        self.agent_id = agent_id
+        self.lock = threading.RLock()
+        self.snapshot_bytes = 0
+        self.log_bytes = 0
+        self._reset()
+
+    def _reset(self):
+        self.chunk_docs: Dict[int, int] = {}  # chunk_id -> document_id
+        self.doc_chunks: Dict[int, set] = {}  # document_id -> chunk_ids
+        self.chunk_terms: Dict[int, Dict[str, int]] = {}  # chunk_id -> term frequencies
+        self.chunk_lengths: Dict[int, int] = {}
+        self.postings: Dict[str, Dict[int, int]] = {}  # term -> {chunk_id: tf}
+        self.total_length = 0
+
+    @property
+    def path(self) -> str:
+        agent = self.agent_id if self.agent_id is not None else "none"
+        return os.path.join(LEXICAL_INDEX_DIR, f"user_{self.user_id}_agent_{agent}.json")
+
+    @property
+    def log_path(self) -> str:
+        return self.path + ".log"
+
+    @property
+    def max_chunk_id(self) -> Optional[int]:
+        return max(self.chunk_docs) if self.chunk_docs else None
+
+    def _index(self, chunk_id: int, document_id: int, terms: Dict[str, int]):
+        self.chunk_docs[chunk_id] = document_id
+        self.doc_chunks.setdefault(document_id, set()).add(chunk_id)
+        self.chunk_terms[chunk_id] = terms
+        length = sum(terms.values())
+        self.chunk_lengths[chunk_id] = length
+        self.total_length += length
+        for term, tf in terms.items():
+            self.postings.setdefault(term, {})[chunk_id] = tf
+
+    def add(self, chunk_ids: List[int], document_ids: List[int], texts: List[str]):
+        """Add or replace chunks"""
+        self.add_terms(chunk_ids, document_ids, [dict(Counter(analyze(text))) for text in texts])
+
+    def add_terms(self, chunk_ids: List[int], document_ids: List[int], chunk_terms: List[Dict[str, int]]):
+        with self.lock:
+            self.remove_chunks([cid for cid in chunk_ids if cid in self.chunk_docs])
+            for chunk_id, document_id, terms in zip(chunk_ids, document_ids, chunk_terms):
+                self._index(chunk_id, document_id, terms)
+
+    def remove_chunks(self, chunk_ids: List[int]):
+        with self.lock:
+            for chunk_id in chunk_ids:
+                document_id = self.chunk_docs.pop(chunk_id, None)
+                if document_id is None:
+                    continue
+                self.doc_chunks[document_id].discard(chunk_id)
+                if not self.doc_chunks[document_id]:
+                    del self.doc_chunks[document_id]
+                self.total_length -= self.chunk_lengths.pop(chunk_id)
+                for term in self.chunk_terms.pop(chunk_id):
+                    posting = self.postings[term]
+                    del posting[chunk_id]
+                    if not posting:
+                        del self.postings[term]
+
+    def remove_document(self, document_id: int):
+        with self.lock:
+            self.remove_chunks(list(self.doc_chunks.get(document_id, ())))
+
+    def search(self, terms: List[str], top_k: int, document_ids: Optional[set] = None) -> List[Tuple[int, float]]:
+        """Top-k (chunk_id, BM25 score) for analyzed query terms; only chunks sharing a term are scored"""
+        with self.lock:
+            n = len(self.chunk_docs)
+            if not n or not terms:
+                return []
+            avg_length = self.total_length / n or 1.0
+            scores: Dict[int, float] = {}
+            for term, query_tf in Counter(terms).items():
+                posting = self.postings.get(term)
+                if not posting:
+                    continue
+                idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+                for chunk_id, tf in posting.items():
+                    if document_ids is not None and self.chunk_docs[chunk_id] not in document_ids:
+                        continue
+                    norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * self.chunk_lengths[chunk_id] / avg_length)
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + query_tf * idf * tf * (BM25_K1 + 1) / norm
+            return sorted(scores.items(), key=lambda hit: hit[1], reverse=True)[:top_k]
+
+    def save(self):
+        """Persist the term frequencies atomically (postings are rebuilt on load), emptying the log"""
+        with self.lock:
+            os.makedirs(LEXICAL_INDEX_DIR, exist_ok=True)
+            with open(self.path + ".tmp", "w") as f:
+                json.dump({"chunk_docs": self.chunk_docs, "chunk_terms": self.chunk_terms}, f)
+            os.replace(self.path + ".tmp", self.path)
+            # Operations of the log are in the snapshot now (replaying them again would be harmless)
+            if os.path.exists(self.log_path):
+                os.unlink(self.log_path)
+            self.snapshot_bytes = os.path.getsize(self.path)
+            self.log_bytes = 0
+
+    def _append(self, operation: dict):
+        """Persist one add/remove operation at the end of the log, compacting it once it outgrows the snapshot"""
+        os.makedirs(LEXICAL_INDEX_DIR, exist_ok=True)
+        line = json.dumps(operation) + "\n"
+        with open(self.log_path, "a") as f:
+            f.write(line)
+        self.log_bytes += len(line)
+        if self.log_bytes > max(self.snapshot_bytes, LOG_COMPACT_MIN_BYTES):
+            self.save()
+
+    def log_add(self, chunk_ids: List[int], document_ids: List[int], texts: List[str]):
+        """add() persisted as a log entry (cost proportional to the chunks added, not to the partition)"""
+        chunk_terms = [dict(Counter(analyze(text))) for text in texts]
+        with self.lock:
+            self.add_terms(chunk_ids, document_ids, chunk_terms)
+            self._append({"add": [list(chunk_ids), list(document_ids), chunk_terms]})
+
+    def log_remove_document(self, document_id: int):
+        """remove_document() persisted as a log entry"""
+        with self.lock:
+            self.remove_document(document_id)
+            self._append({"remove_document": document_id})
+
+    def _replay(self, operation: dict):
+        if "add" in operation:
+            self.add_terms(*operation["add"])
+        elif "remove_document" in operation:
+            self.remove_document(operation["remove_document"])
+
+    def load(self) -> bool:
+        """Load the snapshot, then replay the log written since"""
+        if not os.path.exists(self.path) and not os.path.exists(self.log_path):
+            return False
+        with self.lock:
+            self._reset()
+            if os.path.exists(self.path):
+                try:
+                    with open(self.path) as f:
+                        meta = json.load(f)
+                except Exception as e:
+                    logger.warning(f"Could not load lexical index {self.path}: {e}")
+                    return False
+                for chunk_id, document_id in meta["chunk_docs"].items():
+                    self._index(int(chunk_id), document_id, meta["chunk_terms"][chunk_id])
+                self.snapshot_bytes = os.path.getsize(self.path)
+            if os.path.exists(self.log_path):
+                with open(self.log_path) as f:
+                    for line in f:
+                        try:
+                            operation = json.loads(line)
+                        except ValueError:
+                            # Last line cut short by a crash; sync() fetches what is missing from the database
+                            logger.warning(f"Truncated entry in lexical index log {self.log_path}")
+                            break
+                        self._replay(operation)
+                        self.log_bytes += len(line)
+        return True
+
+    def _partition_query(self, db: Session, *columns):
+        return db.query(*columns).join(Document, DocumentChunk.document_id == Document.id).filter(
+            Document.user_id == self.user_id,
+            Document.agent_id == self.agent_id if self.agent_id is not None else Document.agent_id.is_(None)
+        )
+
+    def _load_rows(self, query):
+        batch = []
+        for row in query.yield_per(1000):
+            batch.append(row)
+            if len(batch) >= 1000:
+                self.add(*zip(*batch))
+                batch = []
+        if batch:
+            self.add(*zip(*batch))
+
+    def sync(self, db: Session, db_count: int, db_max_id: Optional[int]) -> bool:
+        """Bring the partition up to date: new chunks by id, then id reconciliation if counts differ"""
+        with self.lock:
+            if len(self.chunk_docs) == db_count and self.max_chunk_id == db_max_id:
+                return False
+            columns = (DocumentChunk.id, DocumentChunk.document_id, DocumentChunk.content)
+            if self.chunk_docs:
+                self._load_rows(self._partition_query(db, *columns).filter(DocumentChunk.id > self.max_chunk_id))
+            else:
+                self._load_rows(self._partition_query(db, *columns))
+            if len(self.chunk_docs) != db_count:
+                db_ids = {chunk_id for (chunk_id,) in self._partition_query(db, DocumentChunk.id)}
+                known = set(self.chunk_docs)
+                self.remove_chunks(list(known - db_ids))
+                missing = list(db_ids - known)
+                for start in range(0, len(missing), 1000):
+                    self._load_rows(self._partition_query(db, *columns).filter(
+                        DocumentChunk.id.in_(missing[start:start + 1000])
+                    ))
+        logger.info(f"Synced lexical index {self.path} ({len(self.chunk_docs)} chunks, {len(self.postings)} terms)")
+        return True
+
+class LexicalIndexManager:
+    """Keeps one LexicalTenantIndex per (user_id, agent_id) partition in memory and on disk"""
+
+    def __init__(self):
+        self._indexes: Dict[Tuple[int, Optional[int]], LexicalTenantIndex] = {}
+        self._synced: Dict[int, Tuple[float, List[LexicalTenantIndex]]] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, user_id: int, agent_id: Optional[int]) -> LexicalTenantIndex:
+        key = (user_id, agent_id)
+        with self._lock:
+            tenant = self._indexes.get(key)
+            if tenant is None:
+                tenant = LexicalTenantIndex(user_id, agent_id)
+                tenant.load()
+                self._indexes[key] = tenant
+            return tenant
+
+    def _invalidate(self, user_id: int):
+        with self._lock:
+            self._synced.pop(user_id, None)
+
+    def _sync_user(self, db: Session, user_id: int) -> List[LexicalTenantIndex]:
+        cached = self._synced.get(user_id)
+        if cached and time.monotonic() - cached[0] < SYNC_INTERVAL:
+            return cached[1]
+
+        stats = db.query(
+            Document.agent_id, func.count(DocumentChunk.id), func.max(DocumentChunk.id)
+        ).join(DocumentChunk, DocumentChunk.document_id == Document.id).filter(
+            Document.user_id == user_id
+        ).group_by(Document.agent_id).all()
+
+        tenants = []
+        for agent_id, chunk_count, max_id in stats:
+            tenant = self._get(user_id, agent_id)
+            if tenant.sync(db, chunk_count, max_id):
+                tenant.save()
+            tenants.append(tenant)
+        self._synced[user_id] = (time.monotonic(), tenants)
+        return tenants
+
+    def search(self, db: Session, question: str, user_id: int, top_k: int = 3,
+               selected_doc_ids: List[int] = None) -> List[Tuple[int, float]]:
+        """Top-k (chunk_id, BM25 score) across the user's partitions"""
+        terms = analyze(question)
+        if not terms:
+            return []
+        document_ids = set(selected_doc_ids) if selected_doc_ids else None
+        hits = []
+        for tenant in self._sync_user(db, user_id):
+            hits.extend(tenant.search(terms, top_k, document_ids))
+        hits.sort(key=lambda hit: hit[1], reverse=True)
+        return hits[:top_k]
+
+    def add_document(self, user_id: int, agent_id: Optional[int], document_id: int,
+                     chunk_ids: List[int], texts: List[str]):
+        """Incrementally index the chunks of a newly stored document"""
+        tenant = self._get(user_id, agent_id)
+        tenant.log_add(chunk_ids, [document_id] * len(chunk_ids), texts)
+        self._invalidate(user_id)
+
+    def remove_document(self, user_id: int, agent_id: Optional[int], document_id: int):
+        tenant = self._get(user_id, agent_id)
+        tenant.log_remove_document(document_id)
+        self._invalidate(user_id)
+
+    def drop_partition(self, user_id: int, agent_id: Optional[int]):
+        """Forget an agent's partition (agent deleted)"""
+        with self._lock:
+            tenant = self._indexes.pop((user_id, agent_id), None)
+        path = tenant.path if tenant else LexicalTenantIndex(user_id, agent_id).path
+        for stale in glob.glob(path + "*"):
+            os.unlink(stale)
+        self._invalidate(user_id)
+
+def reciprocal_rank_fusion(rankings: List[List[Tuple[int, float]]], k: int = 60) -> List[Tuple[int, float]]:
+    """Fuse ranked (id, score) lists: score(id) = sum over lists of 1 / (k + rank)"""
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, (item_id, _) in enumerate(ranking, 1):
+            fused[item_id] = fused.get(item_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda hit: hit[1], reverse=True)
+
+# Instance globale partagée par le moteur RAG et l'API
+lexical_index = LexicalIndexManager()
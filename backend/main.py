@@ -1,20 +1,35 @@
-from fastapi import FastAPI, UploadFile, File, Depends, HTTPException, Request
+from fastapi import FastAPI, UploadFile, File, Form, Depends, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer
 from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
+import asyncio
 import logging
 import os
 import time
 import json
 import io
 from datetime import datetime
+from typing import List, Optional
 
 from auth import create_access_token, verify_token, hash_password, verify_password
-from database import get_db, init_db, User, Document, Agent, Base, engine
-from rag_engine import get_answer, get_answer_with_files, process_document_for_user
+from database import get_db, init_db, User, Document, Agent, IngestJob, Base, engine
+from rag_engine import get_answer, get_answer_with_files, process_document_for_user, answer_flights
+from vector_store import vector_index
+from lexical_index import lexical_index
+from blob_store import blob_store
+from reembed import start_reembed_worker, stop_reembed_worker
+from openai_client import close_async_client, chat_flights
+from openai_scheduler import openai_scheduler
+from file_loader import shutdown_pdf_pool
+from extractors import is_supported, shutdown_extract_pool, SUPPORTED_EXTENSIONS, ExtractionError
+from bulk_ingest import spool_uploads, close_uploads, expand_uploads, create_job, start_job, job_status, watch_interrupted_jobs, BULK_UPLOAD_MAX_BYTES
+from redis_cache import bump_corpus_version, close_redis, answer_cache
+from embedding_cache import embedding_cache, query_embedding_flights
+from semantic_cache import semantic_cache
 from file_generator import FileGenerator
+from streaming_response import stream_answer_events
 from utils import logger, event_tracker
 
 # Setup Google Cloud Logging
@@ -37,6 +52,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+interrupted_jobs_watcher: Optional[asyncio.Task] = None
+
 # Initialize database on startup
 @app.on_event("startup")
 async def startup_event():
@@ -55,35 +72,79 @@ async def startup_event():
     except Exception as e:
         logger.error(f"Database initialization failed: {e}")
         # Don't raise exception to allow the app to start, but log the error
+    
+    # Optional background backfill / re-embedding of document chunks
+    start_reembed_worker()
+    
+    # Bulk upload jobs left running by a stopped instance are marked failed
+    global interrupted_jobs_watcher
+    interrupted_jobs_watcher = asyncio.create_task(watch_interrupted_jobs())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background workers and release pooled connections"""
+    stop_reembed_worker()
+    if interrupted_jobs_watcher is not None:
+        interrupted_jobs_watcher.cancel()
+    # Partitions changed in the last VECTOR_INDEX_SAVE_DELAY seconds
+    await asyncio.to_thread(vector_index.flush)
+    await close_async_client()
+    await close_redis()
+    shutdown_extract_pool()
+    shutdown_pdf_pool()
 
 async def run_migrations():
     """Run database migrations"""
+    from sqlalchemy import text
+    
     try:
-        from sqlalchemy import text
-        
         with engine.connect() as conn:
-            # Check if agent_id column exists in documents table
-            result = conn.execute(text("""
-                SELECT column_name 
-                FROM information_schema.columns 
-                WHERE table_name = 'documents' AND column_name = 'agent_id'
-            """))
-            
-            if not result.fetchone():
-                logger.info("Adding agent_id column to documents table...")
-                conn.execute(text("""
-                    ALTER TABLE documents 
-                    ADD COLUMN agent_id INTEGER REFERENCES agents(id)
-                """))
-                conn.commit()
-                logger.info("agent_id column added successfully")
-            else:
-                logger.info("agent_id column already exists")
+            add_column_if_missing(conn, "documents", "agent_id", "INTEGER REFERENCES agents(id)")
+            add_column_if_missing(conn, "document_chunks", "embedding_f32", "BYTEA")
+            add_column_if_missing(conn, "document_chunks", "embedding_model", "VARCHAR(100)")
+            add_column_if_missing(conn, "document_chunks", "embedding_dim", "INTEGER")
+            add_column_if_missing(conn, "document_chunks", "embedded_at", "TIMESTAMP")
+            add_column_if_missing(conn, "documents", "chunk_count", "INTEGER")
+            add_column_if_missing(conn, "documents", "summary_excerpt", "TEXT")
+            add_column_if_missing(conn, "documents", "summary", "TEXT")
+            add_column_if_missing(conn, "documents", "blob_key", "VARCHAR(64)")
+            add_column_if_missing(conn, "documents", "content_type", "VARCHAR(100)")
+            add_column_if_missing(conn, "documents", "size_bytes", "INTEGER")
+            add_column_if_missing(conn, "document_chunks", "page_start", "INTEGER")
+            add_column_if_missing(conn, "document_chunks", "page_end", "INTEGER")
+            add_column_if_missing(conn, "document_chunks", "char_start", "INTEGER")
+            add_column_if_missing(conn, "document_chunks", "char_end", "INTEGER")
+            add_column_if_missing(conn, "document_chunks", "content_hash", "VARCHAR(64)")
+            add_column_if_missing(conn, "documents", "version", "INTEGER DEFAULT 1")
+            add_column_if_missing(conn, "documents", "updated_at", "TIMESTAMP")
+            # New chunks are offsets into documents.content instead of a copy of their text;
+            # uncompressed out-of-line storage lets substr() read only the TOAST slices it needs
+            conn.execute(text("ALTER TABLE document_chunks ALTER COLUMN chunk_text DROP NOT NULL"))
+            conn.execute(text("ALTER TABLE documents ALTER COLUMN content SET STORAGE EXTERNAL"))
+            conn.commit()
                 
     except Exception as e:
         logger.error(f"Migration failed: {e}")
         # Don't raise exception to allow the app to continue
 
+def add_column_if_missing(conn, table: str, column: str, definition: str):
+    """Add a column to an existing table if it doesn't exist yet"""
+    from sqlalchemy import text
+    
+    result = conn.execute(text("""
+        SELECT column_name 
+        FROM information_schema.columns 
+        WHERE table_name = :table AND column_name = :column
+    """), {"table": table, "column": column})
+    
+    if not result.fetchone():
+        logger.info(f"Adding {column} column to {table} table...")
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {definition}"))
+        conn.commit()
+        logger.info(f"{column} column added successfully")
+    else:
+        logger.info(f"{column} column already exists")
+
 # Health check endpoints
 @app.get("/")
 async def root():
@@ -95,6 +156,25 @@ async def health_check():
     """Health check endpoint"""
     return {"status": "healthy", "service": "TAIC Companion API"}
 
+@app.get("/cache/stats")
+async def cache_stats():
+    """Hit/miss counters of the answer, semantic and embedding caches, and shared in-flight calls (this instance)"""
+    return {
+        "answers": answer_cache.stats(),
+        "semantic_answers": semantic_cache.stats(),
+        "embeddings": embedding_cache.stats(),
+        "single_flight": {
+            "answers": answer_flights.stats(),
+            "query_embeddings": query_embedding_flights.stats(),
+            "chat": chat_flights.stats()
+        }
+    }
+
+@app.get("/openai/stats")
+async def openai_stats():
+    """Queue depth per priority, calls in flight and rate-limit budgets of the OpenAI scheduler (this instance)"""
+    return openai_scheduler.stats()
+
 # Pydantic models
 class UserCreate(BaseModel):
     username: str
@@ -192,7 +272,7 @@ async def ask_question(
         logger.info(f"Selected documents: {request.selected_documents}")
         
         # Get only the answer (plus simple)
-        answer = get_answer(
+        answer = await get_answer(
             request.question, 
             int(user_id), 
             db, 
@@ -209,6 +289,34 @@ async def ask_question(
         logger.error(f"Error answering question for user {user_id}: {e}")
         return {"answer": f"Désolé, une erreur s'est produite lors du traitement de votre question. Détails: {str(e)}"}
 
+@app.post("/ask/stream")
+async def ask_question_stream(
+    request: QuestionRequest,
+    user_id: str = Depends(verify_token)
+):
+    """Ask question to RAG system, streaming the answer as Server-Sent Events"""
+    start_time = time.time()
+    logger.info(f"Processing streamed question from user {user_id}: {request.question}")
+    
+    async def events():
+        async for event in stream_answer_events(
+            request.question,
+            int(user_id),
+            selected_doc_ids=request.selected_documents,
+            agent_type=request.agent_type
+        ):
+            yield event
+        
+        response_time = time.time() - start_time
+        logger.info(f"Streamed question answered for user {user_id} in {response_time:.2f}s")
+        event_tracker.track_question_asked(int(user_id), request.question, response_time)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.post("/upload")
 async def upload_file(
     file: UploadFile = File(...),
@@ -222,14 +330,13 @@ async def upload_file(
             raise HTTPException(status_code=413, detail="File too large (max 10MB)")
         
         # Check file type
-        allowed_types = ['.pdf', '.txt', '.docx']
-        if not any(file.filename.lower().endswith(ext) for ext in allowed_types):
-            raise HTTPException(status_code=400, detail="File type not supported")
+        if not is_supported(file.filename):
+            raise HTTPException(status_code=400, detail=f"File type not supported ({', '.join(SUPPORTED_EXTENSIONS)})")
         
         content = await file.read()
         
         # Process document (agent_id will be None if not provided)
-        doc_id = process_document_for_user(file.filename, content, int(user_id), db, agent_id=None)
+        doc_id = await process_document_for_user(file.filename, content, int(user_id), db, agent_id=None)
         
         logger.info(f"Document uploaded for user {user_id}: {file.filename}")
         event_tracker.track_document_upload(int(user_id), file.filename, len(content))
@@ -238,6 +345,9 @@ async def upload_file(
     
     except HTTPException:
         raise
+    except ExtractionError as e:
+        logger.warning(f"Rejected upload: {e}")
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
         logger.error(f"Error uploading document: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
@@ -264,9 +374,8 @@ async def upload_file_for_agent(
             raise HTTPException(status_code=413, detail="File too large (max 10MB)")
         
         # Check file type
-        allowed_types = ['.pdf', '.txt', '.docx']
-        if not any(file.filename.lower().endswith(ext) for ext in allowed_types):
-            raise HTTPException(status_code=400, detail="File type not supported")
+        if not is_supported(file.filename):
+            raise HTTPException(status_code=400, detail=f"File type not supported ({', '.join(SUPPORTED_EXTENSIONS)})")
         
         # Verify agent belongs to the user
         agent = db.query(Agent).filter(Agent.id == agent_id, Agent.user_id == int(user_id)).first()
@@ -274,7 +383,7 @@ async def upload_file_for_agent(
             raise HTTPException(status_code=404, detail="Agent not found or doesn't belong to user")
         
         content = await file.read()
-        doc_id = process_document_for_user(file.filename, content, int(user_id), db, agent_id)
+        doc_id = await process_document_for_user(file.filename, content, int(user_id), db, agent_id)
         
         logger.info(f"Document uploaded for user {user_id}, agent {agent_id}: {file.filename}")
         event_tracker.track_document_upload(int(user_id), file.filename, len(content))
@@ -283,10 +392,68 @@ async def upload_file_for_agent(
     
     except HTTPException:
         raise
+    except ExtractionError as e:
+        logger.warning(f"Rejected upload: {e}")
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
         logger.error(f"Error uploading document: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+@app.post("/upload-bulk")
+async def upload_bulk(
+    files: List[UploadFile] = File(...),
+    agent_id: Optional[int] = Form(None),
+    user_id: str = Depends(verify_token),
+    db: Session = Depends(get_db)
+):
+    """Upload many files and/or ZIP archives at once; they are ingested in the background, poll the returned job"""
+    try:
+        if agent_id is not None:
+            agent = db.query(Agent).filter(Agent.id == agent_id, Agent.user_id == int(user_id)).first()
+            if not agent:
+                raise HTTPException(status_code=404, detail="Agent not found or doesn't belong to user")
+        
+        if sum(file.size or 0 for file in files) > BULK_UPLOAD_MAX_BYTES:
+            raise HTTPException(status_code=413, detail=f"Upload too large (max {BULK_UPLOAD_MAX_BYTES // (1024 * 1024)}MB)")
+        
+        # Streamed to temporary files (the limit is checked while reading), ZIPs are opened from there
+        try:
+            uploads = await spool_uploads(files)
+        except ValueError as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        try:
+            items = await asyncio.to_thread(expand_uploads, uploads)
+            job = create_job(db, int(user_id), agent_id, items)
+        except ValueError as e:
+            close_uploads(uploads)
+            raise HTTPException(status_code=413, detail=str(e))
+        except Exception:
+            close_uploads(uploads)
+            raise
+        start_job(job, items, uploads)
+        logger.info(f"Bulk upload job {job.id} for user {user_id}, agent {agent_id}: {len(items)} files")
+        event_tracker.track_user_action(int(user_id), "bulk_upload", {"job_id": job.id, "files": len(items)})
+        
+        return job_status(job)
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error starting bulk upload: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@app.get("/upload-bulk/{job_id}")
+async def get_bulk_upload(
+    job_id: str,
+    user_id: str = Depends(verify_token),
+    db: Session = Depends(get_db)
+):
+    """Progress of a bulk upload, with the status of each file"""
+    job = db.query(IngestJob).filter(IngestJob.id == job_id, IngestJob.user_id == int(user_id)).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_status(job)
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
@@ -485,10 +652,28 @@ async def delete_document(
         if not document:
             raise HTTPException(status_code=404, detail="Document not found")
         
+        agent_id = document.agent_id
+        blob_key = document.blob_key
+        
         # Delete document
         db.delete(document)
         db.commit()
         
+        # Blobs are shared by identical uploads, keep it while another document uses it
+        def delete_blob():
+            if blob_key and not db.query(Document.id).filter(Document.blob_key == blob_key).first():
+                blob_store.delete(blob_key)
+        
+        # A network round trip with the GCS backend
+        await asyncio.to_thread(delete_blob)
+        
+        # The tenant's index files are rewritten, keep it off the event loop
+        await asyncio.gather(
+            asyncio.to_thread(vector_index.remove_document, int(user_id), agent_id, document_id),
+            asyncio.to_thread(lexical_index.remove_document, int(user_id), agent_id, document_id)
+        )
+        await bump_corpus_version(int(user_id), agent_id)
+        
         logger.info(f"Document {document_id} deleted by user {user_id}")
         event_tracker.track_user_action(int(user_id), f"document_deleted:{document.filename}")
         
@@ -558,9 +743,31 @@ async def delete_agent(
         if not agent:
             raise HTTPException(status_code=404, detail="Agent not found")
         
+        # The agent's documents go with it (cascade), collect their blobs first
+        blob_keys = {
+            blob_key for (blob_key,) in db.query(Document.blob_key).filter(
+                Document.agent_id == agent_id,
+                Document.blob_key.isnot(None)
+            )
+        }
+        
         db.delete(agent)
         db.commit()
         
+        # Same rule as delete_document: keep a blob while another document uses it
+        def delete_blobs():
+            for blob_key in blob_keys:
+                if not db.query(Document.id).filter(Document.blob_key == blob_key).first():
+                    blob_store.delete(blob_key)
+        
+        await asyncio.to_thread(delete_blobs)
+        
+        await asyncio.gather(
+            asyncio.to_thread(vector_index.drop_partition, int(user_id), agent_id),
+            asyncio.to_thread(lexical_index.drop_partition, int(user_id), agent_id)
+        )
+        await bump_corpus_version(int(user_id), agent_id)
+        
         return {"message": "Agent deleted successfully"}
     except HTTPException:
         raise
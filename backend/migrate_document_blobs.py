@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Script pour déplacer les fichiers d'origine de documents.content vers le blob store
+
+Les anciennes lignes stockent str(content) : le texte pour les .txt, la
+représentation Python des octets (b'%PDF...') pour les PDF et DOCX. Le script
+reconstitue le fichier, l'écrit dans le blob store (BLOB_STORE_BACKEND),
+puis remplace content par le texte extrait avec l'extracteur du format
+(extractors.py, comme pour un nouvel upload). Traitement par lots sur l'id,
+relançable : seules les lignes sans blob_key sont reprises.
+Usage: python migrate_document_blobs.py [--batch-size 50] [--start-id 0]
+"""
+import sys
+import os
+import argparse
+import ast
+import mimetypes
+import time
+
+# Ajouter le répertoire parent au PATH pour les imports
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from database import engine
+from blob_store import blob_store
+from extractors import get_extractor, ExtractionError
+from sqlalchemy import text
+
+NEW_COLUMNS = [
+    ("blob_key", "VARCHAR(64)"),
+    ("content_type", "VARCHAR(100)"),
+    ("size_bytes", "INTEGER"),
+]
+
+def add_blob_columns(conn):
+    """Ajoute les colonnes blob_key, content_type et size_bytes si elles n'existent pas"""
+    for column, definition in NEW_COLUMNS:
+        result = conn.execute(text("""
+            SELECT column_name
+            FROM information_schema.columns
+            WHERE table_name = 'documents' AND column_name = :column
+        """), {"column": column})
+
+        if result.fetchone():
+            print(f"✅ La colonne '{column}' existe déjà dans la table 'documents'")
+            continue
+
+        print(f"⚠️  La colonne '{column}' n'existe pas. Ajout en cours...")
+        conn.execute(text(f"ALTER TABLE documents ADD COLUMN {column} {definition}"))
+        conn.commit()
+        print(f"✅ Colonne '{column}' ajoutée avec succès")
+
+def extract_upload(filename: str, raw: bytes) -> str:
+    """Texte du fichier, extrait par l'extracteur de son extension"""
+    extractor = get_extractor(filename)
+    if extractor is None:
+        raise ExtractionError(f"Type de fichier non supporté: {filename}")
+    return "".join(piece for _, piece in extractor(raw))
+
+def recover_upload(filename: str, content: str):
+    """Reconstitue (fichier d'origine, texte extrait) à partir de l'ancien contenu"""
+    if content.startswith(("b'", 'b"')):
+        raw = ast.literal_eval(content)
+        return raw, extract_upload(filename, raw)
+    return content.encode('utf-8'), content
+
+def migrate_documents(batch_size: int = 50, start_id: int = 0):
+    """Déplace les fichiers par lots, chaque lot dans sa propre transaction"""
+    try:
+        print("Connexion à la base de données PostgreSQL...")
+
+        with engine.connect() as conn:
+            add_blob_columns(conn)
+
+            remaining = conn.execute(text("""
+                SELECT COUNT(*) FROM documents
+                WHERE blob_key IS NULL AND content IS NOT NULL AND id > :start_id
+            """), {"start_id": start_id}).scalar()
+            print(f"📋 {remaining} documents à migrer")
+
+            last_id = start_id
+            migrated = 0
+            old_bytes = 0
+            new_bytes = 0
+            started = time.time()
+
+            while True:
+                rows = conn.execute(text("""
+                    SELECT id, filename, content FROM documents
+                    WHERE blob_key IS NULL AND content IS NOT NULL AND id > :last_id
+                    ORDER BY id
+                    LIMIT :batch_size
+                """), {"last_id": last_id, "batch_size": batch_size}).fetchall()
+
+                if not rows:
+                    break
+
+                updates = []
+                for document_id, filename, content in rows:
+                    try:
+                        raw, extracted = recover_upload(filename, content)
+                    except Exception as e:
+                        print(f"  ⚠️  Document {document_id} ({filename}) ignoré: {e}")
+                        continue
+                    old_bytes += len(content)
+                    new_bytes += len(extracted)
+                    updates.append({
+                        "id": document_id,
+                        "blob_key": blob_store.put(raw),
+                        "content_type": mimetypes.guess_type(filename)[0],
+                        "size_bytes": len(raw),
+                        "content": extracted
+                    })
+
+                # Les blobs sont écrits avant la mise à jour, une reprise ne perd rien
+                if updates:
+                    conn.execute(text("""
+                        UPDATE documents
+                        SET blob_key = :blob_key, content_type = :content_type,
+                            size_bytes = :size_bytes, content = :content
+                        WHERE id = :id
+                    """), updates)
+                    conn.commit()
+
+                last_id = rows[-1][0]
+                migrated += len(updates)
+                print(f"  ... {migrated}/{remaining} documents migrés (dernier id: {last_id}, {time.time() - started:.1f}s)")
+
+            if old_bytes:
+                print(f"📉 Taille de documents.content: {old_bytes / 1e6:.1f} MB -> {new_bytes / 1e6:.1f} MB")
+            print(f"✅ {migrated} documents migrés vers le blob store")
+            return True
+
+    except Exception as e:
+        print(f"❌ Erreur lors de la migration des documents: {e}")
+        print(f"   Relancez avec --start-id {last_id if 'last_id' in locals() else start_id} pour reprendre")
+        import traceback
+        traceback.print_exc()
+        return False
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migration des fichiers d'origine vers le blob store")
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--start-id", type=int, default=0)
+    args = parser.parse_args()
+
+    success = migrate_documents(args.batch_size, args.start_id)
+    if success:
+        print("\n🎉 Migration terminée avec succès!")
+    else:
+        print("\n💥 Échec de la migration")
+        sys.exit(1)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Script pour convertir les embeddings JSON (document_chunks.embedding) en float32 binaire (embedding_f32)
+
+Le script traite les chunks par lots en suivant l'ordre des ids et peut être
+interrompu puis relancé : seules les lignes encore au format JSON sont reprises.
+Usage: python migrate_embeddings_to_binary.py [--batch-size 500] [--start-id 0]
+"""
+import sys
+import os
+import argparse
+import json
+import time
+
+# Ajouter le répertoire parent au PATH pour les imports
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from database import engine
+from embedding_codec import pack_embedding
+from sqlalchemy import text
+
+def add_embedding_f32_column(conn):
+    """Ajoute la colonne embedding_f32 si elle n'existe pas"""
+    result = conn.execute(text("""
+        SELECT column_name 
+        FROM information_schema.columns 
+        WHERE table_name = 'document_chunks' AND column_name = 'embedding_f32'
+    """))
+    
+    if result.fetchone():
+        print("✅ La colonne 'embedding_f32' existe déjà dans la table 'document_chunks'")
+        return
+    
+    print("⚠️  La colonne 'embedding_f32' n'existe pas. Ajout en cours...")
+    conn.execute(text("ALTER TABLE document_chunks ADD COLUMN embedding_f32 BYTEA"))
+    conn.commit()
+    print("✅ Colonne 'embedding_f32' ajoutée avec succès")
+
+def convert_embeddings(batch_size: int = 500, start_id: int = 0):
+    """Convertit les embeddings JSON par lots, chaque lot dans sa propre transaction"""
+    try:
+        print("Connexion à la base de données PostgreSQL...")
+        
+        with engine.connect() as conn:
+            add_embedding_f32_column(conn)
+            
+            remaining = conn.execute(text("""
+                SELECT COUNT(*) FROM document_chunks 
+                WHERE embedding IS NOT NULL AND id > :start_id
+            """), {"start_id": start_id}).scalar()
+            print(f"📋 {remaining} chunks à convertir")
+            
+            last_id = start_id
+            converted = 0
+            json_bytes = 0
+            binary_bytes = 0
+            started = time.time()
+            
+            while True:
+                rows = conn.execute(text("""
+                    SELECT id, embedding FROM document_chunks 
+                    WHERE embedding IS NOT NULL AND id > :last_id
+                    ORDER BY id
+                    LIMIT :batch_size
+                """), {"last_id": last_id, "batch_size": batch_size}).fetchall()
+                
+                if not rows:
+                    break
+                
+                updates = []
+                for chunk_id, embedding in rows:
+                    packed = pack_embedding(json.loads(embedding))
+                    json_bytes += len(embedding)
+                    binary_bytes += len(packed)
+                    updates.append({"id": chunk_id, "packed": packed})
+                
+                # Écrit le binaire et libère la colonne JSON dans la même transaction
+                conn.execute(text("""
+                    UPDATE document_chunks 
+                    SET embedding_f32 = :packed, embedding = NULL 
+                    WHERE id = :id
+                """), updates)
+                conn.commit()
+                
+                last_id = rows[-1][0]
+                converted += len(rows)
+                print(f"  ... {converted}/{remaining} chunks convertis (dernier id: {last_id}, {time.time() - started:.1f}s)")
+            
+            if binary_bytes:
+                print(f"📉 Taille des embeddings: {json_bytes / 1e6:.1f} MB -> {binary_bytes / 1e6:.1f} MB ({json_bytes / binary_bytes:.1f}x)")
+            print(f"✅ {converted} chunks convertis en float32 binaire")
+            return True
+            
+    except Exception as e:
+        print(f"❌ Erreur lors de la conversion des embeddings: {e}")
+        print(f"   Relancez avec --start-id {last_id if 'last_id' in locals() else start_id} pour reprendre")
+        import traceback
+        traceback.print_exc()
+        return False
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Conversion des embeddings JSON en float32 binaire")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--start-id", type=int, default=0)
+    args = parser.parse_args()
+    
+    success = convert_embeddings(args.batch_size, args.start_id)
+    if success:
+        print("\n🎉 Migration terminée avec succès!")
+    else:
+        print("\n💥 Échec de la migration")
+        sys.exit(1)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Script pour préparer le backend de recherche pgvector (VECTOR_INDEX_BACKEND=pgvector)
+
+Active l'extension vector, ajoute document_chunks.embedding_vec vector(N) et
+embedding_vec_at, recopie les embeddings existants (embedding_f32 ou JSON)
+par lots sur l'id, puis crée l'index HNSW ou IVFFlat en distance cosinus.
+Relançable : seules les lignes sans embedding_vec_at, ou ré-embeddées depuis
+(embedded_at plus récent), sont reprises. Ensuite l'ingestion et reembed.py
+écrivent embedding_vec eux-mêmes.
+Usage: python migrate_pgvector.py [--index hnsw|ivfflat] [--batch-size 500] [--start-id 0]
+"""
+import sys
+import os
+import argparse
+import math
+import time
+
+# Ajouter le répertoire parent au PATH pour les imports
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from database import engine
+from embedding_codec import unpack_embedding
+from pgvector_store import write_vectors
+from vector_store import dimension
+from sqlalchemy import text
+
+def add_vector_columns(conn):
+    """Active l'extension et ajoute les colonnes embedding_vec / embedding_vec_at"""
+    conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+    conn.execute(text(f"ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS embedding_vec vector({dimension})"))
+    conn.execute(text("ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS embedding_vec_at TIMESTAMP"))
+    conn.commit()
+    print(f"✅ Extension 'vector' et colonne 'embedding_vec' vector({dimension}) prêtes")
+
+def create_vector_index(conn, index_type: str):
+    """Crée l'index ANN en distance cosinus (opérateur <=>)"""
+    if index_type == "hnsw":
+        conn.execute(text("""
+            CREATE INDEX IF NOT EXISTS ix_document_chunks_embedding_vec
+            ON document_chunks USING hnsw (embedding_vec vector_cosine_ops) WITH (m = 16, ef_construction = 64)
+        """))
+    else:
+        # IVFFlat se construit à partir des données : environ rows / 1000 listes
+        rows = conn.execute(text("SELECT COUNT(*) FROM document_chunks WHERE embedding_vec IS NOT NULL")).scalar()
+        lists = max(10, int(rows / 1000) if rows < 1_000_000 else int(math.sqrt(rows)))
+        conn.execute(text(f"""
+            CREATE INDEX IF NOT EXISTS ix_document_chunks_embedding_vec
+            ON document_chunks USING ivfflat (embedding_vec vector_cosine_ops) WITH (lists = {lists})
+        """))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_document_chunks_document_id ON document_chunks (document_id)"))
+    conn.commit()
+    print(f"✅ Index {index_type} créé sur document_chunks.embedding_vec")
+
+def migrate_vectors(index_type: str = "hnsw", batch_size: int = 500, start_id: int = 0):
+    """Recopie les embeddings par lots, chaque lot dans sa propre transaction, puis indexe"""
+    try:
+        print("Connexion à la base de données PostgreSQL...")
+
+        with engine.connect() as conn:
+            add_vector_columns(conn)
+
+            remaining = conn.execute(text("""
+                SELECT COUNT(*) FROM document_chunks
+                WHERE (embedding_vec_at IS NULL OR embedded_at > embedding_vec_at)
+                  AND (embedding_f32 IS NOT NULL OR embedding IS NOT NULL) AND id > :start_id
+            """), {"start_id": start_id}).scalar()
+            print(f"📋 {remaining} chunks à copier")
+
+            last_id = start_id
+            copied = 0
+            started = time.time()
+
+            while True:
+                rows = conn.execute(text("""
+                    SELECT id, embedding_f32, embedding, embedded_at FROM document_chunks
+                    WHERE (embedding_vec_at IS NULL OR embedded_at > embedding_vec_at)
+                      AND (embedding_f32 IS NOT NULL OR embedding IS NOT NULL) AND id > :last_id
+                    ORDER BY id
+                    LIMIT :batch_size
+                """), {"last_id": last_id, "batch_size": batch_size}).fetchall()
+
+                if not rows:
+                    break
+
+                write_vectors(conn, [
+                    (chunk_id, unpack_embedding(packed, legacy_json), embedded_at)
+                    for chunk_id, packed, legacy_json, embedded_at in rows
+                ], dimension)
+                conn.commit()
+
+                last_id = rows[-1][0]
+                copied += len(rows)
+                print(f"  ... {copied}/{remaining} chunks copiés (dernier id: {last_id}, {time.time() - started:.1f}s)")
+
+            print(f"✅ {copied} embeddings copiés dans embedding_vec")
+            # L'index est construit après la copie, c'est bien plus rapide qu'une insertion indexée
+            create_vector_index(conn, index_type)
+            return True
+
+    except Exception as e:
+        print(f"❌ Erreur lors de la migration pgvector: {e}")
+        print(f"   Relancez avec --start-id {last_id if 'last_id' in locals() else start_id} pour reprendre")
+        import traceback
+        traceback.print_exc()
+        return False
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migration des embeddings vers pgvector")
+    parser.add_argument("--index", choices=["hnsw", "ivfflat"], default="hnsw")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--start-id", type=int, default=0)
+    args = parser.parse_args()
+
+    success = migrate_vectors(args.index, args.batch_size, args.start_id)
+    if success:
+        print("\n🎉 Migration terminée avec succès! Activez VECTOR_INDEX_BACKEND=pgvector")
+    else:
+        print("\n💥 Échec de la migration")
+        sys.exit(1)
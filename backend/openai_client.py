@@ -1,7 +1,13 @@
+import asyncio
 import os
-from openai import OpenAI
+from typing import List, Optional
+from openai import OpenAI, AsyncOpenAI, RateLimitError
 from google.cloud import secretmanager
 import logging
+from tokenizer import count_tokens
+from openai_scheduler import openai_scheduler, Priority, OpenAIBusyError, OPENAI_RATE_LIMIT_RETRIES, retry_after
+from redis_cache import stable_key
+from single_flight import SingleFlight
 
 logger = logging.getLogger(__name__)
 
@@ -40,10 +46,14 @@ if not api_key:
 
 logger.info(f"OpenAI API key found: {'Yes' if api_key else 'No'}")
 
+# OpenAI-compatible endpoint, e.g. fake_openai_server.py for load tests (default: api.openai.com)
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
+
 # Initialize OpenAI client with custom configuration for Cloud Run
 import httpx
 client = OpenAI(
     api_key=api_key,
+    base_url=OPENAI_BASE_URL,
     timeout=30.0,
     max_retries=3,
     http_client=httpx.Client(
@@ -53,20 +63,51 @@ client = OpenAI(
     )
 )
 
-def get_embedding_fast(text: str) -> list:
+# Embedding model written by ingestion and by the re-embedding tool (see reembed.py)
+EMBEDDING_MODEL = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
+EMBEDDING_DIMENSIONS = int(os.getenv("OPENAI_EMBEDDING_DIMENSIONS", "1536"))
+
+def create_embeddings(texts: List[str], model: str = EMBEDDING_MODEL) -> List[list]:
+    """Single embeddings API call for a list of texts, in input order (raises on failure)"""
+    kwargs = {}
+    if model.startswith("text-embedding-3"):
+        # Keep the vector size stable across models so indexes stay compatible
+        kwargs["dimensions"] = EMBEDDING_DIMENSIONS
+    response = client.embeddings.create(input=texts, model=model, **kwargs)
+    # The API may not preserve order, sort by index
+    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+def get_embedding_fast(text: str, model: str = EMBEDDING_MODEL) -> list:
     """Get embedding for text with fast timeout"""
     try:
-        response = client.embeddings.create(
-            input=text,
-            model="text-embedding-3-small"
-        )
-        return response.data[0].embedding
+        return create_embeddings([text], model)[0]
     except Exception as e:
         logger.error(f"Error getting fast embedding: {e}")
         # Return dummy embedding immediately
-        return [0.0] * 1536  # text-embedding-3-small has 1536 dimensions
+        return [0.0] * EMBEDDING_DIMENSIONS
+
+# Ingestion: many chunks per embeddings call, several calls in flight
+EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", "100000"))
+EMBEDDING_BATCH_MAX_INPUTS = int(os.getenv("EMBEDDING_BATCH_MAX_INPUTS", "512"))
+EMBEDDING_BATCH_CONCURRENCY = int(os.getenv("EMBEDDING_BATCH_CONCURRENCY", "4"))
+EMBEDDING_INPUT_MAX_TOKENS = 8191  # limite par entrée de text-embedding-3-small
+
+def make_embedding_batches(texts: List[str]) -> List[List[int]]:
+    """Group text indices into batches that fit the per-request token budget"""
+    batches = []
+    current, current_tokens = [], 0
+    for i, text in enumerate(texts):
+        tokens = min(count_tokens(text), EMBEDDING_INPUT_MAX_TOKENS)
+        if current and (current_tokens + tokens > EMBEDDING_BATCH_MAX_TOKENS or len(current) >= EMBEDDING_BATCH_MAX_INPUTS):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(i)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
 
-def get_embedding(text: str) -> list:
+def get_embedding(text: str, model: str = EMBEDDING_MODEL) -> list:
     """Get embedding for text with robust retry logic"""
     import time
     max_retries = 5
@@ -74,12 +115,9 @@ def get_embedding(text: str) -> list:
     for attempt in range(max_retries):
         try:
             logger.info(f"Attempting to get embedding (attempt {attempt + 1}/{max_retries})")
-            response = client.embeddings.create(
-                input=text,
-                model="text-embedding-3-small"
-            )
+            embedding = create_embeddings([text], model)[0]
             logger.info("Successfully got embedding from OpenAI")
-            return response.data[0].embedding
+            return embedding
         except Exception as e:
             logger.error(f"Error getting embedding (attempt {attempt + 1}/{max_retries}): {e}")
             if attempt < max_retries - 1:
@@ -90,6 +128,20 @@ def get_embedding(text: str) -> list:
                 logger.error("All embedding attempts failed")
                 raise e
 
+CHAT_MODEL = os.getenv("OPENAI_CHAT_MODEL", "gpt-4")
+
+def chat_request(prompt: str) -> dict:
+    """Chat completion parameters shared by the sync, async and streaming paths"""
+    return {
+        "model": CHAT_MODEL,
+        "messages": [
+            {"role": "system", "content": "Vous êtes un assistant IA professionnel et précis."},
+            {"role": "user", "content": prompt}
+        ],
+        "max_tokens": 1000,
+        "temperature": 0.7
+    }
+
 def get_chat_response(prompt: str) -> str:
     """Get chat response from OpenAI with robust retry logic"""
     import time
@@ -98,15 +150,7 @@ def get_chat_response(prompt: str) -> str:
     for attempt in range(max_retries):
         try:
             logger.info(f"Attempting to get chat response (attempt {attempt + 1}/{max_retries})")
-            response = client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": "Vous êtes un assistant IA professionnel et précis."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=1000,
-                temperature=0.7
-            )
+            response = client.chat.completions.create(**chat_request(prompt))
             logger.info("Successfully got response from OpenAI")
             return response.choices[0].message.content
         except Exception as e:
@@ -118,3 +162,197 @@ def get_chat_response(prompt: str) -> str:
             else:
                 logger.error("All chat response attempts failed")
                 raise e
+
+# Async client for the FastAPI handlers: a single pooled transport shared by all
+# requests, and asyncio.sleep backoff so a slow OpenAI call never blocks the event loop.
+# Every call goes through openai_scheduler (priorities, rate limits); the SDK's own
+# retries are disabled so a 429 is never retried behind the scheduler's back
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "20"))
+
+async_client = AsyncOpenAI(
+    api_key=api_key,
+    base_url=OPENAI_BASE_URL,
+    timeout=30.0,
+    max_retries=0,
+    http_client=httpx.AsyncClient(
+        timeout=30.0,
+        limits=httpx.Limits(max_connections=OPENAI_MAX_CONNECTIONS, max_keepalive_connections=OPENAI_MAX_CONNECTIONS),
+        http2=False  # Force HTTP/1.1 for better Cloud Run compatibility
+    )
+)
+
+# Raised once the scheduler has given up: retrying them again here would only add load
+NOT_RETRIED = (RateLimitError, OpenAIBusyError)
+
+async def create_embeddings_async(texts: List[str], model: str = EMBEDDING_MODEL,
+                                  priority: Priority = Priority.INGESTION) -> List[list]:
+    """Async single embeddings API call for a list of texts, in input order (raises on failure)"""
+    kwargs = {}
+    if model.startswith("text-embedding-3"):
+        kwargs["dimensions"] = EMBEDDING_DIMENSIONS
+    tokens = sum(min(count_tokens(text), EMBEDDING_INPUT_MAX_TOKENS) for text in texts)
+    response = await openai_scheduler.call(
+        priority, model, tokens,
+        lambda: async_client.embeddings.with_raw_response.create(input=texts, model=model, **kwargs)
+    )
+    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+async def get_embedding_fast_async(text: str, model: str = EMBEDDING_MODEL) -> list:
+    """Async get_embedding_fast: no retry, dummy embedding on failure"""
+    try:
+        return (await create_embeddings_async([text], model, Priority.QUERY_EMBEDDING))[0]
+    except Exception as e:
+        logger.error(f"Error getting fast embedding: {e}")
+        return [0.0] * EMBEDDING_DIMENSIONS
+
+async def get_embedding_async(text: str, model: str = EMBEDDING_MODEL) -> list:
+    """Async get_embedding (question embedding priority) with exponential backoff on non rate-limit errors"""
+    max_retries = 5
+    
+    for attempt in range(max_retries):
+        try:
+            logger.info(f"Attempting to get embedding (attempt {attempt + 1}/{max_retries})")
+            embedding = (await create_embeddings_async([text], model, Priority.QUERY_EMBEDDING))[0]
+            logger.info("Successfully got embedding from OpenAI")
+            return embedding
+        except NOT_RETRIED:
+            raise
+        except Exception as e:
+            logger.error(f"Error getting embedding (attempt {attempt + 1}/{max_retries}): {e}")
+            if attempt < max_retries - 1:
+                wait_time = 2 ** attempt  # Exponential backoff
+                logger.info(f"Waiting {wait_time} seconds before retry...")
+                await asyncio.sleep(wait_time)
+            else:
+                logger.error("All embedding attempts failed")
+                raise e
+
+def chat_request_tokens(request: dict) -> int:
+    """Tokens a chat request counts against the per-minute budget (prompt plus max_tokens)"""
+    return sum(count_tokens(message["content"]) + 4 for message in request["messages"]) + request["max_tokens"]
+
+# Identical prompts sent at the same time (e.g. same question on the same documents) make one completion
+chat_flights = SingleFlight("chat")
+
+async def get_chat_response_async(prompt: str, priority: Priority = Priority.CHAT) -> str:
+    """Async get_chat_response; concurrent calls with the same prompt share one completion"""
+    request = chat_request(prompt)
+    return await chat_flights.do(stable_key(request), lambda: _get_chat_response_async(request, priority))
+
+async def _get_chat_response_async(request: dict, priority: Priority) -> str:
+    """Chat completion with exponential backoff on non rate-limit errors"""
+    max_retries = 5
+    
+    for attempt in range(max_retries):
+        try:
+            logger.info(f"Attempting to get chat response (attempt {attempt + 1}/{max_retries})")
+            response = await openai_scheduler.call(
+                priority, CHAT_MODEL, chat_request_tokens(request),
+                lambda: async_client.chat.completions.with_raw_response.create(**request)
+            )
+            logger.info("Successfully got response from OpenAI")
+            return response.choices[0].message.content
+        except NOT_RETRIED:
+            raise
+        except Exception as e:
+            logger.error(f"Error getting chat response (attempt {attempt + 1}/{max_retries}): {e}")
+            if attempt < max_retries - 1:
+                wait_time = 2 ** attempt  # Exponential backoff
+                logger.info(f"Waiting {wait_time} seconds before retry...")
+                await asyncio.sleep(wait_time)
+            else:
+                logger.error("All chat response attempts failed")
+                raise e
+
+async def stream_chat_response_async(prompt: str):
+    """Stream a chat completion: yields ("delta", text) pairs, then ("usage", dict).
+
+    The stream holds its scheduler slot until it ends.
+    """
+    max_retries = 3
+    request = chat_request(prompt)
+    tokens = chat_request_tokens(request)
+    
+    # Only opening the stream is retried, never after tokens have been sent
+    attempt, rate_limited, started = 0, 0, False
+    while True:
+        try:
+            async with openai_scheduler.slot(Priority.CHAT, CHAT_MODEL, tokens):
+                raw = await async_client.chat.completions.with_raw_response.create(
+                    **request,
+                    stream=True,
+                    stream_options={"include_usage": True}
+                )
+                openai_scheduler.observe(CHAT_MODEL, raw.headers)
+                started = True
+                async for chunk in raw.parse():
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield "delta", chunk.choices[0].delta.content
+                    if getattr(chunk, "usage", None):
+                        yield "usage", {
+                            "prompt_tokens": chunk.usage.prompt_tokens,
+                            "completion_tokens": chunk.usage.completion_tokens,
+                            "total_tokens": chunk.usage.total_tokens
+                        }
+            return
+        except RateLimitError as e:
+            # Back in the queue until the model's rate limit window is over
+            openai_scheduler.rate_limited_for(CHAT_MODEL, e.response.headers, retry_after(e.response.headers))
+            rate_limited += 1
+            if rate_limited > OPENAI_RATE_LIMIT_RETRIES:
+                raise
+        except OpenAIBusyError:
+            raise
+        except Exception as e:
+            if started:
+                raise
+            logger.error(f"Error opening chat stream (attempt {attempt + 1}/{max_retries}): {e}")
+            attempt += 1
+            if attempt < max_retries:
+                await asyncio.sleep(2 ** (attempt - 1))
+            else:
+                raise e
+
+async def _embed_batch_async(texts: List[str], priority: Priority, max_retries: int = 3) -> List[Optional[list]]:
+    """Embed one batch in a single API call; None for each text when every attempt failed"""
+    for attempt in range(max_retries):
+        try:
+            return await create_embeddings_async(texts, priority=priority)
+        except NOT_RETRIED as e:
+            logger.error(f"Batch embeddings for {len(texts)} texts rate limited: {e}")
+            break
+        except Exception as e:
+            logger.error(f"Error getting batch embeddings for {len(texts)} texts (attempt {attempt + 1}/{max_retries}): {e}")
+            if attempt < max_retries - 1:
+                await asyncio.sleep(2 ** attempt)
+    
+    logger.error(f"All batch embedding attempts failed, {len(texts)} texts left without embedding")
+    return [None] * len(texts)
+
+async def get_embeddings_batch_async(texts: List[str], priority: Priority = Priority.INGESTION) -> List[Optional[list]]:
+    """Get embeddings for many texts with few, concurrent API calls (same order as texts).
+
+    Texts of a batch that failed get None: stored without a vector, they are
+    embedded later by the re-embedding worker (see reembed.py).
+    """
+    if not texts:
+        return []
+    
+    batches = make_embedding_batches(texts)
+    logger.info(f"Embedding {len(texts)} texts in {len(batches)} batch(es)")
+    semaphore = asyncio.Semaphore(EMBEDDING_BATCH_CONCURRENCY)
+    
+    async def embed(batch):
+        async with semaphore:
+            return await _embed_batch_async([texts[i] for i in batch], priority)
+    
+    results = await asyncio.gather(*(embed(batch) for batch in batches))
+    embeddings = [None] * len(texts)
+    for batch, batch_embeddings in zip(batches, results):
+        for i, embedding in zip(batch, batch_embeddings):
+            embeddings[i] = embedding
+    return embeddings
+
+async def close_async_client():
+    """Release the pooled connections (application shutdown)"""
+    await async_client.close()
@@ -0,0 +1,273 @@
+# Ordonnancement des appels OpenAI : priorités (chat, question, ingestion, ré-embedding) et quotas par minute lus dans les en-têtes
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import re
+import time
+from contextlib import asynccontextmanager
+from enum import IntEnum
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from openai import RateLimitError
+
+logger = logging.getLogger(__name__)
+
+# Requests sent at once to OpenAI; the last OPENAI_INTERACTIVE_RESERVE slots are kept for interactive calls
+OPENAI_MAX_IN_FLIGHT = int(os.getenv("OPENAI_MAX_CONNECTIONS", "20"))
+OPENAI_INTERACTIVE_RESERVE = int(os.getenv("OPENAI_INTERACTIVE_RESERVE", "4"))
+# Starting per-model limits, replaced by the x-ratelimit-* headers of the first response
+OPENAI_RPM_LIMIT = int(os.getenv("OPENAI_RPM_LIMIT", "500"))
+OPENAI_TPM_LIMIT = int(os.getenv("OPENAI_TPM_LIMIT", "300000"))
+# An interactive call waiting longer than this for capacity fails instead of piling up
+OPENAI_QUEUE_TIMEOUT = float(os.getenv("OPENAI_QUEUE_TIMEOUT", "30"))
+# 429 responses retried per call, after the wait OpenAI asks for (shared by all queued calls)
+OPENAI_RATE_LIMIT_RETRIES = int(os.getenv("OPENAI_RATE_LIMIT_RETRIES", "4"))
+
+class Priority(IntEnum):
+    CHAT = 0  # Answer the user is waiting for
+    QUERY_EMBEDDING = 1  # Question embedding, before retrieval
+    INGESTION = 2  # Chunk embeddings and summaries of uploads
+    BACKGROUND = 3  # Re-embedding / backfill of stored chunks (see reembed.py)
+
+class OpenAIBusyError(Exception):
+    """No capacity for an interactive call within OPENAI_QUEUE_TIMEOUT"""
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Seconds of an OpenAI reset duration such as '20ms', '1s' or '6m0s'"""
+    if not value:
+        return None
+    parts = _DURATION_RE.findall(value)
+    if not parts:
+        return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+def retry_after(headers) -> float:
+    """Wait asked by a 429 response, in seconds"""
+    if headers.get("retry-after-ms"):
+        return float(headers["retry-after-ms"]) / 1000
+    if headers.get("retry-after"):
+        try:
+            return float(headers["retry-after"])
+        except ValueError:
+            pass
+    waits = [parse_duration(headers.get(name)) for name in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens")]
+    return max([wait for wait in waits if wait] or [1.0])
+
+class RateBucket:
+    """Requests or tokens available per minute, refilled continuously"""
+
+    def __init__(self, limit: float):
+        self.limit = limit
+        self.available = limit
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.available = min(self.limit, self.available + (now - self.updated) * self.limit / 60)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until amount is available (a request larger than the limit waits for a full bucket)"""
+        amount = min(amount, self.limit)
+        if self.available >= amount:
+            return 0.0
+        return (amount - self.available) * 60 / self.limit
+
+    def observe(self, limit: Optional[str], remaining: Optional[str]):
+        """Align with the counters OpenAI reported"""
+        try:
+            if limit:
+                self.limit = max(float(limit), 1.0)
+            if remaining:
+                self.available = min(float(remaining), self.limit)
+                self.updated = time.monotonic()
+        except ValueError:
+            pass
+
+class _ModelLimits:
+    def __init__(self):
+        self.requests = RateBucket(OPENAI_RPM_LIMIT)
+        self.tokens = RateBucket(OPENAI_TPM_LIMIT)
+        self.paused_until = 0.0
+
+    def wait_time(self, now: float, tokens: int) -> float:
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        return max(self.paused_until - now, self.requests.wait_time(1), self.tokens.wait_time(tokens))
+
+class _Waiter:
+    def __init__(self, priority: Priority, model: str, tokens: int):
+        self.priority = priority
+        self.model = model
+        self.tokens = tokens
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.enqueued = time.monotonic()
+
+class OpenAIScheduler:
+    """Single queue in front of every async OpenAI call.
+
+    Calls are granted by priority (chat, then question embeddings, then
+    ingestion, then background re-embedding), within the requests-per-minute
+    and tokens-per-minute budget of their model and the number of requests in
+    flight. Budgets follow the
+    x-ratelimit-* headers of each response; a 429 pauses the model for the wait
+    OpenAI asks for and puts the call back in the queue. Callers wait in the
+    queue instead of sleeping and retrying on their own, and ingestion and
+    background calls can never take the slots reserved for interactive calls.
+    """
+
+    def __init__(self, max_in_flight: int = OPENAI_MAX_IN_FLIGHT, interactive_reserve: int = OPENAI_INTERACTIVE_RESERVE):
+        self.max_in_flight = max_in_flight
+        self.interactive_reserve = min(interactive_reserve, max_in_flight - 1)
+        self._queue: List[tuple] = []
+        self._sequence = itertools.count()
+        self._limits: Dict[str, _ModelLimits] = {}
+        self._in_flight = {priority: 0 for priority in Priority}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.granted = {priority: 0 for priority in Priority}
+        self.wait_seconds = {priority: 0.0 for priority in Priority}
+        self.rate_limited = 0
+        self.timeouts = 0
+
+    def _model(self, model: str) -> _ModelLimits:
+        if model not in self._limits:
+            self._limits[model] = _ModelLimits()
+        return self._limits[model]
+
+    def _dispatch(self):
+        """Grant queued calls in priority order; a call that must wait blocks later calls of its model only"""
+        now = time.monotonic()
+        in_flight = sum(self._in_flight.values())
+        blocked, next_check, waiting = set(), None, []
+        while self._queue:
+            entry = heapq.heappop(self._queue)
+            waiter = entry[2]
+            if waiter.future.done():  # Timed out or cancelled
+                continue
+            limit = self.max_in_flight - (self.interactive_reserve if waiter.priority >= Priority.INGESTION else 0)
+            wait = 0.0 if waiter.model in blocked else self._model(waiter.model).wait_time(now, waiter.tokens)
+            if waiter.model in blocked or in_flight >= limit or wait > 0:
+                blocked.add(waiter.model)
+                if wait > 0:
+                    next_check = wait if next_check is None else min(next_check, wait)
+                waiting.append(entry)
+                continue
+            limits = self._model(waiter.model)
+            limits.requests.available -= 1
+            limits.tokens.available -= waiter.tokens
+            self._in_flight[waiter.priority] += 1
+            in_flight += 1
+            self.granted[waiter.priority] += 1
+            self.wait_seconds[waiter.priority] += now - waiter.enqueued
+            waiter.future.set_result(None)
+        for entry in waiting:
+            heapq.heappush(self._queue, entry)
+
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if next_check is not None:
+            self._timer = asyncio.get_running_loop().call_later(next_check, self._dispatch)
+
+    async def _acquire(self, priority: Priority, model: str, tokens: int):
+        waiter = _Waiter(priority, model, tokens)
+        heapq.heappush(self._queue, (priority, next(self._sequence), waiter))
+        self._dispatch()
+        timeout = OPENAI_QUEUE_TIMEOUT if priority < Priority.INGESTION else None
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            waiter.future.cancel()
+            raise OpenAIBusyError(f"OpenAI capacity not available within {OPENAI_QUEUE_TIMEOUT:g}s")
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self._release(priority)  # Granted just as the caller went away
+            else:
+                waiter.future.cancel()
+            raise
+
+    def _release(self, priority: Priority):
+        self._in_flight[priority] -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, priority: Priority, model: str, tokens: int):
+        """Hold a request slot of the model for the duration of the block (e.g. a whole stream)"""
+        await self._acquire(priority, model, tokens)
+        try:
+            yield
+        finally:
+            self._release(priority)
+
+    def observe(self, model: str, headers):
+        """Update the model's budgets from the x-ratelimit-* response headers"""
+        limits = self._model(model)
+        now = time.monotonic()
+        limits.requests.refill(now)
+        limits.tokens.refill(now)
+        limits.requests.observe(headers.get("x-ratelimit-limit-requests"), headers.get("x-ratelimit-remaining-requests"))
+        limits.tokens.observe(headers.get("x-ratelimit-limit-tokens"), headers.get("x-ratelimit-remaining-tokens"))
+
+    def rate_limited_for(self, model: str, headers, wait: float):
+        """A 429: no call of the model is granted before the wait is over"""
+        self.rate_limited += 1
+        self.observe(model, headers)
+        limits = self._model(model)
+        limits.paused_until = max(limits.paused_until, time.monotonic() + wait)
+        logger.warning(f"OpenAI rate limit on {model}, pausing its calls for {wait:.1f}s")
+
+    async def call(self, priority: Priority, model: str, tokens: int, create: Callable[[], Awaitable]):
+        """Run create() (a with_raw_response API call) in a slot; returns the parsed response.
+
+        429 responses are retried through the queue, OPENAI_RATE_LIMIT_RETRIES
+        times at most; other errors are raised to the caller.
+        """
+        for attempt in range(OPENAI_RATE_LIMIT_RETRIES + 1):
+            async with self.slot(priority, model, tokens):
+                try:
+                    raw = await create()
+                except RateLimitError as e:
+                    self.rate_limited_for(model, e.response.headers, retry_after(e.response.headers))
+                    if attempt == OPENAI_RATE_LIMIT_RETRIES:
+                        raise
+                    continue
+                self.observe(model, raw.headers)
+                return raw.parse()
+
+    def stats(self) -> dict:
+        """Queue depth, calls in flight and budgets (this instance)"""
+        queued = {priority.name.lower(): 0 for priority in Priority}
+        for priority, _, waiter in self._queue:
+            if not waiter.future.done():
+                queued[Priority(priority).name.lower()] += 1
+        now = time.monotonic()
+        models = {}
+        for model, limits in self._limits.items():
+            limits.requests.refill(now)
+            limits.tokens.refill(now)
+            models[model] = {
+                "requests_available": int(limits.requests.available),
+                "requests_per_minute": int(limits.requests.limit),
+                "tokens_available": int(limits.tokens.available),
+                "tokens_per_minute": int(limits.tokens.limit),
+                "paused_seconds": round(max(limits.paused_until - now, 0.0), 2)
+            }
+        return {
+            "queued": queued,
+            "in_flight": {priority.name.lower(): count for priority, count in self._in_flight.items()},
+            "granted": {priority.name.lower(): count for priority, count in self.granted.items()},
+            "avg_wait_ms": {
+                priority.name.lower(): round(self.wait_seconds[priority] / self.granted[priority] * 1000, 1) if self.granted[priority] else 0.0
+                for priority in Priority
+            },
+            "rate_limited": self.rate_limited,
+            "timeouts": self.timeouts,
+            "models": models
+        }
+
+openai_scheduler = OpenAIScheduler()
@@ -0,0 +1,146 @@
+# Recherche vectorielle dans PostgreSQL (extension pgvector) : le top-k est calculé par la base
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from database import engine
+from embedding_codec import LEGACY_EMBEDDING_MODEL
+
+logger = logging.getLogger(__name__)
+
+PGVECTOR_EF_SEARCH = int(os.getenv("PGVECTOR_EF_SEARCH", "64"))  # HNSW
+PGVECTOR_PROBES = int(os.getenv("PGVECTOR_PROBES", "10"))  # IVFFlat
+# "relaxed_order" keeps filtered HNSW scans from returning fewer than k rows (pgvector >= 0.8,
+# as in the docker-compose image); set it empty for older versions
+PGVECTOR_ITERATIVE_SCAN = os.getenv("PGVECTOR_ITERATIVE_SCAN", "relaxed_order")
+# Seconds during which the embedding models of a user's chunks are cached
+SYNC_INTERVAL = float(os.getenv("VECTOR_INDEX_SYNC_INTERVAL", "2"))
+
+def vector_literal(embedding) -> Optional[str]:
+    """pgvector text form '[x,y,...]'; None for zero (dummy) vectors, which have no cosine distance"""
+    vector = np.asarray(embedding, dtype="float32")
+    if not vector.any():
+        return None
+    return "[" + ",".join(repr(x) for x in vector.tolist()) + "]"
+
+def write_vectors(conn, rows: List[Tuple[int, object, datetime]], dimension: int):
+    """Copy (chunk_id, embedding, embedded_at) rows into embedding_vec, in the caller's transaction"""
+    updates = []
+    for chunk_id, embedding, embedded_at in rows:
+        literal = vector_literal(embedding) if embedding is not None and len(embedding) == dimension else None
+        updates.append({"id": chunk_id, "vec": literal, "at": embedded_at or datetime.utcnow()})
+    if updates:
+        conn.execute(text("""
+            UPDATE document_chunks SET embedding_vec = CAST(:vec AS vector), embedding_vec_at = :at
+            WHERE id = :id
+        """), updates)
+
+class PgVectorIndex:
+    """Same interface as VectorIndexManager, backed by document_chunks.embedding_vec.
+
+    embedding_vec is written by the writers of embedding_f32: ingestion
+    (add_document) and re-embedding (reembed.py), so searches only read.
+    migrate_pgvector.py copies the vectors stored before (and any row whose
+    embedding_vec_at is older than its embedded_at).
+    """
+
+    def __init__(self, dimension: int):
+        self.dimension = dimension
+        self._models: Dict[Tuple[int, object], Tuple[float, List[str]]] = {}
+
+    def _invalidate(self, user_id: int):
+        """Forget the cached embedding models of the user's partitions"""
+        for key in [key for key in self._models if key[0] == user_id]:
+            del self._models[key]
+
+    def embedding_models(self, db: Session, user_id: int, agent_id=...) -> List[str]:
+        """Embedding models present in the user's chunks (more than one during a model migration)"""
+        cached = self._models.get((user_id, agent_id))
+        if cached and time.monotonic() - cached[0] < SYNC_INTERVAL:
+            return cached[1]
+        query = """
+            SELECT DISTINCT COALESCE(c.embedding_model, :legacy)
+            FROM document_chunks c JOIN documents d ON d.id = c.document_id
+            WHERE d.user_id = :user_id AND (c.embedding_f32 IS NOT NULL OR c.embedding IS NOT NULL)
+        """
+        params = {"user_id": user_id, "legacy": LEGACY_EMBEDDING_MODEL}
+        if agent_id is not ...:
+            query += " AND d.agent_id IS NULL" if agent_id is None else " AND d.agent_id = :agent_id"
+            params["agent_id"] = agent_id
+        models = sorted(model for (model,) in db.execute(text(query), params))
+        self._models[(user_id, agent_id)] = (time.monotonic(), models)
+        return models
+
+    def search(self, db: Session, query_embedding: Union[List[float], Dict[str, List[float]]], user_id: int,
+               top_k: int = 3, selected_doc_ids: List[int] = None, agent_id=...) -> List[Tuple[int, float]]:
+        """Top-k (chunk_id, cosine similarity), computed by Postgres with the embedding_vec index.
+
+        The HNSW index is shared by all tenants: when its filtered scan returns
+        fewer than k rows (iterative scan unavailable, or a small tenant), and for
+        searches restricted to selected documents, the rows are scored exactly.
+        """
+        if isinstance(query_embedding, dict):
+            queries = query_embedding.items()
+        else:
+            queries = [(model, query_embedding) for model in self.embedding_models(db, user_id, agent_id)]
+
+        filters = ["d.user_id = :user_id", "c.embedding_vec IS NOT NULL",
+                   "COALESCE(c.embedding_model, :legacy) = :model"]
+        params = {"user_id": user_id, "legacy": LEGACY_EMBEDDING_MODEL, "k": top_k}
+        if agent_id is not ...:
+            filters.append("d.agent_id IS NULL" if agent_id is None else "d.agent_id = :agent_id")
+            params["agent_id"] = agent_id
+        if selected_doc_ids:
+            filters.append("c.document_id = ANY(:doc_ids)")
+            params["doc_ids"] = list(selected_doc_ids)
+        select_sql = f"""
+            SELECT c.id, 1 - (c.embedding_vec <=> CAST(:q AS vector)) AS similarity
+            FROM document_chunks c JOIN documents d ON d.id = c.document_id
+            WHERE {' AND '.join(filters)}
+        """
+        sql = text(select_sql + " ORDER BY c.embedding_vec <=> CAST(:q AS vector) LIMIT :k")
+        # Same ordering through an expression the vector index cannot serve: exact scan of the filtered rows
+        exact_sql = text(select_sql + " ORDER BY (c.embedding_vec <=> CAST(:q AS vector)) + 0 LIMIT :k")
+
+        # Index scan settings only last for this transaction
+        db.execute(text(f"SET LOCAL hnsw.ef_search = {max(PGVECTOR_EF_SEARCH, top_k)}"))
+        db.execute(text(f"SET LOCAL ivfflat.probes = {PGVECTOR_PROBES}"))
+        if PGVECTOR_ITERATIVE_SCAN:
+            db.execute(text(f"SET LOCAL hnsw.iterative_scan = {PGVECTOR_ITERATIVE_SCAN}"))
+
+        hits = []
+        for model, embedding in queries:
+            literal = vector_literal(embedding) if embedding is not None and len(embedding) == self.dimension else None
+            if literal is None:
+                continue
+            query_params = {**params, "model": model, "q": literal}
+            rows = [] if selected_doc_ids else db.execute(sql, query_params).fetchall()
+            if len(rows) < top_k:
+                rows = db.execute(exact_sql, query_params).fetchall()
+            hits.extend((chunk_id, float(similarity)) for chunk_id, similarity in rows)
+        hits.sort(key=lambda hit: hit[1], reverse=True)
+        return hits[:top_k]
+
+    def add_document(self, user_id: int, agent_id: Optional[int], document_id: int, chunk_ids: List[int],
+                     embeddings: List[List[float]], model: str, embedded_at: Optional[datetime] = None):
+        """Write the vectors of a newly stored document"""
+        with engine.begin() as conn:
+            write_vectors(conn, [(chunk_id, embedding, embedded_at) for chunk_id, embedding in zip(chunk_ids, embeddings)], self.dimension)
+        self._invalidate(user_id)
+
+    def remove_document(self, user_id: int, agent_id: Optional[int], document_id: int):
+        """The vectors are deleted with their chunks, only the cached models may change"""
+        self._invalidate(user_id)
+
+    def drop_partition(self, user_id: int, agent_id: Optional[int]):
+        """The vectors are deleted with their chunks, only the cached models may change"""
+        self._invalidate(user_id)
+
+    def flush(self):
+        """Nothing to write: the vectors are in Postgres"""
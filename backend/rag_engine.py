@@ -1,35 +1,87 @@
 # Contient la logique RAG améliorée
-import json
+import asyncio
+import hashlib
 import logging
+import mimetypes
+import os
 import time
 from datetime import datetime
-from typing import List, Dict, Any, Tuple
-from sqlalchemy.orm import Session
-from openai_client import get_embedding, get_chat_response, get_embedding_fast
+from typing import List, Dict, Any, Optional, Tuple, Union
+from sqlalchemy import and_, case, delete, func, insert, select
+from sqlalchemy.orm import Session, aliased
+from openai_client import get_chat_response_async, EMBEDDING_MODEL, EMBEDDING_DIMENSIONS
+from openai_scheduler import Priority
+from embedding_cache import get_query_embedding, get_chunk_embeddings
 from database import Document, DocumentChunk, User
-from file_loader import load_text_from_pdf, chunk_text
+from file_loader import TokenChunker, page_range
+from extractors import extract_text, ExtractionError
 from file_generator import FileGenerator
+from vector_store import vector_index
+from lexical_index import lexical_index, reciprocal_rank_fusion
+from blob_store import blob_store, blob_key as content_key
+from embedding_codec import pack_embedding, unpack_embedding, embedding_model_column
+from redis_cache import answer_cache, corpus_version, bump_corpus_version, stable_key, normalize_question
+from semantic_cache import semantic_cache, SEMANTIC_CACHE_ENABLED
+from single_flight import SingleFlight
+from context_packer import pack_context
+from tokenizer import count_tokens
 
 logger = logging.getLogger(__name__)
 
-# Cache simple pour les réponses récentes
-_answer_cache = {}
+# Document summaries computed at ingest (see get_documents_summary)
+SUMMARY_EXCERPT_CHARS = 2000
+DOCUMENT_LLM_SUMMARY = os.getenv("DOCUMENT_LLM_SUMMARY", "false").lower() == "true"
+DOCUMENT_SUMMARY_SOURCE_CHARS = 8000
+# Multi-document summaries: missing per-document summaries are computed concurrently on first use
+# and stored (map), then one prompt combines them (reduce) within a token budget
+SUMMARY_MAP_CONCURRENCY = int(os.getenv("SUMMARY_MAP_CONCURRENCY", "4"))
+SUMMARY_REDUCE_TOKEN_BUDGET = int(os.getenv("SUMMARY_REDUCE_TOKEN_BUDGET", "6000"))
 
-def get_answer_with_files(question: str, user_id: int, db: Session, selected_doc_ids: List[int] = None, agent_type: str = None) -> Dict[str, Any]:
+# Hybrid retrieval: vector and BM25 candidates (top_k * factor each) fused by rank
+HYBRID_SEARCH_ENABLED = os.getenv("HYBRID_SEARCH_ENABLED", "true").lower() == "true"
+HYBRID_CANDIDATES_FACTOR = 3
+# Chunks on each side added to every retrieved chunk (one slice of the document text, overlaps not repeated)
+CONTEXT_NEIGHBOR_CHUNKS = int(os.getenv("CONTEXT_NEIGHBOR_CHUNKS", "0"))
+
+# Ingestion pipeline: chunks are sent for embedding in batches while later PDF pages are still parsed
+INGEST_EMBEDDING_BATCH = int(os.getenv("INGEST_EMBEDDING_BATCH", "64"))
+# Embedding batches in flight across all concurrent ingestions (bulk uploads run several at once)
+INGEST_EMBEDDING_CONCURRENCY = int(os.getenv("INGEST_EMBEDDING_CONCURRENCY", "4"))
+_ingest_embedding_slots = asyncio.Semaphore(INGEST_EMBEDDING_CONCURRENCY)
+
+# Answers being computed, by answer cache key
+answer_flights = SingleFlight("answer")
+
+def answer_cache_key(kind: str, question: str, user_id: int, selected_doc_ids: List[int], agent_type: str, version: str) -> str:
+    """Cache key of an answer; includes the corpus version so uploads/deletes invalidate it"""
+    doc_ids = sorted(selected_doc_ids) if selected_doc_ids else None
+    return stable_key(kind, user_id, normalize_question(question), doc_ids, agent_type, version)
+
+def user_has_documents(db: Session, user_id: int, selected_doc_ids: List[int] = None) -> bool:
+    """Whether the question will be answered from documents (otherwise nothing is worth embedding it for)"""
+    query = db.query(Document.id).filter(Document.user_id == user_id)
+    if selected_doc_ids:
+        query = query.filter(Document.id.in_(selected_doc_ids))
+    return query.first() is not None
+
+def semantic_scope_key(user_id: int, selected_doc_ids: List[int], agent_type: str) -> str:
+    """Questions are only compared with questions asked on the same documents and agent"""
+    doc_ids = sorted(selected_doc_ids) if selected_doc_ids else None
+    return stable_key("semantic", user_id, doc_ids, agent_type)
+
+async def get_answer_with_files(question: str, user_id: int, db: Session, selected_doc_ids: List[int] = None, agent_type: str = None) -> Dict[str, Any]:
     """Get answer using RAG with file generation capabilities"""
     try:
-        # Créer une clé de cache
-        cache_key = f"{user_id}_{hash(question)}_{hash(str(selected_doc_ids))}_{agent_type}"
-        
-        # Vérifier le cache (garde en cache pendant 5 minutes)
-        if cache_key in _answer_cache:
-            cached_time, cached_result = _answer_cache[cache_key]
-            if datetime.now().timestamp() - cached_time < 300:  # 5 minutes
-                logger.info("Returning cached answer")
-                return cached_result
+        # Vérifier le cache partagé
+        version = await corpus_version(user_id)
+        cache_key = answer_cache_key("answer_with_files", question, user_id, selected_doc_ids, agent_type, version)
+        cached_result = await answer_cache.get(cache_key)
+        if cached_result is not None:
+            logger.info("Returning cached answer")
+            return cached_result
         
         # Get the regular answer first
-        answer = get_answer(question, user_id, db, selected_doc_ids, agent_type)
+        answer = await get_answer(question, user_id, db, selected_doc_ids, agent_type)
         
         # Initialize file generator
         file_gen = FileGenerator()
@@ -55,12 +107,7 @@ def get_answer_with_files(question: str, user_id: int, db: Session, selected_doc
         }
         
         # Mettre en cache le résultat
-        _answer_cache[cache_key] = (datetime.now().timestamp(), result)
-        
-        # Nettoyer le cache (garder seulement les 10 dernières entrées)
-        if len(_answer_cache) > 10:
-            oldest_key = min(_answer_cache.keys(), key=lambda k: _answer_cache[k][0])
-            del _answer_cache[oldest_key]
+        await answer_cache.set(cache_key, result)
             
         return result
         
@@ -82,24 +129,27 @@ def get_agent_system_prompt(agent_type: str = None) -> str:
     else:
         return "Vous êtes un assistant IA professionnel."
 
-def get_direct_gpt_response(question: str, agent_type: str = None) -> str:
-    """Get direct response from GPT without RAG when no documents are available"""
-    try:
-        # Get agent-specific system prompt
-        agent_prompt = get_agent_system_prompt(agent_type)
-        
-        # Create prompt for direct GPT call
-        prompt = f"""{agent_prompt}
+def build_direct_prompt(question: str, agent_type: str = None) -> str:
+    """Prompt for a direct GPT call when the user has no documents"""
+    # Get agent-specific system prompt
+    agent_prompt = get_agent_system_prompt(agent_type)
+    
+    return f"""{agent_prompt}
 
 L'utilisateur n'a pas encore uploadé de documents. Répondez à sa question en utilisant vos connaissances générales, tout en gardant votre spécialisation à l'esprit.
 
 Question: {question}
 
 Réponse:"""
+
+async def get_direct_gpt_response(question: str, agent_type: str = None) -> str:
+    """Get direct response from GPT without RAG when no documents are available"""
+    try:
+        prompt = build_direct_prompt(question, agent_type)
         
         # Get AI response
         logger.info("Getting direct response from OpenAI (no documents)")
-        response = get_chat_response(prompt)
+        response = await get_chat_response_async(prompt)
         logger.info("Successfully got direct response from OpenAI")
         
         return response
@@ -108,70 +158,133 @@ Réponse:"""
         logger.error(f"Error getting direct GPT response: {e}")
         raise Exception(f"Erreur lors du traitement de votre question : {str(e)}")
 
-def get_answer(question: str, user_id: int, db: Session, selected_doc_ids: List[int] = None, agent_type: str = None) -> str:
+async def get_answer(question: str, user_id: int, db: Session, selected_doc_ids: List[int] = None, agent_type: str = None) -> str:
     """Get answer using RAG for specific user with OpenAI - always using embeddings"""
     try:
-        # Get user's documents (filter by selected documents if provided)
-        if selected_doc_ids:
-            user_docs = db.query(Document).filter(
-                Document.user_id == user_id,
-                Document.id.in_(selected_doc_ids)
-            ).all()
-            logger.info(f"Using {len(user_docs)} selected documents: {selected_doc_ids}")
-        else:
-            user_docs = db.query(Document).filter(Document.user_id == user_id).all()
-            logger.info(f"Using all {len(user_docs)} user documents")
+        version = await corpus_version(user_id)
+        cache_key = answer_cache_key("answer", question, user_id, selected_doc_ids, agent_type, version)
+        cached_answer = await answer_cache.get(cache_key)
+        if cached_answer is not None:
+            logger.info("Returning cached answer")
+            return cached_answer
+        
+        # Concurrent identical questions (same user, documents, agent and corpus version) share one computation
+        async def answer() -> str:
+            # Same question in other words: reuse the answer of the nearest previous question
+            question_embedding = None
+            if SEMANTIC_CACHE_ENABLED and await asyncio.to_thread(user_has_documents, db, user_id, selected_doc_ids):
+                scope_key = semantic_scope_key(user_id, selected_doc_ids, agent_type)
+                try:
+                    question_embedding = await get_query_embedding(question)
+                except Exception as e:
+                    logger.error(f"Question embedding failed, skipping semantic cache: {e}")
+            if question_embedding is not None:
+                cached_answer = semantic_cache.get(scope_key, version, question_embedding, question)
+                if cached_answer is not None:
+                    logger.info("Returning semantically cached answer")
+                    await answer_cache.set(cache_key, cached_answer)
+                    return cached_answer
             
-        if not user_docs:
-            if selected_doc_ids:
-                return "Aucun des documents sélectionnés n'a été trouvé. Veuillez vérifier votre sélection."
-            else:
-                # No documents available - use direct GPT call
-                logger.info("No documents found, using direct GPT call")
-                return get_direct_gpt_response(question, agent_type)
+            prepared = await prepare_answer(question, user_id, db, selected_doc_ids, agent_type)
+            if 'answer' in prepared:
+                return prepared['answer']
+            
+            # Always get AI response with retry
+            logger.info("Getting response from OpenAI")
+            response = await get_chat_response_async(prepared['prompt'])
+            logger.info("Successfully got response from OpenAI")
+            
+            await answer_cache.set(cache_key, response)
+            if question_embedding is not None:
+                semantic_cache.set(scope_key, version, question_embedding, question, response)
+            return response
+            
+        return await answer_flights.do(cache_key, answer, lambda: answer_cache.get(cache_key))
+    
+    except Exception as e:
+        logger.error(f"Error getting answer: {e}")
+        # Re-raise the exception to propagate to the API endpoint for proper error handling
+        raise Exception(f"Erreur lors du traitement de votre question avec l'API OpenAI : {str(e)}")
+
+async def prepare_answer(question: str, user_id: int, db: Session, selected_doc_ids: List[int] = None, agent_type: str = None) -> Dict[str, Any]:
+    """Retrieval and prompt construction shared by get_answer and the streaming endpoint.
+    
+    Returns {'prompt': ..., 'sources': [...]} when an LLM call is needed,
+    or {'answer': ...} when the answer is already known.
+    """
+    # Get user's document ids (filter by selected documents if provided)
+    def user_document_ids():
+        query = db.query(Document.id).filter(Document.user_id == user_id)
+        if selected_doc_ids:
+            query = query.filter(Document.id.in_(selected_doc_ids))
+        return query.all()
+    
+    user_docs = await asyncio.to_thread(user_document_ids)
+    if selected_doc_ids:
+        logger.info(f"Using {len(user_docs)} selected documents: {selected_doc_ids}")
+    else:
+        logger.info(f"Using all {len(user_docs)} user documents")
         
-        # Always get question embedding with retry
-        logger.info(f"Getting embedding for question: {question}")
-        query_embedding = get_embedding(question)
+    if not user_docs:
+        if selected_doc_ids:
+            return {'answer': "Aucun des documents sélectionnés n'a été trouvé. Veuillez vérifier votre sélection."}
+        else:
+            # No documents available - use direct GPT call
+            logger.info("No documents found, using direct GPT call")
+            return {'prompt': build_direct_prompt(question, agent_type), 'sources': []}
+    
+    # Always get question embedding with retry, once per embedding model
+    # present in the user's index (two while a model migration is running)
+    logger.info(f"Getting embedding for question: {question}")
+    models = await asyncio.to_thread(vector_index.embedding_models, db, user_id) or [EMBEDDING_MODEL]
+    try:
+        embeddings = await asyncio.gather(*(get_query_embedding(question, model=model) for model in models))
+        query_embedding = dict(zip(models, embeddings))
         logger.info("Successfully got query embedding")
-        
-        # Search similar chunks for this user (with optional document filtering)
-        logger.info(f"Searching similar texts for user {user_id}")
-        context_results = search_similar_texts_for_user(query_embedding, user_id, db, top_k=8, selected_doc_ids=selected_doc_ids)
-        
-        if not context_results:
-            return "Je n'ai pas trouvé d'informations pertinentes dans vos documents pour répondre à cette question."
-        
-        # Get complete document information
+    except Exception as e:
+        if not HYBRID_SEARCH_ENABLED:
+            raise
+        # Embeddings unavailable: answer from exact-term (BM25) matches only
+        logger.error(f"Query embedding failed, using lexical search only: {e}")
+        query_embedding = None
+    
+    # Search similar chunks for this user (with optional document filtering)
+    logger.info(f"Searching similar texts for user {user_id}")
+    # Index sync and scoring are CPU/DB work, keep them off the event loop
+    context_results = await asyncio.to_thread(
+        search_similar_texts_for_user, query_embedding, user_id, db, top_k=8,
+        selected_doc_ids=selected_doc_ids, question=question
+    )
+    
+    if not context_results:
+        return {'answer': "Je n'ai pas trouvé d'informations pertinentes dans vos documents pour répondre à cette question."}
+    
+    # Prepare context with document attribution: redundant chunks dropped, overlapping ones merged,
+    # within the context token budget
+    packed = pack_context(context_results)
+    parts = []
+    for doc_name, contexts in packed.by_document().items():
+        parts.append(f"\n--- Extraits du document '{doc_name}' ---\n")
+        parts.extend(f"Extrait {i}: {context}\n" for i, context in enumerate(contexts, 1))
+    enhanced_context = "".join(parts)
+    
+    # Check if user is asking for a summary of multiple documents
+    is_summary_request = any(word in question.lower() for word in ['résumé', 'résume', 'synthèse', 'présente', 'parle de quoi', 'contenu'])
+    is_multiple_docs = len(user_docs) > 1
+    
+    if is_summary_request and is_multiple_docs:
+        # Summaries are only loaded when this path needs them, the missing ones are computed now
         documents_info = get_documents_summary(user_id, db, selected_doc_ids)
+        await summarize_documents(documents_info, db)
         
-        # Prepare context with document attribution
-        context_by_document = {}
-        for result in context_results:
-            doc_name = result['document_name']
-            if doc_name not in context_by_document:
-                context_by_document[doc_name] = []
-            context_by_document[doc_name].append(result['text'])
-        
-        # Build enhanced context string
-        enhanced_context = ""
-        for doc_name, contexts in context_by_document.items():
-            enhanced_context += f"\n--- Extraits du document '{doc_name}' ---\n"
-            for i, context in enumerate(contexts, 1):
-                enhanced_context += f"Extrait {i}: {context}\n"
-        
-        # Check if user is asking for a summary of multiple documents
-        is_summary_request = any(word in question.lower() for word in ['résumé', 'résume', 'synthèse', 'présente', 'parle de quoi', 'contenu'])
-        is_multiple_docs = len(documents_info) > 1
-        
-        if is_summary_request and is_multiple_docs:
-            # Special handling for document summaries
-            documents_content = ""
-            for i, doc in enumerate(documents_info, 1):
-                documents_content += f"\n=== Document {i}: {doc['filename']} ===\n"
-                documents_content += f"Contenu: {doc['content']}\n"
-            
-            prompt = f"""Vous êtes un assistant IA spécialisé dans l'analyse de documents. L'utilisateur vous demande de faire un résumé de {len(documents_info)} documents.
+        # Special handling for document summaries
+        share = SUMMARY_REDUCE_TOKEN_BUDGET // max(len(documents_info), 1)
+        documents_content = "".join(
+            f"\n=== Document {i}: {doc['filename']} ===\nContenu: {truncate_to_tokens(doc['content'], share)}\n"
+            for i, doc in enumerate(documents_info, 1)
+        )
+        
+        prompt = f"""Vous êtes un assistant IA spécialisé dans l'analyse de documents. L'utilisateur vous demande de faire un résumé de {len(documents_info)} documents.
 
 DOCUMENTS À ANALYSER:
 {documents_content}
@@ -186,14 +299,14 @@ CONSIGNES:
 Question de l'utilisateur: {question}
 
 Réponse:"""
-        else:
-            # Get agent-specific system prompt
-            agent_prompt = get_agent_system_prompt(agent_type)
-            
-            # Standard RAG response with document attribution
-            prompt = f"""{agent_prompt} Utilisez les extraits de documents ci-dessous pour répondre à la question de l'utilisateur.
+    else:
+        # Get agent-specific system prompt
+        agent_prompt = get_agent_system_prompt(agent_type)
+        
+        # Standard RAG response with document attribution
+        prompt = f"""{agent_prompt} Utilisez les extraits de documents ci-dessous pour répondre à la question de l'utilisateur.
 
-CONTEXTE DES DOCUMENTS ({len(documents_info)} document(s) sélectionné(s)):
+CONTEXTE DES DOCUMENTS ({len(user_docs)} document(s) sélectionné(s)):
 {enhanced_context}
 
 CONSIGNES:
@@ -206,80 +319,138 @@ CONSIGNES:
 Question: {question}
 
 Réponse:"""
-        
-        # Always get AI response with retry
-        logger.info("Getting response from OpenAI")
-        response = get_chat_response(prompt)
-        logger.info("Successfully got response from OpenAI")
-        
-        return response
     
-    except Exception as e:
-        logger.error(f"Error getting answer: {e}")
-        # Re-raise the exception to propagate to the API endpoint for proper error handling
-        raise Exception(f"Erreur lors du traitement de votre question avec l'API OpenAI : {str(e)}")
+    return {'prompt': prompt, 'sources': context_results}
 
-def search_similar_texts_for_user(query_embedding: List[float], user_id: int, db: Session, top_k: int = 3, selected_doc_ids: List[int] = None) -> List[dict]:
-    """Search similar texts for a specific user - returns structured data with document info"""
+def search_similar_texts_for_user(query_embedding: Union[List[float], Dict[str, List[float]]], user_id: int, db: Session, top_k: int = 3, selected_doc_ids: List[int] = None, question: str = None) -> List[dict]:
+    """Search similar texts for a specific user - returns structured data with document info
+    
+    With the question, vector and BM25 rankings are fused (reciprocal rank fusion);
+    without a usable query embedding the BM25 ranking is used alone.
+    """
     try:
-        # Get all chunks for user's documents (filter by selected documents if provided)
-        query = db.query(DocumentChunk, Document).join(Document).filter(
-            Document.user_id == user_id
-        )
-        
-        if selected_doc_ids:
-            query = query.filter(Document.id.in_(selected_doc_ids))
-            
-        chunks_with_docs = query.all()
+        # Top-k from the user's persistent vector index (optionally restricted to selected documents)
+        candidates = top_k * HYBRID_CANDIDATES_FACTOR if question and HYBRID_SEARCH_ENABLED else top_k
+        vector_hits = vector_index.search(db, query_embedding, user_id, top_k=candidates, selected_doc_ids=selected_doc_ids) if query_embedding else []
+        similarity_by_id = dict(vector_hits)
+        
+        if question and HYBRID_SEARCH_ENABLED:
+            lexical_hits = lexical_index.search(db, question, user_id, top_k=candidates, selected_doc_ids=selected_doc_ids)
+            hits = reciprocal_rank_fusion([vector_hits, lexical_hits])[:top_k]
+        else:
+            hits = vector_hits[:top_k]
         
-        if not chunks_with_docs:
+        if not hits:
             return []
         
-        # Simple similarity search with document info
+        # Fetch text and document info only for the k winning chunks
+        rows = db.query(
+            DocumentChunk.id, DocumentChunk.content, DocumentChunk.char_start, DocumentChunk.char_end,
+            Document.id, Document.filename, Document.created_at
+        ).join(Document).filter(DocumentChunk.id.in_([chunk_id for chunk_id, _ in hits])).all()
+        rows_by_id = {row[0]: row for row in rows}
+        windows = get_chunk_windows(db, list(rows_by_id), CONTEXT_NEIGHBOR_CHUNKS) if CONTEXT_NEIGHBOR_CHUNKS else {}
+        
         similarities = []
-        for chunk, document in chunks_with_docs:
-            if chunk.embedding:
-                chunk_embedding = json.loads(chunk.embedding)
-                similarity = cosine_similarity(query_embedding, chunk_embedding)
-                similarities.append({
-                    'similarity': similarity,
-                    'text': chunk.chunk_text,
-                    'document_id': document.id,
-                    'document_name': document.filename,
-                    'created_at': document.created_at.isoformat()
-                })
-        
-        # Sort by similarity and return top_k
-        similarities.sort(key=lambda x: x['similarity'], reverse=True)
-        return similarities[:top_k]
+        for chunk_id, _ in hits:
+            if chunk_id not in rows_by_id:
+                continue  # Chunk deleted since the index was last synced
+            _, chunk_text, char_start, char_end, document_id, filename, created_at = rows_by_id[chunk_id]
+            if chunk_id in windows:
+                char_start, char_end, chunk_text = windows[chunk_id]
+            similarities.append({
+                'similarity': similarity_by_id.get(chunk_id, 0.0),
+                'text': chunk_text,
+                'chunk_id': chunk_id,
+                'char_start': char_start,
+                'char_end': char_end,
+                'document_id': document_id,
+                'document_name': filename,
+                'created_at': created_at.isoformat()
+            })
+        
+        return similarities
     
     except Exception as e:
         logger.error(f"Error searching similar texts: {e}")
         return []
 
+def get_chunk_windows(db: Session, chunk_ids: List[int], neighbors: int = 1) -> Dict[int, Tuple[int, int, str]]:
+    """(start, end, text) of each chunk extended with its neighbours in the document.
+
+    Chunks are offsets into the document text, so the window is a single substring
+    from the first neighbour's start to the last one's end. Chunks stored before
+    offsets existed are left out.
+    """
+    if not chunk_ids:
+        return {}
+    neighbor = aliased(DocumentChunk)
+    bounds = db.query(
+        DocumentChunk.id, DocumentChunk.document_id, func.min(neighbor.char_start), func.max(neighbor.char_end)
+    ).join(neighbor, and_(
+        neighbor.document_id == DocumentChunk.document_id,
+        neighbor.chunk_index.between(DocumentChunk.chunk_index - neighbors, DocumentChunk.chunk_index + neighbors)
+    )).filter(
+        DocumentChunk.id.in_(chunk_ids), DocumentChunk.char_start.isnot(None)
+    ).group_by(DocumentChunk.id, DocumentChunk.document_id).all()
+    
+    return {
+        chunk_id: (start, end, db.query(func.substr(Document.content, start + 1, end - start)).filter(Document.id == document_id).scalar())
+        for chunk_id, document_id, start, end in bounds
+    }
+
+def document_excerpt(chunks: List[str], limit: int = SUMMARY_EXCERPT_CHARS) -> str:
+    """Head of a document's text, joining only the chunks needed to reach the limit"""
+    parts, length = [], -1
+    for chunk in chunks:
+        parts.append(chunk)
+        length += len(chunk) + 1
+        if length > limit:
+            break
+    content = " ".join(parts)
+    return content[:limit] + "..." if len(content) > limit else content
+
+def backfill_document_summaries(db: Session, document_ids: List[int]) -> Dict[int, dict]:
+    """Compute and store chunk count and excerpt of documents ingested before they existed"""
+    chunks_by_doc = {document_id: [] for document_id in document_ids}
+    rows = db.query(DocumentChunk.document_id, DocumentChunk.content).filter(
+        DocumentChunk.document_id.in_(document_ids)
+    ).order_by(DocumentChunk.document_id, DocumentChunk.chunk_index).all()
+    for document_id, text in rows:
+        chunks_by_doc[document_id].append(text)
+    
+    summaries = {
+        document_id: {'chunk_count': len(chunks), 'summary_excerpt': document_excerpt(chunks)}
+        for document_id, chunks in chunks_by_doc.items()
+    }
+    db.bulk_update_mappings(Document, [{'id': document_id, **summary} for document_id, summary in summaries.items()])
+    db.commit()
+    return summaries
+
 def get_documents_summary(user_id: int, db: Session, selected_doc_ids: List[int] = None) -> List[dict]:
-    """Get complete information about user's documents"""
+    """Get summary information about user's documents (one projected query)"""
     try:
+        query = db.query(
+            Document.id, Document.filename, Document.created_at,
+            Document.chunk_count, Document.summary_excerpt, Document.summary
+        ).filter(Document.user_id == user_id)
         if selected_doc_ids:
-            documents = db.query(Document).filter(
-                Document.user_id == user_id,
-                Document.id.in_(selected_doc_ids)
-            ).all()
-        else:
-            documents = db.query(Document).filter(Document.user_id == user_id).all()
+            query = query.filter(Document.id.in_(selected_doc_ids))
+        documents = query.order_by(Document.id).all()
+        
+        missing = [doc.id for doc in documents if doc.chunk_count is None]
+        backfilled = backfill_document_summaries(db, missing) if missing else {}
         
         doc_info = []
         for doc in documents:
-            # Get all chunks for this document
-            chunks = db.query(DocumentChunk).filter(DocumentChunk.document_id == doc.id).all()
-            content = " ".join([chunk.chunk_text for chunk in chunks])
-            
+            summary = backfilled.get(doc.id, {'chunk_count': doc.chunk_count, 'summary_excerpt': doc.summary_excerpt})
             doc_info.append({
                 'id': doc.id,
                 'filename': doc.filename,
                 'created_at': doc.created_at.isoformat(),
-                'content': content[:2000] + "..." if len(content) > 2000 else content,  # Limit content
-                'chunk_count': len(chunks)
+                'content': doc.summary or summary['summary_excerpt'] or "",
+                'summary': doc.summary,
+                'chunk_count': summary['chunk_count']
             })
         
         return doc_info
@@ -288,130 +459,334 @@ def get_documents_summary(user_id: int, db: Session, selected_doc_ids: List[int]
         logger.error(f"Error getting documents summary: {e}")
         return []
 
+async def summarize_document(filename: str, chunks: List[str], priority: Priority = Priority.CHAT) -> str:
+    """Short LLM summary of a document, stored at ingest when DOCUMENT_LLM_SUMMARY is enabled, else on first use"""
+    prompt = f"""Résumez en un paragraphe concis et informatif le document '{filename}' dont voici le début.
+
+{document_excerpt(chunks, DOCUMENT_SUMMARY_SOURCE_CHARS)}
+
+Résumé:"""
+    return await get_chat_response_async(prompt, priority)
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut a text to about max_tokens tokens, on a word boundary"""
+    if count_tokens(text) <= max_tokens:
+        return text
+    cut = text[:max_tokens * 4].rsplit(" ", 1)[0]
+    return cut + "..."
+
+def document_summary_sources(db: Session, document_ids: List[int]) -> Dict[int, Tuple[str, str]]:
+    """(blob key, head of the text) of documents, the source of their summary"""
+    rows = db.query(
+        Document.id, Document.blob_key, func.substr(Document.content, 1, DOCUMENT_SUMMARY_SOURCE_CHARS), Document.summary_excerpt
+    ).filter(Document.id.in_(document_ids)).all()
+    return {document_id: (blob_key, head or excerpt or "") for document_id, blob_key, head, excerpt in rows}
+
+def store_document_summaries(db: Session, summaries: List[Tuple[int, str, str]]):
+    """Store (document id, blob key, summary); a document replaced meanwhile by a new version is left alone"""
+    for document_id, blob_key, summary in summaries:
+        query = db.query(Document).filter(Document.id == document_id)
+        query = query.filter(Document.blob_key == blob_key) if blob_key else query.filter(Document.blob_key.is_(None))
+        query.update({'summary': summary}, synchronize_session=False)
+    db.commit()
+
+async def summarize_documents(documents_info: List[dict], db: Session):
+    """Map step of multi-document summaries: summarize the documents that have no stored summary yet.
+
+    Calls run concurrently (SUMMARY_MAP_CONCURRENCY at a time); results are stored
+    on the documents so later requests reuse them until a new version is uploaded.
+    A failed call leaves the document with its text excerpt.
+    """
+    missing = [doc for doc in documents_info if not doc['summary'] and doc['content']]
+    if not missing:
+        return
+    sources = await asyncio.to_thread(document_summary_sources, db, [doc['id'] for doc in missing])
+    slots = asyncio.Semaphore(SUMMARY_MAP_CONCURRENCY)
+    
+    async def summarize(doc: dict) -> str:
+        async with slots:
+            return await summarize_document(doc['filename'], [sources[doc['id']][1]])
+    
+    started = time.time()
+    results = await asyncio.gather(*(summarize(doc) for doc in missing), return_exceptions=True)
+    summaries = []
+    for doc, result in zip(missing, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Could not summarize document {doc['filename']}: {result}")
+            continue
+        doc['content'] = doc['summary'] = result
+        summaries.append((doc['id'], sources[doc['id']][0], result))
+    if summaries:
+        await asyncio.to_thread(store_document_summaries, db, summaries)
+    logger.info(f"Summarized {len(summaries)}/{len(missing)} documents in {time.time() - started:.2f}s")
+
 def search_text_fallback(question: str, user_id: int, db: Session, top_k: int = 3) -> List[str]:
-    """Fallback text search when embeddings are not available"""
+    """Fallback text search when embeddings are not available (BM25 over the lexical index)"""
     try:
-        # Get all chunks for user's documents
-        chunks = db.query(DocumentChunk).join(Document).filter(
-            Document.user_id == user_id
-        ).all()
-        
-        if not chunks:
+        hits = lexical_index.search(db, question, user_id, top_k=top_k)
+        if not hits:
             return []
         
-        # Simple keyword matching
-        question_words = question.lower().split()
-        scored_chunks = []
-        
-        for chunk in chunks:
-            chunk_text = chunk.chunk_text.lower()
-            score = 0
-            
-            # Count word matches
-            for word in question_words:
-                if len(word) > 2:  # Skip very short words
-                    score += chunk_text.count(word)
-            
-            if score > 0:
-                scored_chunks.append((score, chunk.chunk_text))
-        
-        # Sort by score and return top results
-        scored_chunks.sort(reverse=True, key=lambda x: x[0])
-        return [text for _, text in scored_chunks[:top_k]]
+        texts = dict(db.query(DocumentChunk.id, DocumentChunk.content).filter(
+            DocumentChunk.id.in_([chunk_id for chunk_id, _ in hits])
+        ).all())
+        return [texts[chunk_id] for chunk_id, _ in hits if chunk_id in texts]
     
     except Exception as e:
         logger.error(f"Error in text fallback search: {e}")
         return []
 
-def cosine_similarity(vec1: List[float], vec2: List[float]) -> float:
-    """Calculate cosine similarity between two vectors"""
-    import numpy as np
-    
-    vec1 = np.array(vec1)
-    vec2 = np.array(vec2)
-    
-    dot_product = np.dot(vec1, vec2)
-    norm_vec1 = np.linalg.norm(vec1)
-    norm_vec2 = np.linalg.norm(vec2)
-    
-    if norm_vec1 == 0 or norm_vec2 == 0:
-        return 0
-    
-    return dot_product / (norm_vec1 * norm_vec2)
+async def embed_chunk_batch(texts: List[str]) -> List[Optional[list]]:
+    """Embed one batch of new chunks, waiting for an ingestion slot"""
+    async with _ingest_embedding_slots:
+        return await get_chunk_embeddings(texts)
 
-def process_document_for_user(filename: str, content: bytes, user_id: int, db: Session, agent_id: int = None) -> int:
-    """Process and store document for specific user and optionally for a specific agent"""
-    import tempfile
-    import os
-    
+def chunk_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def _partition_documents(db: Session, user_id: int, agent_id: Optional[int]):
+    return db.query(Document).filter(
+        Document.user_id == user_id,
+        Document.agent_id == agent_id if agent_id is not None else Document.agent_id.is_(None)
+    )
+
+def reusable_embeddings(db: Session, document_id: int) -> Dict[str, list]:
+    """Vectors of a document's chunks by chunk hash, for those embedded with the current model"""
+    rows = db.query(
+        DocumentChunk.content_hash,
+        case((DocumentChunk.content_hash.is_(None), DocumentChunk.content), else_=None),  # Chunks stored before hashing
+        DocumentChunk.embedding_f32,
+        DocumentChunk.embedding
+    ).filter(
+        DocumentChunk.document_id == document_id,
+        embedding_model_column() == EMBEDDING_MODEL
+    )
+    reusable = {}
+    for content_hash, text, packed, legacy_json in rows:
+        vector = unpack_embedding(packed, legacy_json)
+        if vector is None or len(vector) != EMBEDDING_DIMENSIONS or not vector.any():
+            continue
+        if content_hash is None and text:
+            content_hash = chunk_hash(text)
+        if content_hash:
+            reusable[content_hash] = vector.tolist()
+    return reusable
+
+async def embed_new_chunks(texts: List[str], hashes: List[str], reusable: Dict[str, list]) -> List[Optional[list]]:
+    """Embeddings of a batch, reusing the previous version's vectors of unchanged chunks"""
+    missing = [i for i, content_hash in enumerate(hashes) if content_hash not in reusable]
+    fresh = await embed_chunk_batch([texts[i] for i in missing]) if missing else []
+    embeddings = [reusable.get(content_hash) for content_hash in hashes]
+    for i, embedding in zip(missing, fresh):
+        embeddings[i] = embedding
+    return embeddings
+
+def delete_unused_blob(db: Session, key: str):
+    """Delete a blob no document references anymore (identical uploads share one)"""
+    if not db.query(Document.id).filter(Document.blob_key == key).first():
+        blob_store.delete(key)
+
+# Identical uploads of a user and agent processed at the same time (e.g. a double submit) make one document
+upload_flights = SingleFlight("upload")
+
+def lock_upload(db: Session, user_id: int, agent_id: Optional[int], file_hash: str):
+    """Serialize the duplicate check and insert of identical uploads across instances, until the transaction ends.
+
+    PostgreSQL advisory lock; within one process upload_flights already runs them once.
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        digest = hashlib.sha256(f"upload:{user_id}:{agent_id}:{file_hash}".encode()).digest()
+        db.execute(select(func.pg_advisory_xact_lock(int.from_bytes(digest[:8], "big", signed=True))))
+
+async def process_document_for_user(filename: str, content: bytes, user_id: int, db: Session, agent_id: int = None) -> int:
+    """Process and store document for specific user and optionally for a specific agent.
+
+    An upload identical to a document of the same user and agent returns that
+    document, including when both are processed at the same time. A new
+    version of a file (same filename) replaces the text and chunks of the
+    existing document in one transaction, keeping its id; only the chunks
+    whose text changed are embedded again.
+    """
+    file_hash = await asyncio.to_thread(content_key, content)
+    return await upload_flights.do(
+        stable_key(user_id, agent_id, file_hash),
+        lambda: _process_document_for_user(filename, content, file_hash, user_id, db, agent_id)
+    )
+
+async def _process_document_for_user(filename: str, content: bytes, file_hash: str, user_id: int, db: Session,
+                                     agent_id: Optional[int]) -> int:
+    embedding_tasks = []
+    blob_key = None
     try:
         logger.info(f"Starting to process document: {filename} for user {user_id}, agent {agent_id}")
         
-        # Save document to database first
-        document = Document(
-            filename=filename,
-            content=content.decode('utf-8') if filename.endswith('.txt') else str(content),
-            user_id=user_id,
-            agent_id=agent_id
-        )
-        db.add(document)
-        db.commit()
-        db.refresh(document)
-        logger.info(f"Document saved to database with ID: {document.id}")
-        
-        # Process content based on file type
-        if filename.endswith('.pdf'):
-            # Save content temporarily to process with pdfplumber
-            tmp_file = None
-            try:
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp:
-                    tmp_file = tmp.name
-                    tmp.write(content)
-                logger.info(f"Processing PDF file: {tmp_file}")
-                text_content = load_text_from_pdf(tmp_file)
-            finally:
-                # Clean up temporary file
-                if tmp_file and os.path.exists(tmp_file):
-                    os.unlink(tmp_file)
+        def find_documents():
+            duplicate = _partition_documents(db, user_id, agent_id).filter(Document.blob_key == file_hash).first()
+            if duplicate is not None:
+                return duplicate, None
+            return None, _partition_documents(db, user_id, agent_id).filter(
+                Document.filename == filename
+            ).order_by(Document.id.desc()).first()
+        
+        duplicate, previous = await asyncio.to_thread(find_documents)
+        if duplicate is not None:
+            logger.info(f"Identical file already ingested as document {duplicate.id} ({duplicate.filename}), skipping")
+            return duplicate.id
+        reusable = {}
+        if previous is not None:
+            # New version: the row is only updated once the new text is extracted and embedded,
+            # a failed upload leaves the previous version untouched
+            document = previous
+            previous_blob_key = previous.blob_key
+            reusable = await asyncio.to_thread(reusable_embeddings, db, previous.id)
+            logger.info(f"New version of document {previous.id}, {len(reusable)} chunk embeddings reusable")
         else:
-            text_content = content.decode('utf-8')
-        
+            # Inserted with its chunks, so a file without text never leaves an empty document
+            document = Document(filename=filename, user_id=user_id, agent_id=agent_id)
+        
+        # Extract, chunk and embed as a pipeline: the file is read by its format's extractor in
+        # the extraction pool and chunks are embedded batch by batch while later pages are read
+        chunker = TokenChunker()
+        page_texts = []
+        page_offsets, page_numbers = [], []  # Where each page starts in the extracted text
+        length = 0
+        chunks = []  # (start, end, text) in the extracted text
+        hashes = []
+        submitted = 0
+        
+        def submit_embeddings(final: bool):
+            nonlocal submitted
+            if len(chunks) - submitted >= INGEST_EMBEDDING_BATCH or (final and len(chunks) > submitted):
+                batch = [chunk for _, _, chunk in chunks[submitted:]]
+                batch_hashes = [chunk_hash(chunk) for chunk in batch]
+                hashes.extend(batch_hashes)
+                embedding_tasks.append(asyncio.create_task(embed_new_chunks(batch, batch_hashes, reusable)))
+                submitted = len(chunks)
+        
+        async for page_no, piece in extract_text(filename, content):
+            page_texts.append(piece)
+            if page_no is not None:
+                page_offsets.append(length)
+                page_numbers.append(page_no)
+            length += len(piece)
+            chunks.extend(await asyncio.to_thread(lambda: list(chunker.feed(piece))))
+            submit_embeddings(final=False)
+        chunks.extend(await asyncio.to_thread(lambda: list(chunker.finish())))
+        submit_embeddings(final=True)
+        
+        text_content = "".join(page_texts)
         logger.info(f"Extracted text length: {len(text_content)} characters")
-        
-        # Chunk the text
-        chunks = chunk_text(text_content)
+        if not chunks:
+            raise ExtractionError(f"No text could be extracted from {filename}")
         logger.info(f"Created {len(chunks)} chunks")
         
-        # Process first few chunks with embeddings, save others without embeddings for now
-        max_immediate_chunks = 20  # Process only first 20 chunks immediately
+        chunk_texts = [chunk for _, _, chunk in chunks]
+        summary = None
+        if DOCUMENT_LLM_SUMMARY:
+            try:
+                summary = await summarize_document(filename, chunk_texts, Priority.INGESTION)
+            except Exception as e:
+                logger.warning(f"Could not summarize document {filename}: {e}")
+        
+        # Embeddings of the last batches (cached texts are reused)
+        embeddings = [embedding for batch in await asyncio.gather(*embedding_tasks) for embedding in batch]
+        embedded_at = datetime.utcnow()
+        if previous is not None:
+            reused = sum(1 for content_hash in hashes if content_hash in reusable)
+            logger.info(f"Reused {reused}/{len(chunks)} chunk embeddings of the previous version")
+        missing = sum(1 for embedding in embeddings if embedding is None)
+        if missing:
+            logger.warning(f"{missing}/{len(chunks)} chunks of {filename} stored without embedding, left to the re-embedding worker")
+        
+        # Raw file goes to the blob store, the row only keeps its address and the extracted text
+        blob_key = await asyncio.to_thread(blob_store.put, content)
+        document.content = text_content
+        document.blob_key = blob_key
+        document.content_type = mimetypes.guess_type(filename)[0]
+        document.size_bytes = len(content)
+        # Summary metadata, so answering never has to re-read every chunk
+        document.chunk_count = len(chunks)
+        document.summary_excerpt = document_excerpt(chunk_texts)
+        document.summary = summary
+        if previous is not None:
+            document.version = (document.version or 1) + 1
+            document.updated_at = datetime.utcnow()
+        
+        # Chunks are slices of the document text, inserted with one executemany
+        rows = []
+        for i, ((start, end, _), embedding) in enumerate(zip(chunks, embeddings)):
+            page_start, page_end = page_range(page_offsets, page_numbers, start, end) if page_numbers else (None, None)
+            rows.append({
+                'char_start': start,
+                'char_end': end,
+                'content_hash': hashes[i],
+                'embedding_f32': pack_embedding(embedding) if embedding else None,
+                'embedding_model': EMBEDDING_MODEL if embedding else None,
+                'embedding_dim': len(embedding) if embedding else None,
+                'embedded_at': embedded_at if embedding else None,
+                'chunk_index': i,
+                'page_start': page_start,
+                'page_end': page_end
+            })
         
-        for i, chunk in enumerate(chunks):
-            if i < max_immediate_chunks:
-                logger.info(f"Processing chunk {i+1}/{len(chunks)} with embedding")
-                try:
-                    # Get embedding for chunk with shorter timeout
-                    embedding = get_embedding_fast(chunk)
-                except Exception as e:
-                    logger.warning(f"Failed to get embedding for chunk {i}, using dummy: {e}")
-                    embedding = [0.0] * 1536
+        def store_chunks() -> Tuple[int, Optional[List[int]]]:
+            # The document row and its chunks (a new version's replacing the old ones) are one transaction
+            lock_upload(db, user_id, agent_id, file_hash)
+            duplicate = _partition_documents(db, user_id, agent_id).filter(Document.blob_key == file_hash).first()
+            if duplicate is not None:
+                # Stored by another instance while this one was extracting
+                duplicate_id = duplicate.id
+                db.rollback()
+                return duplicate_id, None
+            if previous is not None:
+                db.execute(delete(DocumentChunk).where(DocumentChunk.document_id == document.id))
             else:
-                logger.info(f"Saving chunk {i+1}/{len(chunks)} without embedding (will process later)")
-                embedding = None  # Will be processed later
-            
-            # Save chunk to database
-            doc_chunk = DocumentChunk(
-                document_id=document.id,
-                chunk_text=chunk,
-                embedding=json.dumps(embedding) if embedding else None,
-                chunk_index=i
-            )
-            db.add(doc_chunk)
-        
-        db.commit()
+                db.add(document)
+                db.flush()
+            for row in rows:
+                row['document_id'] = document.id
+            ids = list(db.scalars(
+                insert(DocumentChunk).returning(DocumentChunk.id, sort_by_parameter_order=True), rows
+            ))
+            stored_id = document.id
+            db.commit()
+            return stored_id, ids
+        
+        # A large document's inserts would otherwise stall the event loop
+        document_id, all_chunk_ids = await asyncio.to_thread(store_chunks)
+        if all_chunk_ids is None:
+            logger.info(f"Identical file ingested meanwhile as document {document_id}, skipping")
+            return document_id
+        logger.info(f"Document saved to database with ID: {document_id}")
+        embedded = [(chunk_id, embedding) for chunk_id, embedding in zip(all_chunk_ids, embeddings) if embedding]
+        chunk_ids = [chunk_id for chunk_id, _ in embedded]
+        embeddings = [embedding for _, embedding in embedded]
+        
+        if previous is not None and previous_blob_key and previous_blob_key != blob_key:
+            # Blobs are shared by identical uploads, keep it while another document uses it
+            await asyncio.to_thread(delete_unused_blob, db, previous_blob_key)
+        
+        def update_vector_index():
+            if previous is not None:
+                vector_index.remove_document(user_id, agent_id, document_id)
+            vector_index.add_document(user_id, agent_id, document_id, chunk_ids, embeddings, EMBEDDING_MODEL, embedded_at)
+        
+        def update_lexical_index():
+            if previous is not None:
+                lexical_index.remove_document(user_id, agent_id, document_id)
+            lexical_index.add_document(user_id, agent_id, document_id, all_chunk_ids, chunk_texts)
+        
+        # Index updates are CPU and disk bound, keep them off the event loop too
+        await asyncio.gather(asyncio.to_thread(update_vector_index), asyncio.to_thread(update_lexical_index))
+        await bump_corpus_version(user_id, agent_id)
         logger.info(f"Document processed successfully: {filename} for user {user_id}")
-        return document.id
+        return document_id
     
     except Exception as e:
         logger.error(f"Error processing document: {e}")
-        db.rollback()
+        for task in embedding_tasks:
+            task.cancel()
+        await asyncio.to_thread(db.rollback)
+        if blob_key is not None:
+            await asyncio.to_thread(delete_unused_blob, db, blob_key)
         raise e
@@ -0,0 +1,175 @@
+# Cache partagé : LRU en mémoire (L1) devant Redis (L2), invalidé par version de corpus
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # Redis est optionnel, le cache reste alors local au processus
+    aioredis = None
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL")
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "300"))  # 5 minutes
+ANSWER_CACHE_L1_SIZE = int(os.getenv("ANSWER_CACHE_L1_SIZE", "1000"))
+KEY_PREFIX = "applydi:"
+
+def stable_key(*parts) -> str:
+    """Content hash of the key parts, identical across processes (unlike hash())"""
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def normalize_question(question: str) -> str:
+    """Case and whitespace insensitive form of a question"""
+    return " ".join(question.lower().split())
+
+class LRUCache:
+    """Thread-safe size-bounded LRU with per-entry expiry, O(1) get/set/evict"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: float):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+_redis = None
+_redis_failed_at = 0.0
+
+def get_redis():
+    """Shared async Redis client, or None if Redis is not configured or currently unreachable"""
+    global _redis
+    if not REDIS_URL or aioredis is None:
+        return None
+    if time.monotonic() - _redis_failed_at < 30:
+        return None  # Recent failure: don't add a timeout to every request
+    if _redis is None:
+        _redis = aioredis.from_url(REDIS_URL, socket_timeout=0.5, socket_connect_timeout=0.5)
+    return _redis
+
+async def close_redis():
+    global _redis
+    if _redis is not None:
+        await _redis.aclose()
+        _redis = None
+
+def report_redis_error(e: Exception):
+    global _redis_failed_at
+    _redis_failed_at = time.monotonic()
+    logger.warning(f"Redis unavailable, using in-process cache only: {e}")
+
+# Corpus versions: bumped whenever a user's or agent's documents change, and part
+# of every answer cache key, so stale answers are never served after an upload/delete
+_local_versions = {}
+
+def _version_key(scope: str) -> str:
+    return f"{KEY_PREFIX}corpus_version:{scope}"
+
+async def corpus_version(user_id: int, agent_id: Optional[int] = None) -> str:
+    """Current version of the documents visible to a user (and agent)"""
+    scopes = [f"user:{user_id}"] + ([f"agent:{agent_id}"] if agent_id is not None else [])
+    client = get_redis()
+    if client is not None:
+        try:
+            values = await client.mget([_version_key(scope) for scope in scopes])
+            return "-".join(value.decode() if value else "0" for value in values)
+        except Exception as e:
+            report_redis_error(e)
+    return "-".join(str(_local_versions.get(scope, 0)) for scope in scopes)
+
+async def bump_corpus_version(user_id: int, agent_id: Optional[int] = None):
+    """Invalidate every cached answer depending on this user's (and agent's) documents"""
+    scopes = [f"user:{user_id}"] + ([f"agent:{agent_id}"] if agent_id is not None else [])
+    for scope in scopes:
+        _local_versions[scope] = _local_versions.get(scope, 0) + 1
+    client = get_redis()
+    if client is not None:
+        try:
+            for scope in scopes:
+                await client.incr(_version_key(scope))
+        except Exception as e:
+            report_redis_error(e)
+
+class TwoLevelCache:
+    """In-process LRU (L1) in front of Redis (L2); values must be JSON-serializable"""
+
+    def __init__(self, namespace: str, ttl: int, l1_size: int):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.l1 = LRUCache(l1_size)
+        self.hits = 0
+        self.misses = 0
+
+    def _redis_key(self, key: str) -> str:
+        return f"{KEY_PREFIX}{self.namespace}:{key}"
+
+    async def get(self, key: str) -> Optional[Any]:
+        value = self.l1.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        client = get_redis()
+        if client is not None:
+            try:
+                raw = await client.get(self._redis_key(key))
+                if raw is not None:
+                    value = json.loads(raw)
+                    self.l1.set(key, value, self.ttl)
+                    self.hits += 1
+                    return value
+            except Exception as e:
+                report_redis_error(e)
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: Any):
+        self.l1.set(key, value, self.ttl)
+        client = get_redis()
+        if client is not None:
+            try:
+                await client.set(self._redis_key(key), json.dumps(value, ensure_ascii=False), ex=self.ttl)
+            except Exception as e:
+                report_redis_error(e)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "l1_entries": len(self.l1),
+            "redis": get_redis() is not None
+        }
+
+# Cache des réponses de get_answer / get_answer_with_files
+answer_cache = TwoLevelCache("answer", ANSWER_CACHE_TTL, ANSWER_CACHE_L1_SIZE)
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Outil de backfill / ré-embedding des chunks de documents
+
+Remplit les chunks sans embedding ou avec l'embedding factice [0.0]*1536, et
+ré-embedde les chunks produits par un autre modèle que OPENAI_EMBEDDING_MODEL.
+Les chunks sont parcourus par lots paginés sur l'id, la progression est
+enregistrée dans la table reembed_checkpoints et le débit respecte un plafond
+de tokens par minute. Les appels passent par l'ordonnanceur OpenAI avec la
+priorité la plus basse : /ask et les uploads sont servis d'abord. /ask reste
+disponible pendant une migration de modèle : l'index vectoriel garde une
+partition par modèle. Un chunk sans texte ou refusé par l'API est sauté (et
+journalisé) au lieu de bloquer le lot ; la passe suivante le retente.
+
+Usage: python reembed.py [--model text-embedding-3-large] [--batch-size 100]
+                         [--tokens-per-minute 300000] [--name default] [--restart]
+
+Le même traitement peut tourner en tâche de fond dans l'API avec
+REEMBED_WORKER_ENABLED=true.
+"""
+import sys
+import os
+import argparse
+import asyncio
+import concurrent.futures
+import logging
+import threading
+import time
+from datetime import datetime
+
+from openai import BadRequestError
+
+# Ajouter le répertoire parent au PATH pour les imports
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from database import SessionLocal, DocumentChunk, ReembedCheckpoint
+from embedding_codec import pack_embedding, needs_embedding
+from openai_client import create_embeddings_async, close_async_client, EMBEDDING_MODEL, EMBEDDING_DIMENSIONS, EMBEDDING_INPUT_MAX_TOKENS
+from openai_scheduler import Priority
+from pgvector_store import write_vectors
+from vector_store import INDEX_BACKEND
+from tokenizer import count_tokens
+
+logger = logging.getLogger(__name__)
+
+REEMBED_WORKER_ENABLED = os.getenv("REEMBED_WORKER_ENABLED", "false").lower() == "true"
+REEMBED_TOKENS_PER_MINUTE = int(os.getenv("REEMBED_TOKENS_PER_MINUTE", "300000"))
+REEMBED_BATCH_SIZE = int(os.getenv("REEMBED_BATCH_SIZE", "100"))
+# Pause between two full passes of the background worker
+REEMBED_IDLE_SECONDS = int(os.getenv("REEMBED_IDLE_SECONDS", "300"))
+
+class TokenRateLimiter:
+    """Token bucket refilled continuously at tokens_per_minute"""
+
+    def __init__(self, tokens_per_minute: int):
+        self.capacity = tokens_per_minute
+        self.rate = tokens_per_minute / 60.0
+        self.available = float(tokens_per_minute)
+        self.updated = time.monotonic()
+
+    def acquire(self, tokens: int, stop_event: threading.Event = None) -> bool:
+        """Block until tokens are available, returns False if stopped while waiting"""
+        tokens = min(tokens, self.capacity)
+        while True:
+            now = time.monotonic()
+            self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.available >= tokens:
+                self.available -= tokens
+                return True
+            wait = (tokens - self.available) / self.rate
+            if stop_event is not None:
+                if stop_event.wait(wait):
+                    return False
+            else:
+                time.sleep(wait)
+
+class ReembedStopped(Exception):
+    """The worker was stopped while an embeddings call was in flight"""
+
+def _background_loop() -> asyncio.AbstractEventLoop:
+    """Event loop of the command-line tool, run in its own thread like the API's"""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="reembed-loop", daemon=True).start()
+    return loop
+
+def _embed(texts, model, loop: asyncio.AbstractEventLoop, stop_event: threading.Event = None):
+    """Embed texts through the OpenAI scheduler of loop, at background priority.
+
+    The scheduler queues the call behind /ask and uploads and retries 429
+    responses itself; other errors are raised (the worker tries the batch again
+    after REEMBED_IDLE_SECONDS).
+    """
+    future = asyncio.run_coroutine_threadsafe(create_embeddings_async(texts, model, Priority.BACKGROUND), loop)
+    while True:
+        try:
+            return future.result(timeout=1.0)
+        except concurrent.futures.TimeoutError:
+            if stop_event is not None and stop_event.is_set():
+                future.cancel()
+                raise ReembedStopped()
+
+def _embed_rows(rows, model, loop: asyncio.AbstractEventLoop, stop_event: threading.Event = None) -> dict:
+    """Embeddings by chunk id. When the API rejects the batch, each chunk is embedded
+    on its own so one bad input does not hold back the others (rejected ones are left out)"""
+    try:
+        return dict(zip((chunk_id for chunk_id, _ in rows), _embed([text for _, text in rows], model, loop, stop_event)))
+    except BadRequestError as e:
+        logger.warning(f"Re-embedding batch of {len(rows)} chunks rejected, embedding them one by one: {e}")
+
+    embeddings = {}
+    for chunk_id, chunk_text in rows:
+        try:
+            embeddings[chunk_id] = _embed([chunk_text], model, loop, stop_event)[0]
+        except BadRequestError as e:
+            logger.warning(f"Chunk {chunk_id} skipped by re-embedding, the API rejected it: {e}")
+    return embeddings
+
+def reembed_batch(db, checkpoint: ReembedCheckpoint, limiter: TokenRateLimiter, batch_size: int,
+                  loop: asyncio.AbstractEventLoop, stop_event: threading.Event = None) -> int:
+    """Re-embed the next batch after the checkpoint, returns the number of chunks processed.
+
+    Chunks without text and chunks the API rejects are skipped (logged): the
+    checkpoint moves past them and the next pass tries them again.
+    """
+    rows = db.query(DocumentChunk.id, DocumentChunk.content).filter(
+        DocumentChunk.id > checkpoint.last_chunk_id,
+        needs_embedding(checkpoint.target_model, EMBEDDING_DIMENSIONS)
+    ).order_by(DocumentChunk.id).limit(batch_size).all()
+
+    if not rows:
+        return 0
+
+    embeddable = [(chunk_id, chunk_text) for chunk_id, chunk_text in rows if chunk_text and chunk_text.strip()]
+    if len(embeddable) < len(rows):
+        empty = [chunk_id for chunk_id, chunk_text in rows if not (chunk_text and chunk_text.strip())]
+        logger.warning(f"Chunks {empty} skipped by re-embedding, they have no text")
+
+    embeddings = {}
+    if embeddable:
+        tokens = sum(min(count_tokens(chunk_text), EMBEDDING_INPUT_MAX_TOKENS) for _, chunk_text in embeddable)
+        if not limiter.acquire(tokens, stop_event):
+            return 0
+        try:
+            embeddings = _embed_rows(embeddable, checkpoint.target_model, loop, stop_event)
+        except ReembedStopped:
+            return 0
+
+    embedded_at = datetime.utcnow()
+    db.bulk_update_mappings(DocumentChunk, [
+        {
+            "id": chunk_id,
+            "embedding_f32": pack_embedding(embedding),
+            "embedding": None,
+            "embedding_model": checkpoint.target_model,
+            "embedding_dim": len(embedding),
+            "embedded_at": embedded_at
+        }
+        for chunk_id, embedding in embeddings.items()
+    ])
+    if INDEX_BACKEND == "pgvector":
+        # Searches only read embedding_vec: keep it in step with embedding_f32
+        write_vectors(db, [(chunk_id, embedding, embedded_at) for chunk_id, embedding in embeddings.items()], EMBEDDING_DIMENSIONS)
+    # Vectors and checkpoint are committed together, so a crash never skips a batch
+    checkpoint.last_chunk_id = rows[-1][0]
+    checkpoint.processed_count += len(embeddings)
+    db.commit()
+    return len(rows)
+
+def run_reembed(name: str = "default", model: str = EMBEDDING_MODEL, batch_size: int = REEMBED_BATCH_SIZE,
+                tokens_per_minute: int = REEMBED_TOKENS_PER_MINUTE, restart: bool = False,
+                stop_event: threading.Event = None, loop: asyncio.AbstractEventLoop = None) -> int:
+    """Run one pass from the checkpoint to the end of document_chunks, returns chunks processed.
+
+    loop is the event loop whose OpenAI scheduler the calls go through (the
+    API's for the background worker); the command-line tool runs its own.
+    """
+    own_loop = loop is None
+    if own_loop:
+        loop = _background_loop()
+    db = SessionLocal()
+    try:
+        checkpoint = db.get(ReembedCheckpoint, name)
+        if checkpoint is None:
+            checkpoint = ReembedCheckpoint(name=name, target_model=model, last_chunk_id=0, processed_count=0)
+            db.add(checkpoint)
+        elif restart or checkpoint.target_model != model:
+            checkpoint.target_model = model
+            checkpoint.last_chunk_id = 0
+            checkpoint.processed_count = 0
+        db.commit()
+
+        logger.info(f"Re-embedding '{name}' to {model} from chunk id {checkpoint.last_chunk_id}")
+        limiter = TokenRateLimiter(tokens_per_minute)
+        processed = 0
+        while stop_event is None or not stop_event.is_set():
+            count = reembed_batch(db, checkpoint, limiter, batch_size, loop, stop_event)
+            if count == 0:
+                break
+            processed += count
+            logger.info(f"Re-embedded {processed} chunks (checkpoint '{name}' at id {checkpoint.last_chunk_id})")
+        return processed
+    finally:
+        db.close()
+        if own_loop:
+            asyncio.run_coroutine_threadsafe(close_async_client(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+
+class ReembedWorker(threading.Thread):
+    """Background thread running re-embedding passes inside the API process"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        super().__init__(name="reembed-worker", daemon=True)
+        self.loop = loop
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                run_reembed("worker", stop_event=self.stop_event, loop=self.loop)
+                if not self.stop_event.is_set():
+                    # Pass complete: start over next time to pick up new failures
+                    self._rewind()
+            except Exception as e:
+                logger.error(f"Re-embedding worker error: {e}")
+            self.stop_event.wait(REEMBED_IDLE_SECONDS)
+
+    def _rewind(self):
+        db = SessionLocal()
+        try:
+            checkpoint = db.get(ReembedCheckpoint, "worker")
+            if checkpoint is not None:
+                checkpoint.last_chunk_id = 0
+                db.commit()
+        finally:
+            db.close()
+
+    def stop(self):
+        self.stop_event.set()
+
+_worker = None
+
+def start_reembed_worker():
+    """Start the background worker if REEMBED_WORKER_ENABLED is set (from the API's event loop)"""
+    global _worker
+    if REEMBED_WORKER_ENABLED and _worker is None:
+        _worker = ReembedWorker(asyncio.get_running_loop())
+        _worker.start()
+        logger.info("Re-embedding worker started")
+
+def stop_reembed_worker():
+    global _worker
+    if _worker is not None:
+        _worker.stop()
+        _worker = None
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Backfill / ré-embedding des chunks de documents")
+    parser.add_argument("--name", default="default", help="Nom du checkpoint (reprise)")
+    parser.add_argument("--model", default=EMBEDDING_MODEL, help="Modèle d'embedding cible")
+    parser.add_argument("--batch-size", type=int, default=REEMBED_BATCH_SIZE)
+    parser.add_argument("--tokens-per-minute", type=int, default=REEMBED_TOKENS_PER_MINUTE)
+    parser.add_argument("--restart", action="store_true", help="Repartir du début au lieu du checkpoint")
+    args = parser.parse_args()
+
+    try:
+        processed = run_reembed(args.name, args.model, args.batch_size, args.tokens_per_minute, args.restart)
+        print(f"\n🎉 {processed} chunks ré-embeddés avec {args.model}")
+    except KeyboardInterrupt:
+        print("\n⏸️  Interrompu, relancez la commande pour reprendre au dernier checkpoint")
+    except Exception as e:
+        print(f"\n💥 Échec du ré-embedding: {e} (relancez pour reprendre au dernier checkpoint)")
+        sys.exit(1)
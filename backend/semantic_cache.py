@@ -0,0 +1,124 @@
+# Cache sémantique : réutilise la réponse d'une question très proche déjà posée
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import FrozenSet, List, Optional
+
+import numpy as np
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+# Cosine similarity above which two questions are considered the same
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_TTL = int(os.getenv("SEMANTIC_CACHE_TTL", "3600"))
+# Memory bound: at most MAX_SCOPES * MAX_ENTRIES vectors (500 * 50 * 6 KB = 150 MB at 1536 dims)
+SEMANTIC_CACHE_MAX_SCOPES = int(os.getenv("SEMANTIC_CACHE_MAX_SCOPES", "500"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "50"))
+
+# Numbers and quoted terms: "budget 2023" and "budget 2024", or "article 12" and "article 13",
+# have near-identical embeddings but different answers
+_NUMBER_RE = re.compile(r"\d+(?:[.,]\d+)*")
+_QUOTED_RE = re.compile(r'"([^"]+)"|«([^»]+)»|“([^”]+)”')
+
+def key_terms(question: str) -> FrozenSet[str]:
+    """Terms two questions must share for one's answer to be reused for the other"""
+    terms = set(_NUMBER_RE.findall(question))
+    for groups in _QUOTED_RE.findall(question):
+        quoted = next(group for group in groups if group)
+        terms.add(" ".join(quoted.lower().split()))
+    return frozenset(terms)
+
+class _Scope:
+    """Cached questions of one (user, selected documents, agent type), all from the same corpus version"""
+
+    def __init__(self, version: str, dim: int):
+        self.version = version
+        self.vectors = np.empty((0, dim), dtype=np.float32)
+        self.answers: List[str] = []
+        self.terms: List[FrozenSet[str]] = []
+        self.created: List[float] = []
+
+    def expire(self, now: float, ttl: float):
+        keep = [i for i, created in enumerate(self.created) if now - created < ttl]
+        if len(keep) < len(self.created):
+            self.vectors = self.vectors[keep]
+            self.answers = [self.answers[i] for i in keep]
+            self.terms = [self.terms[i] for i in keep]
+            self.created = [self.created[i] for i in keep]
+
+class SemanticAnswerCache:
+    """Nearest-question lookup over normalized question embeddings, bounded LRU of scopes.
+
+    Only previous questions with the same numbers and quoted terms are candidates
+    (see key_terms): the embedding threshold alone cannot tell them apart.
+    """
+
+    def __init__(self, threshold: float, ttl: int, max_scopes: int, max_entries: int):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_scopes = max_scopes
+        self.max_entries = max_entries
+        self._scopes: "OrderedDict[str, _Scope]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _normalize(embedding) -> Optional[np.ndarray]:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else None
+
+    def get(self, scope_key: str, version: str, embedding, question: str) -> Optional[str]:
+        query = self._normalize(embedding)
+        terms = key_terms(question)
+        with self._lock:
+            scope = self._scopes.get(scope_key)
+            if query is None or scope is None or scope.version != version or scope.vectors.shape[1] != query.shape[0]:
+                self.misses += 1
+                return None
+            scope.expire(time.monotonic(), self.ttl)
+            self._scopes.move_to_end(scope_key)
+            if not scope.answers:
+                self.misses += 1
+                return None
+            scores = scope.vectors @ query
+            scores[[i for i, entry_terms in enumerate(scope.terms) if entry_terms != terms]] = -np.inf
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return scope.answers[best]
+
+    def set(self, scope_key: str, version: str, embedding, question: str, answer: str):
+        vector = self._normalize(embedding)
+        if vector is None:
+            return
+        with self._lock:
+            scope = self._scopes.get(scope_key)
+            if scope is None or scope.version != version or scope.vectors.shape[1] != vector.shape[0]:
+                # New corpus version: every previous answer of the scope is stale
+                scope = _Scope(version, vector.shape[0])
+                self._scopes[scope_key] = scope
+            self._scopes.move_to_end(scope_key)
+            scope.vectors = np.vstack([scope.vectors, vector[None, :]])[-self.max_entries:]
+            scope.answers = (scope.answers + [answer])[-self.max_entries:]
+            scope.terms = (scope.terms + [key_terms(question)])[-self.max_entries:]
+            scope.created = (scope.created + [time.monotonic()])[-self.max_entries:]
+            while len(self._scopes) > self.max_scopes:
+                self._scopes.popitem(last=False)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "scopes": len(self._scopes),
+            "threshold": self.threshold
+        }
+
+semantic_cache = SemanticAnswerCache(SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_TTL,
+                                     SEMANTIC_CACHE_MAX_SCOPES, SEMANTIC_CACHE_MAX_ENTRIES)
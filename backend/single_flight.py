@@ -0,0 +1,124 @@
+# Regroupement des appels identiques en cours : une seule exécution partagée par processus, et entre workers via un verrou Redis
+import asyncio
+import logging
+import os
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from redis_cache import get_redis, report_redis_error, KEY_PREFIX
+
+logger = logging.getLogger(__name__)
+
+SINGLE_FLIGHT_REDIS = os.getenv("SINGLE_FLIGHT_REDIS", "true").lower() == "true"
+# Lock lifetime: a worker that dies while computing blocks the others this long at most
+SINGLE_FLIGHT_LOCK_TTL = float(os.getenv("SINGLE_FLIGHT_LOCK_TTL", "60"))
+# Longest wait for another worker's result before computing it here anyway
+SINGLE_FLIGHT_WAIT = float(os.getenv("SINGLE_FLIGHT_WAIT", "30"))
+SINGLE_FLIGHT_POLL_INTERVAL = 0.05
+
+# Deletes the lock only if this worker still owns it
+_RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+class SingleFlight:
+    """Concurrent calls with the same key await one shared execution.
+
+    Within a process the first caller runs the function and the others await its
+    future. When a lookup of the shared cache is given and Redis is configured,
+    workers also coordinate through a Redis lock: the lock owner computes (and
+    stores the result in the cache), the other workers poll the cache until the
+    result appears, the lock is released, or SINGLE_FLIGHT_WAIT is over.
+    """
+
+    def __init__(self, namespace: str):
+        self.namespace = namespace
+        self._calls: Dict[str, asyncio.Future] = {}
+        self.executed = 0
+        self.shared = 0
+        self.shared_across_workers = 0
+
+    def _lock_key(self, key: str) -> str:
+        return f"{KEY_PREFIX}flight:{self.namespace}:{key}"
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]],
+                 lookup: Optional[Callable[[], Awaitable[Optional[Any]]]] = None) -> Any:
+        """Result of fn(), shared with every concurrent call of the same key"""
+        future = self._calls.get(key)
+        if future is not None:
+            self.shared += 1
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if future.cancelled():  # The first caller went away, compute it ourselves
+                    return await self.do(key, fn, lookup)
+                raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        try:
+            result = await self._run(key, fn, lookup)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # Retrieved: no warning when nobody else was waiting
+            raise
+        finally:
+            del self._calls[key]
+
+    async def _run(self, key: str, fn: Callable[[], Awaitable[Any]],
+                   lookup: Optional[Callable[[], Awaitable[Optional[Any]]]]) -> Any:
+        client = get_redis() if SINGLE_FLIGHT_REDIS and lookup is not None else None
+        if client is None:
+            self.executed += 1
+            return await fn()
+
+        lock_key, token = self._lock_key(key), uuid.uuid4().hex
+        try:
+            acquired = await client.set(lock_key, token, nx=True, px=int(SINGLE_FLIGHT_LOCK_TTL * 1000))
+        except Exception as e:
+            report_redis_error(e)
+            acquired = True  # No coordination without Redis
+            client = None
+
+        if not acquired:
+            deadline = time.monotonic() + SINGLE_FLIGHT_WAIT
+            try:
+                while time.monotonic() < deadline:
+                    await asyncio.sleep(SINGLE_FLIGHT_POLL_INTERVAL)
+                    result = await lookup()
+                    if result is not None:
+                        self.shared_across_workers += 1
+                        return result
+                    if not await client.exists(lock_key):
+                        break  # The other worker failed or finished without caching
+            except Exception as e:
+                report_redis_error(e)
+            logger.info(f"Single-flight {self.namespace}: no result from another worker, computing it")
+            client = None
+
+        try:
+            self.executed += 1
+            return await fn()
+        finally:
+            if client is not None:
+                try:
+                    await client.eval(_RELEASE_SCRIPT, 1, lock_key, token)
+                except Exception as e:
+                    report_redis_error(e)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._calls),
+            "executed": self.executed,
+            "shared": self.shared,
+            "shared_across_workers": self.shared_across_workers
+        }
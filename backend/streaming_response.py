@@ -0,0 +1,54 @@
+# Réponses en streaming (Server-Sent Events) pour /ask/stream
+import json
+import logging
+from typing import AsyncIterator, List
+
+from database import SessionLocal
+from openai_client import stream_chat_response_async
+from rag_engine import prepare_answer
+
+logger = logging.getLogger(__name__)
+
+def sse_event(event: str, data) -> str:
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def stream_answer_events(question: str, user_id: int, selected_doc_ids: List[int] = None,
+                               agent_type: str = None) -> AsyncIterator[str]:
+    """Stream an answer as SSE: a 'sources' event, 'token' deltas, then 'done' with usage.
+    
+    The generator owns its database session because it outlives the request handler.
+    """
+    db = SessionLocal()
+    try:
+        prepared = await prepare_answer(question, user_id, db, selected_doc_ids, agent_type)
+        
+        # Sources first, as soon as retrieval is done
+        yield sse_event("sources", {"sources": [
+            {
+                "document_id": source['document_id'],
+                "document_name": source['document_name'],
+                "similarity": round(source['similarity'], 4)
+            }
+            for source in prepared.get('sources', [])
+        ]})
+        
+        if 'answer' in prepared:
+            yield sse_event("token", {"delta": prepared['answer']})
+            yield sse_event("done", {"usage": None})
+            return
+        
+        usage = None
+        async for kind, value in stream_chat_response_async(prepared['prompt']):
+            if kind == "delta":
+                yield sse_event("token", {"delta": value})
+            else:
+                usage = value
+        
+        yield sse_event("done", {"usage": usage})
+    
+    except Exception as e:
+        logger.error(f"Error streaming answer for user {user_id}: {e}")
+        yield sse_event("error", {"message": f"Désolé, une erreur s'est produite lors du traitement de votre question. Détails: {str(e)}"})
+    finally:
+        db.close()
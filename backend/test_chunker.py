@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""Chunk offsets must point at the chunk text, and chunks must cover the whole document
+
+Usage: python -m pytest test_chunker.py  (ou python test_chunker.py)
+"""
+import sys
+import os
+
+# Ajouter le répertoire parent au PATH pour les imports
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from file_loader import TokenChunker, iter_token_chunks
+from tokenizer import count_tokens
+
+def sample_document(paragraphs: int = 30) -> str:
+    """Paragraphs of sentences of different lengths, like an extracted report"""
+    text = []
+    for i in range(paragraphs):
+        sentences = [f"Le paragraphe {i} décrit la mesure {j} du rapport annuel." + " Détail" * (j % 7)
+                     for j in range(i % 5 + 2)]
+        text.append(" ".join(sentences))
+    return "\n\n".join(text)
+
+def chunk(text: str, max_tokens: int = 60, overlap_tokens: int = 10):
+    return list(iter_token_chunks([text], max_tokens, overlap_tokens))
+
+def test_offsets_match_text():
+    text = sample_document()
+    chunks = chunk(text)
+    assert len(chunks) > 1
+    for start, end, chunk_text in chunks:
+        assert text[start:end] == chunk_text
+        assert chunk_text == chunk_text.strip()
+
+def test_chunks_cover_document():
+    text = sample_document()
+    chunks = chunk(text)
+    covered = 0
+    for start, end, _ in chunks:
+        assert text[covered:start].strip() == ""  # Nothing but whitespace between two chunks
+        covered = max(covered, end)
+    assert text[covered:].strip() == ""
+
+def test_chunks_within_budget():
+    for start, end, chunk_text in chunk(sample_document(), max_tokens=60):
+        assert count_tokens(chunk_text) <= 60
+
+def test_consecutive_chunks_overlap():
+    chunks = chunk(sample_document(), max_tokens=60, overlap_tokens=20)
+    overlapping = sum(1 for (_, end, _), (start, _, _) in zip(chunks, chunks[1:]) if start < end)
+    assert overlapping > 0
+    for (start, end, _), (next_start, next_end, _) in zip(chunks, chunks[1:]):
+        assert next_start > start and next_end > end
+
+def test_pieces_give_same_chunks():
+    text = sample_document()
+    pieces = [text[i:i + 97] for i in range(0, len(text), 97)]
+    assert list(iter_token_chunks(pieces, 60, 10)) == chunk(text)
+
+def test_oversized_line_is_split():
+    text = " ".join(f"cellule{i}" for i in range(400))  # A table row without punctuation
+    chunks = chunk(text, max_tokens=50, overlap_tokens=0)
+    assert len(chunks) > 1
+    assert " ".join(chunk_text for _, _, chunk_text in chunks) == text
+
+def test_empty_text():
+    chunker = TokenChunker(60, 10)
+    assert list(chunker.feed("  \n\n ")) + list(chunker.finish()) == []
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"✅ {name}")
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""The packed context must stay within its token budget and never repeat the text of overlapping chunks
+
+Usage: python -m pytest test_context_packer.py  (ou python test_context_packer.py)
+"""
+import sys
+import os
+
+# Ajouter le répertoire parent au PATH pour les imports
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from context_packer import pack_context, _new_chars, _Candidate
+from tokenizer import count_tokens
+
+# Distinct sentences, so that chunks only share text where their ranges overlap
+DOCUMENT = " ".join(f"La section {i} fixe le seuil numéro {i * 7} pour le service {i % 13}." for i in range(200))
+
+def result(document_id: int, start: int, end: int, text: str = None) -> dict:
+    return {
+        "text": DOCUMENT[start:end] if text is None else text,
+        "document_id": document_id,
+        "document_name": f"doc{document_id}.txt",
+        "char_start": start,
+        "char_end": end
+    }
+
+def test_budget_respected():
+    results = [result(1, i * 400, i * 400 + 400) for i in range(20)]
+    packed = pack_context(results, budget=500)
+    assert packed.used_tokens <= 500
+    assert packed.over_budget > 0
+    assert packed.used_tokens < packed.retrieved_tokens
+
+def test_best_chunk_kept_over_budget():
+    results = [result(1, 0, 2000), result(1, 4000, 4100)]
+    packed = pack_context(results, budget=10)
+    assert [excerpt.text for excerpt in packed.excerpts] == [DOCUMENT[0:2000]]
+
+def test_overlapping_chunks_merged():
+    results = [result(1, 0, 600), result(1, 500, 1100), result(1, 1100, 1500)]
+    packed = pack_context(results, budget=10_000)
+    assert len(packed.excerpts) == 1
+    excerpt = packed.excerpts[0]
+    assert (excerpt.start, excerpt.end) == (0, 1500)
+    assert excerpt.text == DOCUMENT[0:1500]
+
+def test_chunks_of_other_documents_not_merged():
+    results = [result(1, 0, 600), result(2, 500, 1100)]
+    packed = pack_context(results, budget=10_000)
+    assert [excerpt.document_id for excerpt in packed.excerpts] == [1, 2]
+
+def test_duplicate_passage_dropped():
+    text = DOCUMENT[0:800]
+    results = [result(1, 0, 800), {"text": text, "document_id": 2, "document_name": "copie.txt"}]
+    packed = pack_context(results, budget=10_000)
+    assert packed.duplicates == 1
+    assert len(packed.excerpts) == 1
+
+def test_new_chars_counts_shared_overlap_once():
+    def candidate(start: int, end: int) -> _Candidate:
+        return _Candidate(0, result(1, start, end), count_tokens(DOCUMENT[start:end]), frozenset(), start, end)
+    # [0, 60) and [40, 80) overlap each other: the candidate [0, 100) only has [80, 100) left
+    assert _new_chars(candidate(0, 100), [candidate(0, 60), candidate(40, 80)]) == 20
+    assert _new_chars(candidate(0, 100), [candidate(10, 20), candidate(30, 40)]) == 80
+    assert _new_chars(candidate(0, 100), [candidate(0, 100)]) == 0
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"✅ {name}")
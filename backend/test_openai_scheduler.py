@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""Queued OpenAI calls are granted by priority, and interactive calls give up instead of piling up
+
+Usage: python -m pytest test_openai_scheduler.py  (ou python test_openai_scheduler.py)
+"""
+import sys
+import os
+import asyncio
+
+# Ajouter le répertoire parent au PATH pour les imports
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import openai_scheduler
+from openai_scheduler import OpenAIScheduler, OpenAIBusyError, Priority, parse_duration
+
+MODEL = "text-embedding-3-small"
+
+async def settle():
+    """Let granted calls resume (a grant resolves a future, the caller runs on a later loop iteration)"""
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+async def hold(scheduler: OpenAIScheduler, priority: Priority, order: list, release: asyncio.Event):
+    async with scheduler.slot(priority, MODEL, 10):
+        order.append(priority)
+        await release.wait()
+
+def test_parse_duration():
+    assert parse_duration("20ms") == 0.02
+    assert parse_duration("6m0s") == 360
+    assert parse_duration("1.5s") == 1.5
+    assert parse_duration("") is None
+
+def test_granted_by_priority():
+    async def scenario():
+        scheduler = OpenAIScheduler(max_in_flight=1, interactive_reserve=0)
+        order, release = [], asyncio.Event()
+        first = asyncio.create_task(hold(scheduler, Priority.INGESTION, order, asyncio.Event()))
+        await settle()
+        # Queued while the only slot is taken, in the reverse order of their priority
+        queued = [asyncio.create_task(hold(scheduler, priority, order, release))
+                  for priority in (Priority.BACKGROUND, Priority.INGESTION, Priority.QUERY_EMBEDDING, Priority.CHAT)]
+        await settle()
+        first.cancel()
+        release.set()
+        await asyncio.gather(*queued)
+        return order
+
+    order = asyncio.run(scenario())
+    assert order == [Priority.INGESTION, Priority.CHAT, Priority.QUERY_EMBEDDING, Priority.INGESTION, Priority.BACKGROUND]
+
+def test_reserve_kept_for_interactive_calls():
+    async def scenario():
+        scheduler = OpenAIScheduler(max_in_flight=2, interactive_reserve=1)
+        order, release = [], asyncio.Event()
+        tasks = [asyncio.create_task(hold(scheduler, priority, order, release))
+                 for priority in (Priority.INGESTION, Priority.BACKGROUND, Priority.CHAT)]
+        await settle()
+        granted = list(order)
+        release.set()
+        await asyncio.gather(*tasks)
+        return granted
+
+    assert asyncio.run(scenario()) == [Priority.INGESTION, Priority.CHAT]
+
+def test_interactive_call_times_out():
+    async def scenario():
+        scheduler = OpenAIScheduler(max_in_flight=1, interactive_reserve=0)
+        release = asyncio.Event()
+        busy = asyncio.create_task(hold(scheduler, Priority.INGESTION, [], release))
+        await settle()
+        try:
+            await hold(scheduler, Priority.CHAT, [], release)
+        except OpenAIBusyError:
+            timed_out = True
+        else:
+            timed_out = False
+        # Background calls wait for capacity as long as it takes
+        background = asyncio.create_task(hold(scheduler, Priority.BACKGROUND, [], release))
+        await asyncio.sleep(0.1)
+        waiting = not background.done()
+        release.set()
+        await asyncio.gather(busy, background)
+        return timed_out, waiting, scheduler.stats()
+
+    previous = openai_scheduler.OPENAI_QUEUE_TIMEOUT
+    openai_scheduler.OPENAI_QUEUE_TIMEOUT = 0.05
+    try:
+        timed_out, waiting, stats = asyncio.run(scenario())
+    finally:
+        openai_scheduler.OPENAI_QUEUE_TIMEOUT = previous
+    assert timed_out and waiting
+    assert stats["timeouts"] == 1
+    assert stats["granted"]["background"] == 1
+    assert sum(stats["in_flight"].values()) == 0
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"✅ {name}")
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""Questions that differ only by a number or a quoted term must not share a cached answer
+
+Usage: python -m pytest test_semantic_cache.py  (ou python test_semantic_cache.py)
+"""
+import sys
+import os
+
+import numpy as np
+
+# Ajouter le répertoire parent au PATH pour les imports
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from semantic_cache import SemanticAnswerCache, key_terms
+
+def near_duplicate_embeddings(seed: int = 0):
+    """Two embeddings with a cosine similarity above 0.99, like reworded questions"""
+    rng = np.random.default_rng(seed)
+    base = rng.standard_normal(1536).astype(np.float32)
+    return base, base + 0.05 * rng.standard_normal(1536).astype(np.float32)
+
+def new_cache() -> SemanticAnswerCache:
+    return SemanticAnswerCache(threshold=0.95, ttl=3600, max_scopes=10, max_entries=10)
+
+def test_key_terms():
+    assert key_terms("Quel est le budget 2024 ?") == {"2024"}
+    assert key_terms('Que dit la clause « Force majeure » ?') == {"force majeure"}
+    assert key_terms("Quel est le budget ?") == frozenset()
+
+def test_different_numbers_miss():
+    cache = new_cache()
+    first, second = near_duplicate_embeddings()
+    cache.set("scope", "v1", first, "Quel est le budget 2023 ?", "Le budget 2023 est de 10 M€.")
+    assert cache.get("scope", "v1", second, "Quel est le budget 2024 ?") is None
+    assert cache.get("scope", "v1", second, "Que dit l'article 12 ?") is None
+
+def test_different_quoted_terms_miss():
+    cache = new_cache()
+    first, second = near_duplicate_embeddings()
+    cache.set("scope", "v1", first, 'Que dit la clause "résiliation" ?', "La résiliation est possible avec un préavis.")
+    assert cache.get("scope", "v1", second, 'Que dit la clause "confidentialité" ?') is None
+
+def test_rewording_hits():
+    cache = new_cache()
+    first, second = near_duplicate_embeddings()
+    cache.set("scope", "v1", first, "Quel est le budget 2024 ?", "Le budget 2024 est de 12 M€.")
+    assert cache.get("scope", "v1", second, "Quel budget est prévu pour 2024 ?") == "Le budget 2024 est de 12 M€."
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"✅ {name}")
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""Concurrent identical calls must run once and share the result, or the error
+
+Usage: python -m pytest test_single_flight.py  (ou python test_single_flight.py)
+"""
+import sys
+import os
+import asyncio
+
+# Ajouter le répertoire parent au PATH pour les imports
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from single_flight import SingleFlight
+
+def test_concurrent_calls_share_one_execution():
+    async def scenario():
+        flights, calls = SingleFlight("test"), []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "réponse"
+
+        results = await asyncio.gather(*(flights.do("question", compute) for _ in range(5)))
+        return results, calls, flights.stats()
+
+    results, calls, stats = asyncio.run(scenario())
+    assert results == ["réponse"] * 5
+    assert len(calls) == 1
+    assert stats == {"in_flight": 0, "executed": 1, "shared": 4, "shared_across_workers": 0}
+
+def test_different_keys_run_separately():
+    async def scenario():
+        flights = SingleFlight("test")
+
+        async def compute(value):
+            await asyncio.sleep(0.01)
+            return value
+
+        return await asyncio.gather(flights.do("a", lambda: compute(1)), flights.do("b", lambda: compute(2))), flights.executed
+
+    assert asyncio.run(scenario()) == ([1, 2], 2)
+
+def test_error_shared_with_waiters():
+    async def scenario():
+        flights = SingleFlight("test")
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError("upload illisible")
+
+        return await asyncio.gather(*(flights.do("upload", fail) for _ in range(3)), return_exceptions=True), flights
+
+    results, flights = asyncio.run(scenario())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert flights.executed == 1 and flights.stats()["in_flight"] == 0
+
+def test_cancelled_first_caller_does_not_cancel_waiters():
+    async def scenario():
+        flights = SingleFlight("test")
+
+        async def compute():
+            await asyncio.sleep(0.05)
+            return "réponse"
+
+        first = asyncio.create_task(flights.do("question", compute))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(flights.do("question", compute))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second, flights.executed
+
+    assert asyncio.run(scenario()) == ("réponse", 2)
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"✅ {name}")
@@ -0,0 +1,25 @@
+# Comptage de tokens pour dimensionner les lots d'embeddings et les prompts
+import logging
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken est optionnel, on retombe sur une estimation
+    tiktoken = None
+
+@lru_cache(maxsize=4)
+def _get_encoding(name: str):
+    try:
+        return tiktoken.get_encoding(name)
+    except Exception as e:
+        logger.warning(f"Could not load tiktoken encoding {name}, estimating token counts: {e}")
+        return None
+
+def count_tokens(text: str, encoding_name: str = "cl100k_base") -> int:
+    """Count tokens with tiktoken when available, otherwise estimate ~4 characters per token"""
+    encoding = _get_encoding(encoding_name) if tiktoken else None
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
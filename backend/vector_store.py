@@ -1,16 +1,551 @@
+# Index vectoriel persistant, un index FAISS par partition (utilisateur, agent)
+import glob
+import json
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple, Union
+
 import faiss
 import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from database import Document, DocumentChunk
+from embedding_codec import unpack_embedding, has_embedding, embedding_model_column
+
+logger = logging.getLogger(__name__)
+
+dimension = int(os.getenv("OPENAI_EMBEDDING_DIMENSIONS", "1536"))  # taille embeddings OpenAI
+
+INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", "/tmp/vector_indexes")
+HNSW_M = int(os.getenv("VECTOR_INDEX_HNSW_M", "32"))
+HNSW_EF_SEARCH = int(os.getenv("VECTOR_INDEX_EF_SEARCH", "64"))
+# "hnsw" (approximate, sub-linear), "flat" (exact normalized matrix scan), both in-process,
+# or "pgvector" (top-k computed by Postgres, see pgvector_store.py)
+INDEX_BACKEND = os.getenv("VECTOR_INDEX_BACKEND", "hnsw")
+# Below this many candidate chunks a filtered search is scored exactly
+EXACT_SEARCH_THRESHOLD = int(os.getenv("VECTOR_INDEX_EXACT_THRESHOLD", "2048"))
+# Compact the HNSW graph once this fraction of its vectors are tombstoned
+REBUILD_RATIO = 0.25
+# Seconds during which a user's partitions are trusted without re-checking the database
+SYNC_INTERVAL = float(os.getenv("VECTOR_INDEX_SYNC_INTERVAL", "2"))
+# Changed partitions are written to disk at most once per this many seconds; after a crash,
+# sync() catches up from the saved watermark with what the database has
+SAVE_DELAY = float(os.getenv("VECTOR_INDEX_SAVE_DELAY", "5"))
+
+def _normalize_rows(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """L2-normalize rows in place, returns (vectors, mask of non-zero rows)"""
+    norms = np.linalg.norm(vectors, axis=1)
+    keep = norms > 0
+    vectors[keep] /= norms[keep, None]
+    return vectors, keep
+
+def _as_matrix(embeddings, rows: int, name: str) -> np.ndarray:
+    """Copy embeddings into a float32 matrix; vectors of the wrong size become zero rows"""
+    if isinstance(embeddings, np.ndarray) and embeddings.shape == (rows, dimension):
+        return np.array(embeddings, dtype="float32")
+    vectors = np.zeros((rows, dimension), dtype="float32")
+    wrong_size = 0
+    for row, embedding in enumerate(embeddings):
+        if len(embedding) == dimension:
+            vectors[row] = embedding
+        else:
+            wrong_size += 1
+    if wrong_size:
+        logger.warning(f"Skipping {wrong_size} vectors whose size is not {dimension} in {name}")
+    return vectors
+
+class TenantIndex:
+    """Vectors of the chunks of one (user, agent, embedding model) partition, plus the chunk -> document map.
+
+    Vectors are L2-normalized once when they enter the index, so a query is
+    a plain inner product. Subclasses decide how the vectors are stored and searched.
+    """
+
+    suffix = ""
+
+    def __init__(self, user_id: int, agent_id: Optional[int], model: str):
+        self.user_id = user_id
+        self.agent_id = agent_id
+        self.model = model
+        self.chunk_docs: Dict[int, int] = {}  # chunk_id -> document_id
+        self.skipped: Dict[int, int] = {}  # zero (dummy) or wrong-size vectors, counted but not indexed
+        # Latest embedded_at reflected by the index, for incremental sync
+        self.watermark: Optional[datetime] = None
+        self.dropped = False  # Agent deleted: a pending save must not write the files back
+        self.lock = threading.RLock()
+        self._reset_vectors()
+
+    @property
+    def path(self) -> str:
+        return os.path.join(INDEX_DIR, partition_prefix(self.user_id, self.agent_id) + _slug(self.model))
+
+    @property
+    def row_count(self) -> int:
+        return len(self.chunk_docs) + len(self.skipped)
+
+    def add(self, chunk_ids: List[int], document_ids: List[int], embeddings: List[List[float]],
+            embedded_at: Optional[datetime] = None):
+        """Add or replace chunk embeddings; zero vectors (failed embeddings) are skipped"""
+        with self.lock:
+            if embedded_at is not None and (self.watermark is None or embedded_at > self.watermark):
+                self.watermark = embedded_at
+            if not chunk_ids:
+                return
+            self.remove_chunks([cid for cid in chunk_ids if cid in self.chunk_docs or cid in self.skipped])
+
+            vectors = _as_matrix(embeddings, len(chunk_ids), self.path)
+            vectors, keep = _normalize_rows(vectors)
+            ids = np.asarray(chunk_ids, dtype="int64")
+            if keep.any():
+                self._add_vectors(ids[keep], vectors[keep])
+            for chunk_id, document_id, indexed in zip(chunk_ids, document_ids, keep.tolist()):
+                (self.chunk_docs if indexed else self.skipped)[chunk_id] = document_id
+
+    def remove_chunks(self, chunk_ids: List[int]):
+        """Remove chunks from the partition"""
+        with self.lock:
+            indexed = [cid for cid in chunk_ids if self.chunk_docs.pop(cid, None) is not None]
+            for chunk_id in chunk_ids:
+                self.skipped.pop(chunk_id, None)
+            if indexed:
+                self._remove_vectors(indexed)
+
+    def remove_document(self, document_id: int):
+        """Remove every chunk of a document"""
+        with self.lock:
+            self.remove_chunks([cid for cid, did in list(self.chunk_docs.items()) + list(self.skipped.items()) if did == document_id])
+
+    def search(self, query: np.ndarray, top_k: int, document_ids: Optional[set] = None) -> List[Tuple[int, float]]:
+        """Return up to top_k (chunk_id, cosine similarity) pairs"""
+        with self.lock:
+            if not self.chunk_docs:
+                return []
+            allowed = None
+            if document_ids is not None:
+                allowed = [cid for cid, did in self.chunk_docs.items() if did in document_ids]
+                if not allowed:
+                    return []
+            return self._search(query, min(top_k, len(self.chunk_docs)), allowed)
+
+    def save(self):
+        """Persist vectors and metadata atomically"""
+        with self.lock:
+            os.makedirs(INDEX_DIR, exist_ok=True)
+            self._save_vectors(self.path + self.suffix + ".tmp")
+            with open(self.path + ".json.tmp", "w") as f:
+                json.dump({
+                    "chunk_docs": self.chunk_docs,
+                    "skipped": self.skipped,
+                    "watermark": self.watermark.isoformat() if self.watermark else None,
+                    **self._extra_meta()
+                }, f)
+            os.replace(self.path + self.suffix + ".tmp", self.path + self.suffix)
+            os.replace(self.path + ".json.tmp", self.path + ".json")
+
+    def load(self) -> bool:
+        """Load a persisted index, returns False if none exists"""
+        if not (os.path.exists(self.path + self.suffix) and os.path.exists(self.path + ".json")):
+            return False
+        with self.lock:
+            try:
+                with open(self.path + ".json") as f:
+                    meta = json.load(f)
+                self._load_vectors(self.path + self.suffix, meta)
+            except Exception as e:
+                logger.warning(f"Could not load vector index {self.path}: {e}")
+                self._reset_vectors()
+                return False
+            self.chunk_docs = {int(k): v for k, v in meta["chunk_docs"].items()}
+            self.skipped = {int(k): v for k, v in meta["skipped"].items()}
+            self.watermark = datetime.fromisoformat(meta["watermark"]) if meta["watermark"] else None
+        return True
+
+    def delete_files(self):
+        for suffix in (self.suffix, ".json"):
+            if os.path.exists(self.path + suffix):
+                os.unlink(self.path + suffix)
+
+    def _partition_query(self, db: Session, *columns):
+        return db.query(*columns).join(Document, DocumentChunk.document_id == Document.id).filter(
+            Document.user_id == self.user_id,
+            Document.agent_id == self.agent_id if self.agent_id is not None else Document.agent_id.is_(None),
+            embedding_model_column() == self.model,
+            has_embedding()
+        )
+
+    def _load_rows(self, query):
+        """Stream (id, document_id, vector, embedded_at) rows into the index"""
+        batch_ids, batch_docs, batch_vectors = [], [], []
+        for chunk_id, document_id, packed, legacy_json, embedded_at in query.yield_per(1000):
+            batch_ids.append(chunk_id)
+            batch_docs.append(document_id)
+            batch_vectors.append(unpack_embedding(packed, legacy_json))
+            if embedded_at is not None and (self.watermark is None or embedded_at > self.watermark):
+                self.watermark = embedded_at
+            if len(batch_ids) >= 1000:
+                self.add(batch_ids, batch_docs, batch_vectors)
+                batch_ids, batch_docs, batch_vectors = [], [], []
+        self.add(batch_ids, batch_docs, batch_vectors)
+
+    def _row_columns(self):
+        return (DocumentChunk.id, DocumentChunk.document_id, DocumentChunk.embedding_f32,
+                DocumentChunk.embedding, DocumentChunk.embedded_at)
+
+    def rebuild(self, db: Session):
+        """Rebuild the partition from the document_chunks table"""
+        with self.lock:
+            self._reset_vectors()
+            self.chunk_docs = {}
+            self.skipped = {}
+            self.watermark = None
+            self._load_rows(self._partition_query(db, *self._row_columns()))
+        logger.info(f"Rebuilt vector index {self.path} ({len(self.chunk_docs)} vectors)")
+
+    def sync(self, db: Session, db_count: int, db_watermark: Optional[datetime]) -> bool:
+        """Bring the partition up to date with the database, incrementally when possible.
+
+        Rows embedded after the watermark are fetched first (new uploads and
+        re-embedded chunks); if counts still differ, chunk ids are reconciled
+        and only the missing vectors are fetched. Returns True if anything changed.
+        """
+        with self.lock:
+            if self.row_count == db_count and self.watermark == db_watermark:
+                return False
+            if self.row_count == 0:
+                self.rebuild(db)
+                return True
+
+            if self.watermark is not None:
+                self._load_rows(self._partition_query(db, *self._row_columns()).filter(
+                    DocumentChunk.embedded_at > self.watermark
+                ))
+            if self.row_count != db_count:
+                db_ids = {chunk_id for (chunk_id,) in self._partition_query(db, DocumentChunk.id)}
+                known = set(self.chunk_docs) | set(self.skipped)
+                self.remove_chunks(list(known - db_ids))
+                missing = list(db_ids - known)
+                for start in range(0, len(missing), 1000):
+                    self._load_rows(self._partition_query(db, *self._row_columns()).filter(
+                        DocumentChunk.id.in_(missing[start:start + 1000])
+                    ))
+            self.watermark = db_watermark
+        logger.info(f"Synced vector index {self.path} ({len(self.chunk_docs)} vectors)")
+        return True
+
+    # Storage hooks implemented by subclasses
+    def _reset_vectors(self):
+        raise NotImplementedError
+
+    def _add_vectors(self, ids: np.ndarray, vectors: np.ndarray):
+        raise NotImplementedError
+
+    def _remove_vectors(self, chunk_ids: List[int]):
+        raise NotImplementedError
+
+    def _search(self, query: np.ndarray, k: int, allowed: Optional[List[int]]) -> List[Tuple[int, float]]:
+        raise NotImplementedError
+
+    def _save_vectors(self, path: str):
+        raise NotImplementedError
+
+    def _load_vectors(self, path: str, meta: dict):
+        raise NotImplementedError
+
+    def _extra_meta(self) -> dict:
+        return {}
+
+class HNSWTenantIndex(TenantIndex):
+    """Approximate search over a FAISS HNSW inner-product graph.
+
+    FAISS ids are DocumentChunk ids. HNSW cannot remove vectors, so deleted
+    chunks are tombstoned and excluded at search time until the next compaction.
+    """
+
+    suffix = ".faiss"
+
+    def _reset_vectors(self):
+        hnsw = faiss.IndexHNSWFlat(dimension, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        self.index = faiss.IndexIDMap2(hnsw)
+        self.deleted = set()
+
+    def _add_vectors(self, ids: np.ndarray, vectors: np.ndarray):
+        readded = self.deleted.intersection(ids.tolist())
+        self.index.add_with_ids(vectors, ids)
+        if readded:
+            # A tombstoned id is back (re-embedded chunk): the old vector must go
+            self.deleted -= readded
+            self._compact()
+
+    def _remove_vectors(self, chunk_ids: List[int]):
+        self.deleted.update(chunk_ids)
+        if len(self.deleted) > REBUILD_RATIO * self.index.ntotal:
+            self._compact()
+
+    def _compact(self):
+        """Rebuild the graph from live vectors to drop tombstones"""
+        live_ids = np.fromiter(self.chunk_docs.keys(), dtype="int64", count=len(self.chunk_docs))
+        vectors = [self.index.reconstruct(int(cid)) for cid in live_ids]
+        self._reset_vectors()
+        if len(live_ids):
+            self.index.add_with_ids(np.vstack(vectors).astype("float32"), live_ids)
+        logger.info(f"Compacted vector index {self.path} ({len(live_ids)} vectors)")
+
+    def _search(self, query: np.ndarray, k: int, allowed: Optional[List[int]]) -> List[Tuple[int, float]]:
+        if allowed is not None:
+            if len(allowed) <= EXACT_SEARCH_THRESHOLD:
+                return self._exact_search(query, k, allowed)
+            selector = faiss.IDSelectorBatch(np.asarray(allowed, dtype="int64"))
+        elif self.deleted:
+            selector = faiss.IDSelectorNot(faiss.IDSelectorBatch(np.fromiter(self.deleted, dtype="int64")))
+        else:
+            selector = None
+
+        params = faiss.SearchParametersHNSW(efSearch=max(HNSW_EF_SEARCH, k))
+        if selector is not None:
+            params.sel = selector
+        scores, ids = self.index.search(query.reshape(1, -1), k, params=params)
+        return [(int(cid), float(score)) for cid, score in zip(ids[0], scores[0]) if cid != -1]
+
+    def _exact_search(self, query: np.ndarray, k: int, chunk_ids: List[int]) -> List[Tuple[int, float]]:
+        vectors = np.vstack([self.index.reconstruct(cid) for cid in chunk_ids])
+        scores = vectors @ query
+        order = np.argsort(-scores)[:k]
+        return [(chunk_ids[i], float(scores[i])) for i in order]
+
+    def _save_vectors(self, path: str):
+        faiss.write_index(self.index, path)
+
+    def _load_vectors(self, path: str, meta: dict):
+        self.index = faiss.read_index(path)
+        self.deleted = set(meta.get("deleted", []))
+
+    def _extra_meta(self) -> dict:
+        return {"deleted": list(self.deleted)}
+
+class FlatTenantIndex(TenantIndex):
+    """Exact search over one contiguous normalized float32 matrix.
+
+    A query is a single matrix-vector product followed by an argpartition
+    top-k, with no per-chunk Python work.
+    """
+
+    suffix = ".npz"
+
+    def _reset_vectors(self):
+        self.vectors = np.empty((0, dimension), dtype="float32")
+        self.ids = np.empty(0, dtype="int64")
+        self.size = 0
+
+    def _add_vectors(self, ids: np.ndarray, vectors: np.ndarray):
+        needed = self.size + len(ids)
+        if needed > len(self.ids):
+            # Grow geometrically so incremental uploads stay amortized O(1) per vector
+            capacity = max(needed, 2 * len(self.ids), 1024)
+            grown_vectors = np.empty((capacity, dimension), dtype="float32")
+            grown_vectors[:self.size] = self.vectors[:self.size]
+            grown_ids = np.empty(capacity, dtype="int64")
+            grown_ids[:self.size] = self.ids[:self.size]
+            self.vectors, self.ids = grown_vectors, grown_ids
+        self.vectors[self.size:needed] = vectors
+        self.ids[self.size:needed] = ids
+        self.size = needed
+
+    def _remove_vectors(self, chunk_ids: List[int]):
+        keep = ~np.isin(self.ids[:self.size], np.asarray(chunk_ids, dtype="int64"))
+        live = int(keep.sum())
+        self.vectors[:live] = self.vectors[:self.size][keep]
+        self.ids[:live] = self.ids[:self.size][keep]
+        self.size = live
+
+    def _search(self, query: np.ndarray, k: int, allowed: Optional[List[int]]) -> List[Tuple[int, float]]:
+        ids = self.ids[:self.size]
+        scores = self.vectors[:self.size] @ query
+        if allowed is not None:
+            mask = np.isin(ids, np.asarray(allowed, dtype="int64"))
+            ids, scores = ids[mask], scores[mask]
+            k = min(k, len(ids))
+            if k == 0:
+                return []
+        top = top_k_indices(scores, k)
+        return [(int(ids[i]), float(scores[i])) for i in top]
+
+    def _save_vectors(self, path: str):
+        with open(path, "wb") as f:
+            np.savez(f, vectors=self.vectors[:self.size], ids=self.ids[:self.size])
+
+    def _load_vectors(self, path: str, meta: dict):
+        with np.load(path) as data:
+            self.vectors = np.ascontiguousarray(data["vectors"], dtype="float32")
+            self.ids = data["ids"].astype("int64")
+        self.size = len(self.ids)
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first, in O(n + k log k)"""
+    if k >= len(scores):
+        return np.argsort(-scores)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+INDEX_BACKENDS = {
+    "hnsw": HNSWTenantIndex,
+    "flat": FlatTenantIndex
+}
+
+def _slug(model: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", model)
+
+def partition_prefix(user_id: int, agent_id: Optional[int]) -> str:
+    agent = agent_id if agent_id is not None else "none"
+    return f"user_{user_id}_agent_{agent}_"
+
+class VectorIndexManager:
+    """Keeps one TenantIndex per (user_id, agent_id, embedding model) partition in memory and on disk.
+
+    During an embedding model migration (see reembed.py) a user has one partition
+    per model; each is searched with a query embedded by its own model.
+    """
+
+    def __init__(self, backend: str = INDEX_BACKEND):
+        self._index_class = INDEX_BACKENDS[backend]
+        self._indexes: Dict[Tuple[int, Optional[int], str], TenantIndex] = {}
+        self._synced: Dict[Tuple[int, object], Tuple[float, List[TenantIndex]]] = {}
+        self._dirty: List[TenantIndex] = []  # Changed since their last save
+        self._save_timer: Optional[threading.Timer] = None
+        self._lock = threading.Lock()
+
+    def _get(self, user_id: int, agent_id: Optional[int], model: str) -> TenantIndex:
+        key = (user_id, agent_id, model)
+        with self._lock:
+            tenant = self._indexes.get(key)
+            if tenant is None:
+                tenant = self._index_class(user_id, agent_id, model)
+                tenant.load()
+                self._indexes[key] = tenant
+            return tenant
+
+    def _loaded(self, user_id: int, agent_id: Optional[int]) -> List[TenantIndex]:
+        with self._lock:
+            return [t for (u, a, _), t in self._indexes.items() if u == user_id and a == agent_id]
+
+    def _invalidate(self, user_id: int):
+        with self._lock:
+            for key in [key for key in self._synced if key[0] == user_id]:
+                del self._synced[key]
+
+    def _schedule_save(self, tenant: TenantIndex):
+        """Save the partition within SAVE_DELAY seconds, together with the others changed meanwhile"""
+        with self._lock:
+            if tenant not in self._dirty:
+                self._dirty.append(tenant)
+            if self._save_timer is None:
+                self._save_timer = threading.Timer(SAVE_DELAY, self.flush)
+                self._save_timer.daemon = True
+                self._save_timer.start()
+
+    def flush(self):
+        """Write every changed partition to disk now (also called on shutdown)"""
+        with self._lock:
+            tenants, self._dirty = self._dirty, []
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+        for tenant in tenants:
+            with tenant.lock:
+                if not tenant.dropped:
+                    try:
+                        tenant.save()
+                    except Exception as e:
+                        logger.error(f"Could not save vector index {tenant.path}: {e}")
+
+    def _sync_user(self, db: Session, user_id: int, agent_id=...) -> List[TenantIndex]:
+        """Return the user's partitions, syncing any that are out of date with the database"""
+        cache_key = (user_id, agent_id)
+        cached = self._synced.get(cache_key)
+        if cached and time.monotonic() - cached[0] < SYNC_INTERVAL:
+            return cached[1]
+
+        model = embedding_model_column()
+        query = db.query(
+            Document.agent_id, model, func.count(DocumentChunk.id), func.max(DocumentChunk.embedded_at)
+        ).join(DocumentChunk, DocumentChunk.document_id == Document.id).filter(
+            Document.user_id == user_id,
+            has_embedding()
+        )
+        if agent_id is not ...:
+            query = query.filter(Document.agent_id == agent_id if agent_id is not None else Document.agent_id.is_(None))
+        stats = query.group_by(Document.agent_id, model).all()
+
+        tenants = []
+        for partition_agent_id, partition_model, row_count, watermark in stats:
+            tenant = self._get(user_id, partition_agent_id, partition_model)
+            if tenant.sync(db, row_count, watermark):
+                self._schedule_save(tenant)
+            tenants.append(tenant)
+        self._synced[cache_key] = (time.monotonic(), tenants)
+        return tenants
+
+    def embedding_models(self, db: Session, user_id: int, agent_id=...) -> List[str]:
+        """Embedding models present in the user's index (more than one during a model migration)"""
+        return sorted({tenant.model for tenant in self._sync_user(db, user_id, agent_id) if tenant.chunk_docs})
+
+    def search(self, db: Session, query_embedding: Union[List[float], Dict[str, List[float]]], user_id: int,
+               top_k: int = 3, selected_doc_ids: List[int] = None, agent_id=...) -> List[Tuple[int, float]]:
+        """Top-k (chunk_id, similarity) across the user's partitions, or a single agent's.
+
+        query_embedding is either one vector, or a {model: vector} mapping so each
+        partition is searched with a query from the model that produced it.
+        """
+        document_ids = set(selected_doc_ids) if selected_doc_ids else None
+
+        hits = []
+        for tenant in self._sync_user(db, user_id, agent_id):
+            embedding = query_embedding.get(tenant.model) if isinstance(query_embedding, dict) else query_embedding
+            if embedding is None:
+                continue
+            query = np.asarray(embedding, dtype="float32")
+            norm = np.linalg.norm(query)
+            if norm == 0 or len(query) != dimension:
+                continue
+            hits.extend(tenant.search(query / norm, top_k, document_ids))
+        hits.sort(key=lambda hit: hit[1], reverse=True)
+        return hits[:top_k]
+
+    def add_document(self, user_id: int, agent_id: Optional[int], document_id: int, chunk_ids: List[int],
+                     embeddings: List[List[float]], model: str, embedded_at: Optional[datetime] = None):
+        """Incrementally index the embedded chunks of a newly stored document"""
+        tenant = self._get(user_id, agent_id, model)
+        tenant.add(chunk_ids, [document_id] * len(chunk_ids), embeddings, embedded_at)
+        self._schedule_save(tenant)
+        self._invalidate(user_id)
 
-# Stocke embeddings localement dans un index FAISS
-dimension = 1536  # taille embeddings OpenAI
+    def remove_document(self, user_id: int, agent_id: Optional[int], document_id: int):
+        """Drop a deleted document's chunks from the loaded partitions (others reconcile on next sync)"""
+        for tenant in self._loaded(user_id, agent_id):
+            tenant.remove_document(document_id)
+            self._schedule_save(tenant)
+        self._invalidate(user_id)
 
-index = faiss.IndexFlatL2(dimension)
-texts = []  # Liste parallèle des docs
+    def drop_partition(self, user_id: int, agent_id: Optional[int]):
+        """Forget all partitions of an agent (agent deleted)"""
+        with self._lock:
+            dropped = [self._indexes.pop(key) for key in [key for key in self._indexes if key[:2] == (user_id, agent_id)]]
+        for tenant in dropped:
+            with tenant.lock:
+                tenant.dropped = True
+        for path in glob.glob(os.path.join(INDEX_DIR, partition_prefix(user_id, agent_id) + "*")):
+            os.unlink(path)
+        self._invalidate(user_id)
 
-def add_to_index(embedding, text):
-    index.add(np.array([embedding]).astype("float32"))
-    texts.append(text)
+def create_vector_index(backend: str = INDEX_BACKEND):
+    if backend == "pgvector":
+        from pgvector_store import PgVectorIndex
+        return PgVectorIndex(dimension)
+    return VectorIndexManager(backend)
 
-def search_similar_texts(query_embedding, top_k=3):
-    D, I = index.search(np.array([query_embedding]).astype("float32"), top_k)
-    return [texts[i] for i in I[0] if i != -1]
+# Instance globale partagée par le moteur RAG et l'API
+vector_index = create_vector_index()
@@ -386,7 +386,7 @@ export default function Dashboard() {
             <input
               type="file"
               className="hidden"
-              accept=".pdf,.txt,.docx"
+              accept=".pdf,.txt,.docx,.md,.csv"
               onChange={handleFileUpload}
               disabled={uploadLoading}
             />